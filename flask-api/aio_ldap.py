@@ -0,0 +1,347 @@
+"""
+asyncio LDAP client for the ASGI gateway
+Runs ldap3's ASYNC strategy, which pipelines requests over one socket and
+collects responses on a receiver thread, and resolves an asyncio future per
+message id so many directory calls overlap on a handful of connections
+"""
+
+import asyncio
+import logging
+import math
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import ldap3
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPException, LDAPSessionTerminatedByServerError
+from prometheus_client import Gauge
+
+from ldap_search import PAGED_RESULTS_OID, entry_to_dict
+from read_router import ReplicaUnavailable, ldap_read_hedged_total, ldap_read_requests_total
+from replication import csns_by_server
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+ldap_aio_connections = Gauge(
+    'ldap_aio_connections',
+    'Open pipelined connections held by the asyncio LDAP pool',
+    ['pool']
+)
+ldap_aio_in_flight = Gauge(
+    'ldap_aio_in_flight',
+    'Requests using asyncio LDAP connections',
+    ['pool']
+)
+
+# Waiter placeholder for a cancelled request whose response is still due
+_ABANDONED = object()
+
+
+class AsyncLDAPConnection:
+    """One bound ASYNC-strategy connection; any number of requests may be
+    in flight on it at once"""
+
+    def __init__(self, server: ldap3.Server, bind_dn: str, bind_password: str, timeout: float):
+        self.conn = ldap3.Connection(server, user=bind_dn, password=bind_password,
+                                     client_strategy=ldap3.ASYNC, receive_timeout=math.ceil(timeout))
+        self.timeout = timeout
+        self.in_flight = 0
+        self.broken = False
+        self._loop = None
+        self._waiters = {}
+
+    async def open(self) -> bool:
+        """Connect and bind; ldap3 binds synchronously, so off the event loop"""
+        self._loop = asyncio.get_running_loop()
+        strategy = self.conn.strategy
+        set_event, close = strategy.set_event_for_message, strategy.close
+
+        # Both run on the receiver thread: hand the news to the event loop.
+        # ldap3 has no public hook for this; tests/test_ldap3_internals.py
+        # checks the receiver still calls them
+        def set_event_for_message(message_id):
+            set_event(message_id)
+            self._notify(self._wake, message_id)
+
+        def close_strategy():
+            close()
+            self._notify(self._fail_all)
+
+        strategy.set_event_for_message = set_event_for_message
+        strategy.close = close_strategy
+        return await asyncio.to_thread(self.conn.bind, read_server_info=self.conn.server.info is None)
+
+    def _notify(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # event loop already closed
+
+    def _wake(self, message_id: int):
+        waiter = self._waiters.pop(message_id, None)
+        if waiter is _ABANDONED:
+            self._collect(message_id)
+        elif waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _fail_all(self):
+        self.broken = True
+        waiters, self._waiters = self._waiters, {}
+        for waiter in waiters.values():
+            if waiter is not _ABANDONED and not waiter.done():
+                waiter.set_exception(LDAPSessionTerminatedByServerError('LDAP connection closed'))
+
+    def _collect(self, message_id: int) -> Tuple[List[Dict], Dict]:
+        """(response, result) of a completed message, removed from the strategy"""
+        return self.conn.strategy.get_response(message_id, timeout=0)
+
+    async def _request(self, send: Callable[[ldap3.Connection], int]) -> Tuple[List[Dict], Dict]:
+        """Send a request with send(conn), which returns its message id, and
+        await the response without holding a thread"""
+        if self.broken or self.conn.closed:
+            raise LDAPSessionTerminatedByServerError('LDAP connection closed')
+        message_id = send(self.conn)
+        # The receiver thread can only wake us through the loop, so the
+        # waiter is always registered before its wake-up runs
+        waiter = self._loop.create_future()
+        self._waiters[message_id] = waiter
+        self.in_flight += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.broken = True
+            self._waiters.pop(message_id, None)
+            raise LDAPSessionTerminatedByServerError(f'No response within {self.timeout}s')
+        except asyncio.CancelledError:
+            if self._waiters.get(message_id) is waiter:
+                self._waiters[message_id] = _ABANDONED
+            raise
+        finally:
+            self.in_flight -= 1
+        return self._collect(message_id)
+
+    async def search(self, base_dn: str, search_filter: str, search_scope=ldap3.SUBTREE,
+                     attributes=None, size_limit: int = 0, paged_size: Optional[int] = None,
+                     paged_cookie: Optional[bytes] = None, controls=None) -> Tuple[List[Dict], Dict]:
+        return await self._request(lambda conn: conn.search(
+            base_dn, search_filter, search_scope, attributes=attributes, size_limit=size_limit,
+            paged_size=paged_size, paged_cookie=paged_cookie, controls=controls))
+
+    async def add(self, dn: str, attributes: Dict, controls=None) -> Dict:
+        _, result = await self._request(lambda conn: conn.add(dn, attributes=attributes, controls=controls))
+        return result
+
+    async def modify(self, dn: str, changes: Dict, controls=None) -> Dict:
+        _, result = await self._request(lambda conn: conn.modify(dn, changes, controls=controls))
+        return result
+
+    async def delete(self, dn: str, controls=None) -> Dict:
+        _, result = await self._request(lambda conn: conn.delete(dn, controls=controls))
+        return result
+
+    def close(self):
+        self.broken = True
+        try:
+            self.conn.unbind()
+        except Exception:
+            pass
+
+
+class AsyncLDAPPool:
+    """A few pipelined connections to one server, opened on demand and
+    replaced when they break. Requests share connections instead of
+    checking them out, so size is a socket count, not a concurrency cap."""
+
+    def __init__(self, name: str, uri: str, bind_dn: str, bind_password: str,
+                 size: int = 2, timeout: float = 5.0, get_info=ldap3.ALL):
+        self.name = name
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = size
+        self.timeout = timeout
+        self.server = ldap3.Server(uri, get_info=get_info, connect_timeout=timeout)
+        self._connections: List[AsyncLDAPConnection] = []
+        self._open_lock = None
+        self._loop = None
+
+    async def _open(self) -> Optional[AsyncLDAPConnection]:
+        conn = AsyncLDAPConnection(self.server, self.bind_dn, self.bind_password, self.timeout)
+        try:
+            if await conn.open():
+                return conn
+            logger.error(f"LDAP pool {self.name}: bind failed: {conn.conn.result}")
+        except LDAPException as e:
+            logger.error(f"LDAP pool {self.name}: connection error: {e}")
+        conn.close()
+        return None
+
+    async def acquire(self) -> Optional[AsyncLDAPConnection]:
+        """Least busy open connection, opening another while there is room
+        and every open one has requests in flight; None if none can be opened"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Connections deliver responses to the loop that opened them
+            self.close()
+            self._loop, self._open_lock = loop, asyncio.Lock()
+        for conn in [c for c in self._connections if c.broken or c.conn.closed]:
+            self._connections.remove(conn)
+            conn.close()
+        idle = [c for c in self._connections if c.in_flight == 0]
+        if idle or len(self._connections) >= self.size:
+            conn = idle[0] if idle else min(self._connections, key=lambda c: c.in_flight)
+        else:
+            async with self._open_lock:
+                conn = await self._open() if len(self._connections) < self.size else None
+                if conn is not None:
+                    self._connections.append(conn)
+                elif self._connections:
+                    conn = min(self._connections, key=lambda c: c.in_flight)
+        ldap_aio_connections.labels(pool=self.name).set(len(self._connections))
+        return conn
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Optional[AsyncLDAPConnection]]:
+        """Connection for one or more requests; yields None if the server is
+        unreachable. A communication error retires the connection."""
+        conn = await self.acquire()
+        ldap_aio_in_flight.labels(pool=self.name).inc()
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            if conn is not None:
+                conn.close()
+            raise
+        finally:
+            ldap_aio_in_flight.labels(pool=self.name).dec()
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        ldap_aio_connections.labels(pool=self.name).set(0)
+
+
+class AsyncReadRouter:
+    """Routes asyncio reads using the replica state a ReadRouter keeps
+    (probe thread, lag, circuit breakers, contextCSNs), with one
+    AsyncLDAPPool per replica in the same order as router.replicas"""
+
+    def __init__(self, router, replica_pools: List[AsyncLDAPPool], master_pool: AsyncLDAPPool):
+        self.router = router
+        self.replica_pools = {replica.name: pool for replica, pool in zip(router.replicas, replica_pools)}
+        self.master_pool = master_pool
+
+    @asynccontextmanager
+    async def _replica_connection(self, replica) -> AsyncIterator[AsyncLDAPConnection]:
+        with self.router.tracked(replica):
+            async with self.replica_pools[replica.name].connection() as conn:
+                if conn is None:
+                    raise ReplicaUnavailable('connection failed')
+                ldap_read_requests_total.labels(target=replica.name).inc()
+                yield conn
+
+    @asynccontextmanager
+    async def connection(self, eligible=None) -> AsyncIterator[Optional[AsyncLDAPConnection]]:
+        """Read connection on the best replica, the master when none is
+        usable; yields None only if the master is unreachable too"""
+        async with AsyncExitStack() as stack:
+            for replica in self.router.candidates(eligible):
+                try:
+                    conn = await stack.enter_async_context(self._replica_connection(replica))
+                    break
+                except ReplicaUnavailable:
+                    continue
+            else:
+                conn = await stack.enter_async_context(self.master_pool.connection())
+                if conn:
+                    ldap_read_requests_total.labels(target=self.master_pool.name).inc()
+            yield conn
+
+    async def execute(self, operation: Callable[[AsyncLDAPConnection], Awaitable], eligible=None):
+        """await operation(conn) on the best replica, hedged onto the next one
+        after the router's hedge_after seconds; the slower attempt is
+        cancelled. Raises ConnectionError when no server can be reached."""
+        hedge_after = self.router.hedge_after
+        candidates = self.router.candidates(eligible) if hedge_after else []
+        if len(candidates) < 2:
+            async with self.connection(eligible) as conn:
+                if not conn:
+                    raise ConnectionError('LDAP connection failed')
+                return await operation(conn)
+
+        async def attempt(replica):
+            async with self._replica_connection(replica) as conn:
+                return await operation(conn)
+
+        pending = {asyncio.ensure_future(attempt(candidates[0]))}
+        done, _ = await asyncio.wait(pending, timeout=hedge_after)
+        if not done:
+            ldap_read_hedged_total.inc()
+            pending.add(asyncio.ensure_future(attempt(candidates[1])))
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    logger.warning(f"Hedged read failed: {task.exception()}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        async with self.master_pool.connection() as conn:
+            if not conn:
+                raise ConnectionError('LDAP connection failed')
+            ldap_read_requests_total.labels(target=self.master_pool.name).inc()
+            return await operation(conn)
+
+    async def consistent_with(self, target: Dict[int, str], timeout: float):
+        """ReadRouter.consistent_with in a worker thread: it only blocks
+        while polling replicas that have not caught up yet"""
+        return await asyncio.to_thread(self.router.consistent_with, target, timeout)
+
+    def close(self):
+        for pool in self.replica_pools.values():
+            pool.close()
+
+
+def search_entries(response: List[Dict]) -> List[Dict]:
+    """Entries of a search response, serialized like response_entries()"""
+    return [entry_to_dict(item['dn'], item['attributes'])
+            for item in response or [] if item.get('type') == 'searchResEntry']
+
+
+def result_cookie(result: Dict) -> Optional[bytes]:
+    """Paged-results cookie of a search result, None on the last page"""
+    try:
+        cookie = result['controls'][PAGED_RESULTS_OID]['value']['cookie']
+    except (KeyError, TypeError):
+        return None
+    return cookie or None
+
+
+async def iter_paged(conn: AsyncLDAPConnection, base_dn: str, search_filter: str,
+                     attributes: List[str], page_size: int = 500,
+                     search_scope=ldap3.SUBTREE) -> AsyncIterator[Dict]:
+    """Yield entries page by page so memory stays bounded by page_size"""
+    cookie = None
+    while True:
+        response, result = await conn.search(base_dn, search_filter, search_scope, attributes=attributes,
+                                             paged_size=page_size, paged_cookie=cookie)
+        if result['result'] != 0:
+            raise LDAPException(f"Search failed: {result['description']}")
+        for entry in search_entries(response):
+            yield entry
+        cookie = result_cookie(result)
+        if not cookie:
+            return
+
+
+async def read_context_csn(conn: AsyncLDAPConnection, base_dn: str) -> Dict[int, str]:
+    """contextCSN of the suffix entry, by serverID"""
+    response, _ = await conn.search(base_dn, '(objectClass=*)', ldap3.BASE, attributes=['contextCSN'])
+    for item in response or []:
+        if item.get('type') == 'searchResEntry':
+            return csns_by_server(item['attributes'].get('contextCSN', []))
+    return {}
@@ -0,0 +1,628 @@
+"""
+asyncio serving mode for the API gateway
+Serves the directory routes (/search, /tree, /add_user, /modify_user,
+/delete_user, /audit_logs, /health) natively on the event loop over
+pipelined LDAP connections, asyncpg and redis.asyncio, with the same JWT and
+role checks as the Flask app; every other route is handed to the Flask app
+through a WSGI adapter. Run with: uvicorn asgi_app:app
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+
+import asyncpg
+import jwt
+import ldap3
+import redis.asyncio as aioredis
+from a2wsgi import WSGIMiddleware
+from ldap3.core.exceptions import LDAPException
+from limits import parse_many
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from aio_ldap import AsyncLDAPPool, AsyncReadRouter, iter_paged, read_context_csn, search_entries
+from app import (
+    AUDIT_LOGS_MAX_LIMIT, DATABASE_URL, DB_POOL_MAX, DB_POOL_MIN, DB_POOL_TIMEOUT, DEFAULT_RATE_LIMITS,
+    GROUP_MEMBER_ATTRIBUTES, LDAP_BASE_DN, LDAP_BIND_DN, LDAP_BIND_PASSWORD, LDAP_MASTER_URI, LDAP_POOL_TIMEOUT,
+    READ_CONSISTENCY_WAIT, SEARCH_STREAM_PAGE_SIZE, RequestError,
+    app as flask_app, audit_old_values, change_feed, check_may_modify, delete_request, json_object,
+    modify_request, next_page, operation_failed, operation_succeeded, read_router, record_write,
+    replica_pools, requested_token, role_cache, search_body, search_cache, search_cache_key,
+    search_flight_key, search_flights, search_request, start_paged_search, start_worker, tree_body,
+    tree_request, user_entry, write_response
+)
+from audit_logs import approximate_total_async, encode_cursor, fetch_page_async, parse_filters
+from ldap_batch import replace_changes
+from ldap_search import TREE_ATTRIBUTES
+from replication import format_csn_token, parse_csn_token
+
+# Configuration
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+LDAP_AIO_CONNECTIONS = int(os.getenv('LDAP_AIO_CONNECTIONS', '2'))
+ASGI_WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', '10'))
+RATE_LIMIT_PREFIX = 'LIMITER_ASGI'
+
+logger = logging.getLogger(__name__)
+
+JWT_SECRET_KEY = flask_app.config['JWT_SECRET_KEY']
+JWT_ALGORITHM = flask_app.config['JWT_ALGORITHM']
+JWT_IDENTITY_CLAIM = flask_app.config.get('JWT_IDENTITY_CLAIM', 'sub')
+
+# Pipelined LDAP connections; replica choice, lag and breakers come from the
+# Flask app's ReadRouter, whose probe thread keeps running in this process
+master_pool = AsyncLDAPPool('master', LDAP_MASTER_URI, LDAP_BIND_DN, LDAP_BIND_PASSWORD,
+                            size=LDAP_AIO_CONNECTIONS, timeout=LDAP_POOL_TIMEOUT)
+read_pools = AsyncReadRouter(
+    read_router,
+    [AsyncLDAPPool(pool.name, pool.uri, LDAP_BIND_DN, LDAP_BIND_PASSWORD,
+                   size=LDAP_AIO_CONNECTIONS, timeout=LDAP_POOL_TIMEOUT) for pool in replica_pools],
+    master_pool
+)
+
+redis_client = aioredis.from_url(REDIS_URL)
+
+# asyncpg pool, opened on startup
+db = {'pool': None}
+
+
+# Responses
+
+def json_response(body, status: int = 200, headers: Optional[Dict] = None) -> Response:
+    """Serialize like Flask's jsonify so both serving modes return the same bodies"""
+    return Response(flask_app.json.dumps(body) + '\n', status_code=status, headers=headers,
+                    media_type='application/json')
+
+
+async def json_body(request) -> Dict:
+    """Request body as a JSON object; RequestError if it is not one"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    return json_object(data)
+
+
+def int_arg(params, name: str, default: int) -> int:
+    """request.args.get(name, default, type=int)"""
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+
+def client_ip(request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+# Authentication and authorization
+
+class AuthError(Exception):
+    def __init__(self, status: int, msg: str):
+        super().__init__(msg)
+        self.status = status
+        self.msg = msg
+
+
+def access_identity(request) -> str:
+    """Identity of the access token in the Authorization header, checked as
+    flask_jwt_extended checks it; raises AuthError with its status and msg"""
+    header = request.headers.get('Authorization')
+    if not header:
+        raise AuthError(401, 'Missing Authorization Header')
+    parts = header.split()
+    if not parts or parts[0] != 'Bearer':
+        raise AuthError(401, "Missing 'Bearer' type in 'Authorization' header. "
+                             "Expected 'Authorization: Bearer <JWT>'")
+    if len(parts) != 2:
+        raise AuthError(422, "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'")
+    try:
+        claims = jwt.decode(parts[1], JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise AuthError(401, 'Token has expired')
+    except jwt.InvalidTokenError as e:
+        raise AuthError(422, str(e))
+    if claims.get('type') != 'access':
+        raise AuthError(422, 'Only non-refresh tokens are allowed')
+    return claims[JWT_IDENTITY_CLAIM]
+
+
+def jwt_required(f):
+    """Decorator to require an access token; sets request.state.identity"""
+    @wraps(f)
+    async def decorated_function(request):
+        try:
+            request.state.identity = access_identity(request)
+        except AuthError as e:
+            return json_response({'msg': e.msg}, e.status)
+        return await f(request)
+    return decorated_function
+
+
+async def get_user_role(user_dn: str) -> str:
+    """Get user role, resolving it from LDAP on a cache miss"""
+    if 'cn=admin' in user_dn.lower():
+        return 'admin'
+
+    role = await role_cache.get_async(user_dn, redis_client)
+    if role:
+        return role
+
+    role = await lookup_user_role(user_dn)
+    if role is None:
+        return 'user'
+    await role_cache.set_async(user_dn, role, redis_client)
+    return role
+
+
+async def lookup_user_role(user_dn: str) -> Optional[str]:
+    """Resolve user role from group membership; None if LDAP is unavailable"""
+    try:
+        async with master_pool.connection() as conn:
+            if not conn:
+                return None
+            response, _ = await conn.search(LDAP_BASE_DN, f'(member={user_dn})', attributes=['cn'])
+            for entry in search_entries(response):
+                cn = str(entry.get('cn', '')).lower()
+                for role in ('faculty', 'student', 'staff'):
+                    if role in cn:
+                        return role
+            return 'user'
+    except Exception as e:
+        logger.error(f"Error getting user role: {e}")
+        return None
+
+
+async def invalidate_cached_roles(dn: str, attribute_names):
+    """Drop cached roles affected by a successful write to dn"""
+    if any(attr.lower() in GROUP_MEMBER_ATTRIBUTES for attr in attribute_names):
+        await role_cache.clear_async(redis_client)
+    else:
+        await role_cache.invalidate_async(redis_client, dn)
+
+
+async def invalidate_cached_searches(*dns: str):
+    """Drop cached searches affected by successful writes to dns"""
+    search_flights.forget()
+    if search_cache is not None:
+        await search_cache.invalidate_async(redis_client, *dns)
+
+
+def require_role(*roles):
+    """Decorator to require specific role"""
+    def decorator(f):
+        @wraps(f)
+        @jwt_required
+        async def decorated_function(request):
+            if await get_user_role(request.state.identity) not in roles:
+                return json_response({'error': 'Insufficient permissions'}, 403)
+            return await f(request)
+        return decorated_function
+    return decorator
+
+
+def rate_limit(*limit_values: str):
+    """Fixed-window limits per client address, counted in Redis like
+    Flask-Limiter's; routes without their own limits get DEFAULT_RATE_LIMITS"""
+    items = [item for value in (limit_values or DEFAULT_RATE_LIMITS) for item in parse_many(value)]
+
+    def decorator(f):
+        scope = f.__name__
+
+        @wraps(f)
+        async def decorated_function(request):
+            for item in items:
+                key = '/'.join([RATE_LIMIT_PREFIX, client_ip(request) or '-', scope,
+                                str(item.amount), str(item.multiples), item.GRANULARITY.name])
+                try:
+                    count = await redis_client.incr(key)
+                    if count == 1:
+                        await redis_client.expire(key, item.get_expiry())
+                except Exception as e:
+                    logger.warning(f"Rate limit check failed: {e}")
+                    break
+                if count > item.amount:
+                    return json_response({'error': f'Rate limit exceeded: {item}'}, 429)
+            return await f(request)
+        return decorated_function
+    return decorator
+
+
+# Read-your-writes
+
+async def consistency_token(conn) -> Optional[str]:
+    """The master's contextCSN right after a write on conn"""
+    try:
+        return format_csn_token(await read_context_csn(conn, LDAP_BASE_DN))
+    except LDAPException as e:
+        logger.warning(f"Cannot read contextCSN after write: {e}")
+        return None
+
+
+async def read_eligibility(token: Optional[str]):
+    """Replica filter for a read that must see the writes behind token
+    (None: any replica); raises RequestError for a malformed token"""
+    if not token:
+        return None
+    try:
+        csns = parse_csn_token(token)
+    except ValueError as e:
+        raise RequestError(f'Invalid consistency token: {e}')
+    return await read_pools.consistent_with(csns, READ_CONSISTENCY_WAIT)
+
+
+# Routes
+
+async def database_ok() -> bool:
+    try:
+        async with db['pool'].acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            await conn.execute('SELECT 1')
+        return True
+    except Exception as e:
+        logger.error(f"Database health check error: {e}")
+        return False
+
+
+async def redis_ok() -> bool:
+    try:
+        return bool(await redis_client.ping())
+    except Exception:
+        return False
+
+
+@rate_limit()
+async def health(request):
+    """Health check endpoint"""
+    async with master_pool.connection() as conn:
+        ldap_master_ok = conn is not None
+    database, redis_status = await asyncio.gather(database_ok(), redis_ok())
+    return json_response({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'services': {
+            'ldap_master': 'ok' if ldap_master_ok else 'error',
+            'database': 'ok' if database else 'error',
+            'redis': 'ok' if redis_status else 'error'
+        },
+        'replicas': read_router.status()
+    })
+
+
+@rate_limit("100 per hour")
+@jwt_required
+async def search(request):
+    """Search LDAP directory"""
+    start_time = datetime.now()
+    current_user = request.state.identity
+    cache_key = body = None
+    try:
+        data = await json_body(request)
+        base_dn, search_filter, attributes, page_size, cookie = search_request(data)
+        # Read-your-writes: only replicas that have caught up with the token
+        eligible = None if cookie else await read_eligibility(requested_token(data, request.headers))
+    except RequestError as e:
+        return json_response(e.body, e.status)
+
+    if data.get('stream'):
+        return StreamingResponse(stream_search(base_dn, search_filter, attributes, eligible),
+                                 media_type='application/x-ndjson')
+
+    try:
+        if cookie:
+            # Paged cursors pin a dedicated synchronous connection: shared
+            # with the Flask routes and driven from a worker thread
+            results, cookie = await asyncio.to_thread(next_page, cookie, current_user)
+        elif page_size:
+            results, cookie = await asyncio.to_thread(start_paged_search, eligible, current_user, base_dn,
+                                                      search_filter, attributes, page_size)
+        else:
+            # Repeated searches are answered from the result cache; reads
+            # that must see a given write skip it
+            if eligible is None and search_cache is not None:
+                cache_key = search_cache_key(base_dn, search_filter, attributes, await get_user_role(current_user))
+            read_eligible = eligible
+            if cache_key:
+                body = await search_cache.get_async(*cache_key, redis_client)
+                if body is not None:
+                    return Response(body, media_type='application/json')
+                generation = search_cache.generation()
+                # Only from servers that have the writes the cache dropped
+                read_eligible = read_router.fill_eligibility(search_cache.invalidated_at())
+
+            async def run_search(conn):
+                response, _ = await conn.search(base_dn, search_filter, attributes=attributes)
+                return search_entries(response)
+
+            async def fetch():
+                try:
+                    results = await read_pools.execute(run_search, read_eligible)
+                except ConnectionError:
+                    if read_eligible is eligible:
+                        raise
+                    # Master down: answer from any replica, uncached
+                    return await read_pools.execute(run_search, eligible), None
+                body = None
+                if cache_key:
+                    body = (flask_app.json.dumps(search_body(results, None, False)) + '\n').encode()
+                    await search_cache.set_async(*cache_key, body, generation, redis_client)
+                return results, body
+
+            if eligible is None:
+                # Identical searches arriving together share one
+                results, body = await search_flights.do_async(
+                    search_flight_key(base_dn, search_filter, attributes), fetch)
+            else:
+                results, body = await fetch()
+
+        operation_succeeded('search', start_time)
+        if body is not None:
+            return Response(body, media_type='application/json')
+        return json_response(search_body(results, cookie, bool(page_size or cookie)))
+
+    except RequestError as e:
+        return json_response(e.body, e.status)
+    except ConnectionError:
+        operation_failed('search')
+        return json_response({'error': 'LDAP connection failed'}, 500)
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        operation_failed('search')
+        return json_response({'error': str(e)}, 500)
+
+
+async def stream_search(base_dn: str, search_filter: str, attributes: List[str], eligible=None):
+    """Yield search results as NDJSON lines, one entry per line"""
+    start_time = datetime.now()
+    try:
+        async with read_pools.connection(eligible) as conn:
+            if not conn:
+                operation_failed('search')
+                yield json.dumps({'error': 'LDAP connection failed'}) + '\n'
+                return
+
+            async for entry in iter_paged(conn, base_dn, search_filter, attributes,
+                                          page_size=SEARCH_STREAM_PAGE_SIZE):
+                yield json.dumps(entry) + '\n'
+
+        operation_succeeded('search', start_time)
+    except Exception as e:
+        logger.error(f"Search stream error: {e}")
+        operation_failed('search')
+        yield json.dumps({'error': str(e)}) + '\n'
+
+
+@rate_limit()
+@jwt_required
+async def directory_tree(request):
+    """Immediate children of ?dn=, as the Flask /tree"""
+    start_time = datetime.now()
+    params = request.query_params
+    current_user = request.state.identity
+    try:
+        dn, cookie, page_size = tree_request(params)
+        eligible = None if cookie else await read_eligibility(requested_token(params, request.headers))
+    except RequestError as e:
+        return json_response(e.body, e.status)
+
+    try:
+        if cookie:
+            children, cookie = await asyncio.to_thread(next_page, cookie, current_user)
+        else:
+            # One entry more than a page tells whether the node needs paging
+            async with read_pools.connection(eligible) as conn:
+                if not conn:
+                    raise ConnectionError('LDAP connection failed')
+                response, result = await conn.search(dn, '(objectClass=*)', ldap3.LEVEL,
+                                                     attributes=TREE_ATTRIBUTES, size_limit=page_size + 1)
+                if result['result'] == 32:
+                    raise RequestError('No such entry', 404, dn=dn)
+                children = search_entries(response)
+
+            if len(children) > page_size:
+                children, cookie = await asyncio.to_thread(
+                    start_paged_search, eligible, current_user, dn, '(objectClass=*)',
+                    TREE_ATTRIBUTES, page_size, search_scope=ldap3.LEVEL)
+
+        operation_succeeded('search', start_time)
+        return json_response(tree_body(dn, children, cookie))
+
+    except RequestError as e:
+        return json_response(e.body, e.status)
+    except ConnectionError:
+        operation_failed('search')
+        return json_response({'error': 'LDAP connection failed'}, 500)
+    except Exception as e:
+        logger.error(f"Tree error: {e}")
+        operation_failed('search')
+        return json_response({'error': str(e)}, 500)
+
+
+@rate_limit("50 per hour")
+@require_role('admin', 'faculty')
+async def add_user(request):
+    """Add new user to LDAP"""
+    start_time = datetime.now()
+    current_user = request.state.identity
+    try:
+        data = await json_body(request)
+    except RequestError as e:
+        return json_response(e.body, e.status)
+
+    try:
+        async with master_pool.connection() as conn:
+            if not conn:
+                return json_response({'error': 'LDAP connection failed'}, 500)
+
+            dn, attributes = user_entry(data)
+            result = await conn.add(dn, attributes)
+
+            if result['result'] == 0:
+                token = await consistency_token(conn)
+                await invalidate_cached_searches(dn)
+                record_write('add', current_user, dn, client_ip(request), start_time,
+                             new_attributes=attributes, new_value=json.dumps(attributes))
+                return json_response(*write_response('User added successfully', token, 201, dn=dn))
+            operation_failed('add')
+            return json_response({'error': result['description']}, 400)
+
+    except Exception as e:
+        logger.error(f"Add user error: {e}")
+        operation_failed('add')
+        return json_response({'error': str(e)}, 500)
+
+
+@rate_limit("20 per hour")
+@require_role('admin')
+async def delete_user(request):
+    """Delete user from LDAP"""
+    start_time = datetime.now()
+    current_user = request.state.identity
+    try:
+        dn = delete_request(await json_body(request))
+    except RequestError as e:
+        return json_response(e.body, e.status)
+
+    try:
+        async with master_pool.connection() as conn:
+            if not conn:
+                return json_response({'error': 'LDAP connection failed'}, 500)
+
+            # Get entry before deletion for audit
+            response, _ = await conn.search(dn, '(objectClass=*)', attributes=['*'])
+            entries = search_entries(response)
+            old_value = json.dumps(entries) if entries else None
+            old_attributes = next((item['attributes'] for item in response
+                                   if item.get('type') == 'searchResEntry'), {})
+
+            result = await conn.delete(dn)
+
+            if result['result'] == 0:
+                token = await consistency_token(conn)
+                await invalidate_cached_roles(dn, old_attributes)
+                await invalidate_cached_searches(dn)
+                record_write('delete', current_user, dn, client_ip(request), start_time,
+                             old_attributes=old_attributes, old_value=old_value)
+                return json_response(*write_response('User deleted successfully', token))
+            operation_failed('delete')
+            return json_response({'error': result['description']}, 400)
+
+    except Exception as e:
+        logger.error(f"Delete user error: {e}")
+        operation_failed('delete')
+        return json_response({'error': str(e)}, 500)
+
+
+@rate_limit("100 per hour")
+@jwt_required
+async def modify_user(request):
+    """Modify user attributes in LDAP"""
+    start_time = datetime.now()
+    current_user = request.state.identity
+    try:
+        dn, modifications = modify_request(await json_body(request))
+        check_may_modify(await get_user_role(current_user), current_user, dn)
+    except RequestError as e:
+        return json_response(e.body, e.status)
+
+    try:
+        async with master_pool.connection() as conn:
+            if not conn:
+                return json_response({'error': 'LDAP connection failed'}, 500)
+
+            # Get old values for audit
+            response, _ = await conn.search(dn, '(objectClass=*)', attributes=list(modifications.keys()))
+            found = [item['attributes'] for item in response if item.get('type') == 'searchResEntry']
+            old_attributes = found[0] if found else {}
+
+            result = await conn.modify(dn, replace_changes(modifications))
+
+            if result['result'] == 0:
+                token = await consistency_token(conn)
+                await invalidate_cached_roles(dn, modifications.keys())
+                await invalidate_cached_searches(dn)
+                record_write('modify', current_user, dn, client_ip(request), start_time,
+                             old_attributes=old_attributes, new_attributes=modifications,
+                             old_value=json.dumps(audit_old_values(found, modifications.keys())),
+                             new_value=json.dumps(modifications))
+                return json_response(*write_response('User modified successfully', token))
+            operation_failed('modify')
+            return json_response({'error': result['description']}, 400)
+
+    except Exception as e:
+        logger.error(f"Modify user error: {e}")
+        operation_failed('modify')
+        return json_response({'error': str(e)}, 500)
+
+
+@rate_limit()
+@require_role('admin')
+async def get_audit_logs(request):
+    """Get audit logs from database, newest first (see the Flask route)"""
+    params = request.query_params
+    limit = max(1, min(int_arg(params, 'limit', 100), AUDIT_LOGS_MAX_LIMIT))
+    offset = max(0, int_arg(params, 'offset', 0))
+    try:
+        filters = parse_filters(params)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+
+    try:
+        async with db['pool'].acquire(timeout=DB_POOL_TIMEOUT) as conn:
+            logs = await fetch_page_async(conn, filters, limit, offset)
+            total = await approximate_total_async(conn, filters)
+
+        return json_response({
+            'count': len(logs),
+            'logs': logs,
+            'next_cursor': encode_cursor(logs[-1]) if len(logs) == limit else None,
+            'approximate_total': total
+        })
+
+    except Exception as e:
+        logger.error(f"Audit logs error: {e}")
+        return json_response({'error': str(e)}, 500)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    start_worker()
+    db['pool'] = await asyncpg.create_pool(DATABASE_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                                           timeout=DB_POOL_TIMEOUT)
+    read_router.start()
+    if change_feed is not None:
+        change_feed.start()
+    try:
+        yield
+    finally:
+        master_pool.close()
+        read_pools.close()
+        await db['pool'].close()
+        await redis_client.aclose()
+
+
+app = Starlette(
+    routes=[
+        Route('/health', health, methods=['GET']),
+        Route('/search', search, methods=['POST']),
+        Route('/tree', directory_tree, methods=['GET']),
+        Route('/add_user', add_user, methods=['POST']),
+        Route('/delete_user', delete_user, methods=['DELETE']),
+        Route('/modify_user', modify_user, methods=['PUT']),
+        Route('/audit_logs', get_audit_logs, methods=['GET']),
+        # Everything else, Socket.IO long-polling included, runs in the Flask app
+        Mount('/', WSGIMiddleware(flask_app, workers=ASGI_WSGI_WORKERS)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['X-Consistency-Token']),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,146 @@
+"""
+Audit log queries
+Keyset pagination on (timestamp, id), server-side filters and planner-based
+row estimates for /audit_logs
+"""
+
+import base64
+import itertools
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db_pool import prepare
+
+# Query parameter -> condition; order fixes placeholder numbering and the
+# prepared statement name for each combination of filters
+AUDIT_LOG_FILTERS = (
+    ('actor', 'actor_dn = {}'),
+    ('target', 'target_dn = {}'),
+    ('action', 'action = {}'),
+    ('status', 'status = {}'),
+    ('since', 'timestamp >= {}'),
+    ('until', 'timestamp < {}'),
+    ('cursor', '(timestamp, id) < ({}, {})'),
+)
+
+TIME_FILTERS = ('since', 'until')
+
+# Diffs stored as JSONB are returned as text, like the TEXT columns
+AUDIT_LOG_COLUMNS = (
+    "id, timestamp, action, actor_dn, target_dn, "
+    "COALESCE(old_value, old_json::text) AS old_value, "
+    "COALESCE(new_value, new_json::text) AS new_value, "
+    "ip_address, status"
+)
+
+
+def encode_cursor(row: Dict) -> str:
+    """Opaque cursor pointing just past row"""
+    raw = json.dumps([row['timestamp'].isoformat(), row['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def parse_filters(args) -> Dict[str, List]:
+    """Pick the supported filters out of the request args, in
+    AUDIT_LOG_FILTERS order; raises ValueError on bad values"""
+    filters = {}
+    for name, _ in AUDIT_LOG_FILTERS:
+        value = args.get(name)
+        if not value:
+            continue
+        if name == 'cursor':
+            filters[name] = list(decode_cursor(value))
+        elif name in TIME_FILTERS:
+            try:
+                filters[name] = [datetime.fromisoformat(value)]
+            except ValueError as e:
+                raise ValueError(f"Invalid {name} timestamp") from e
+        else:
+            filters[name] = [value]
+    return filters
+
+
+def _params(filters: Dict[str, List]) -> List:
+    return [value for name, _ in AUDIT_LOG_FILTERS for value in filters.get(name, [])]
+
+
+def _where(filters: Dict[str, List], placeholder) -> str:
+    conditions = []
+    for name, condition in AUDIT_LOG_FILTERS:
+        if name in filters:
+            conditions.append(condition.format(*(placeholder() for _ in filters[name])))
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+
+def _numbered():
+    numbers = itertools.count(1)
+    return lambda: f"${next(numbers)}"
+
+
+def page_query(filters: Dict[str, List], limit: int, offset: int = 0) -> Tuple[str, List]:
+    """Newest-first page query with $n placeholders, and its parameters"""
+    placeholder = _numbered()
+    where = _where(filters, placeholder)
+    sql = f"""
+        SELECT {AUDIT_LOG_COLUMNS} FROM audit_logs
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT {placeholder()} OFFSET {placeholder()}
+    """
+    return sql, _params(filters) + [limit, offset]
+
+
+def fetch_page(cur, filters: Dict[str, List], limit: int, offset: int = 0) -> List[Dict]:
+    """Newest-first page of audit rows through a statement prepared once per
+    combination of filters"""
+    sql, params = page_query(filters, limit, offset)
+    statement = 'audit_logs_page_' + ''.join('1' if name in filters else '0' for name, _ in AUDIT_LOG_FILTERS)
+    prepare(cur, statement, sql)
+    cur.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+    return cur.fetchall()
+
+
+def estimate_query(filters: Dict[str, List], placeholder=None) -> Tuple[str, List]:
+    """EXPLAIN for the filters (cursor ignored) with %s placeholders, or
+    whatever placeholder() returns, and its parameters"""
+    filters = {name: values for name, values in filters.items() if name != 'cursor'}
+    where = _where(filters, placeholder or (lambda: '%s'))
+    return f"EXPLAIN (FORMAT JSON) SELECT 1 FROM audit_logs {where}", _params(filters)
+
+
+def plan_rows(plan) -> Optional[int]:
+    """Row estimate from EXPLAIN (FORMAT JSON) output"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    try:
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def approximate_total(cur, filters: Dict[str, List]) -> Optional[int]:
+    """Row estimate for the filters from the planner, without COUNT(*)"""
+    cur.execute(*estimate_query(filters))
+    row = cur.fetchone()
+    return plan_rows(row['QUERY PLAN'] if isinstance(row, dict) else row[0])
+
+
+async def fetch_page_async(conn, filters: Dict[str, List], limit: int, offset: int = 0) -> List[Dict]:
+    """fetch_page over an asyncpg connection, whose statement cache keeps
+    the query prepared"""
+    sql, params = page_query(filters, limit, offset)
+    return [dict(row) for row in await conn.fetch(sql, *params)]
+
+
+async def approximate_total_async(conn, filters: Dict[str, List]) -> Optional[int]:
+    return plan_rows(await conn.fetchval(*estimate_query(filters, _numbered())))
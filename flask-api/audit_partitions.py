@@ -0,0 +1,212 @@
+"""
+Monthly partitioning and retention for audit_logs
+Creates the partitioned table (migrating an existing heap into it as a
+single legacy partition), keeps partitions ahead of the clock, and
+archives then drops partitions older than the retention window
+"""
+
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BOUND_VALUES = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+AUDIT_INDEXES = (
+    # Keyset pagination on (timestamp, id), alone and behind each equality filter
+    ('idx_audit_ts_id', 'timestamp DESC, id DESC'),
+    ('idx_audit_actor_ts', 'actor_dn, timestamp DESC, id DESC'),
+    ('idx_audit_target_ts', 'target_dn, timestamp DESC, id DESC'),
+    ('idx_audit_action_ts', 'action, timestamp DESC, id DESC'),
+    ('idx_audit_status_ts', 'status, timestamp DESC, id DESC'),
+)
+LEGACY_INDEXES = ('idx_audit_timestamp', 'idx_audit_actor') + tuple(name for name, _ in AUDIT_INDEXES)
+
+CREATE_AUDIT_LOGS = """
+    CREATE SEQUENCE IF NOT EXISTS audit_logs_id_seq;
+    CREATE TABLE audit_logs (
+        id INTEGER NOT NULL DEFAULT nextval('audit_logs_id_seq'),
+        timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        action VARCHAR(50) NOT NULL,
+        actor_dn VARCHAR(500),
+        target_dn VARCHAR(500),
+        old_value TEXT,
+        new_value TEXT,
+        old_json JSONB,
+        new_json JSONB,
+        ip_address VARCHAR(45),
+        status VARCHAR(20)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+    CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+"""
+
+
+# pg_advisory_xact_lock key serializing audit_logs DDL between workers and the maintenance job
+SCHEMA_LOCK = 0x61756469
+
+
+def lock_schema(cur):
+    """Hold the audit DDL lock until the current transaction ends"""
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK,))
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """First day of the month offset months away from day"""
+    month = day.year * 12 + day.month - 1 + offset
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _table_kind(cur, name: str) -> Optional[str]:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    return None if value in ('MINVALUE', 'MAXVALUE') else datetime.fromisoformat(value.strip("'"))
+
+
+def partition_bounds(cur) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(name, lower, upper) for every range partition; None means unbounded"""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'audit_logs'::regclass
+    """)
+    bounds = []
+    for name, expr in cur.fetchall():
+        match = BOUND_VALUES.search(expr or '')
+        if match:
+            bounds.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return bounds
+
+
+def ensure_partitioned(cur):
+    """Create audit_logs as a partitioned table, moving a pre-existing
+    unpartitioned table in as audit_logs_legacy"""
+    kind = _table_kind(cur, 'audit_logs')
+    if kind == 'p':
+        return
+
+    if kind == 'r':
+        logger.info("Migrating audit_logs to a partitioned table")
+        legacy_upper = month_start(date.today(), 1)
+        cur.execute("ALTER TABLE audit_logs RENAME TO audit_logs_legacy")
+        cur.execute("ALTER TABLE audit_logs_legacy RENAME CONSTRAINT audit_logs_pkey TO audit_logs_legacy_pkey")
+        for index in LEGACY_INDEXES:
+            cur.execute(f"DROP INDEX IF EXISTS {index}")
+        cur.execute("""
+            ALTER TABLE audit_logs_legacy
+                ALTER COLUMN timestamp SET NOT NULL,
+                ADD COLUMN IF NOT EXISTS old_json JSONB,
+                ADD COLUMN IF NOT EXISTS new_json JSONB
+        """)
+        cur.execute(CREATE_AUDIT_LOGS)
+        cur.execute(
+            "ALTER TABLE audit_logs ATTACH PARTITION audit_logs_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+            (legacy_upper,)
+        )
+    else:
+        cur.execute(CREATE_AUDIT_LOGS)
+
+    for name, columns in AUDIT_INDEXES:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON audit_logs({columns})")
+
+
+def set_json_compression(cur, method: str):
+    """Compress the JSONB diff columns with method (e.g. lz4) on every partition"""
+    cur.execute("SAVEPOINT audit_compression")
+    try:
+        cur.execute(
+            f"ALTER TABLE audit_logs ALTER COLUMN old_json SET COMPRESSION {method}, "
+            f"ALTER COLUMN new_json SET COMPRESSION {method}"
+        )
+        cur.execute("RELEASE SAVEPOINT audit_compression")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT audit_compression")
+        logger.warning(f"Could not set {method} compression on audit diffs: {e}")
+
+
+def ensure_partitions(cur, months_ahead: int = 2, today: Optional[date] = None) -> List[str]:
+    """Create monthly partitions from the current month to months_ahead, and
+    for earlier months whose rows ended up in audit_logs_default, skipping
+    ranges an existing partition already covers"""
+    today = today or date.today()
+    existing = partition_bounds(cur)
+    cur.execute("SELECT DISTINCT date_trunc('month', timestamp)::date FROM audit_logs_default")
+    months = {row[0] for row in cur.fetchall()} | {month_start(today, offset) for offset in range(months_ahead + 1)}
+    created = []
+    for lower in sorted(months):
+        upper = month_start(lower, 1)
+        lower_dt, upper_dt = datetime.combine(lower, datetime.min.time()), datetime.combine(upper, datetime.min.time())
+        if any((lo is None or lo < upper_dt) and (hi is None or hi > lower_dt) for _, lo, hi in existing):
+            continue
+        name = f"audit_logs_y{lower.year:04d}m{lower.month:02d}"
+        cur.execute("SAVEPOINT audit_partition")
+        try:
+            _create_partition(cur, name, lower, upper)
+            cur.execute("RELEASE SAVEPOINT audit_partition")
+            created.append(name)
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT audit_partition")
+            logger.error(f"Could not create audit partition {name}: {e}")
+    return created
+
+
+def _create_partition(cur, name: str, lower: date, upper: date):
+    """Create the partition for [lower, upper). Rows of that range already
+    in audit_logs_default (the month started before its partition existed)
+    would make the CREATE fail, so they are moved over with the default
+    partition detached meanwhile."""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM audit_logs_default WHERE timestamp >= %s AND timestamp < %s)",
+                (lower, upper))
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF audit_logs FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+        return
+
+    logger.info(f"Moving {lower:%Y-%m} audit rows out of audit_logs_default into {name}")
+    cur.execute("ALTER TABLE audit_logs DETACH PARTITION audit_logs_default")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF audit_logs FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM audit_logs_default WHERE timestamp >= %s AND timestamp < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (lower, upper))
+    cur.execute("ALTER TABLE audit_logs ATTACH PARTITION audit_logs_default DEFAULT")
+
+
+def archive_partition(cur, name: str, archive_dir: str) -> str:
+    """COPY a partition out to a gzipped CSV file and return its path"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    with gzip.open(path, 'wb') as f:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    return path
+
+
+def expire_partitions(cur, retention_months: int, archive_dir: Optional[str] = None,
+                      today: Optional[date] = None, limit: Optional[int] = None) -> List[str]:
+    """Detach and drop partitions whose whole range is older than the
+    retention window (oldest first, at most limit of them), archiving each
+    one first when archive_dir is set"""
+    today = today or date.today()
+    cutoff = datetime.combine(month_start(today, -retention_months), datetime.min.time())
+    expired = []
+    for name, _, upper in sorted(partition_bounds(cur), key=lambda bound: bound[2] or datetime.max):
+        if upper is None or upper > cutoff:
+            continue
+        if limit is not None and len(expired) >= limit:
+            break
+        if archive_dir:
+            path = archive_partition(cur, name, archive_dir)
+            logger.info(f"Archived {name} to {path}")
+        cur.execute(f"ALTER TABLE audit_logs DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+        expired.append(name)
+    return expired
@@ -0,0 +1,363 @@
+"""
+Background audit pipeline
+Buffers audit events in a bounded queue and writes them in batches to
+PostgreSQL and the LDAP audit server, spilling to local JSON-lines files
+while either downstream is unavailable
+"""
+
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import psycopg2
+from ldap3.core.exceptions import LDAPCommunicationError
+from prometheus_client import Counter, Gauge
+from psycopg2.extras import execute_batch
+
+from db_pool import prepare
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+audit_queue_depth = Gauge(
+    'audit_queue_depth',
+    'Audit events waiting to be written'
+)
+audit_events_total = Counter(
+    'audit_events_total',
+    'Audit events handled by the background writer',
+    ['sink', 'status']
+)
+
+AUDIT_INSERT_SQL = """
+    INSERT INTO audit_logs (timestamp, action, actor_dn, target_dn, old_value, new_value,
+                            old_json, new_json, ip_address, status)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+"""
+AUDIT_INSERT_EXECUTE = (
+    "EXECUTE audit_insert (%(timestamp)s, %(action)s, %(actor_dn)s, %(target_dn)s, "
+    "%(old_value)s, %(new_value)s, %(old_json)s, %(new_json)s, %(ip_address)s, %(status)s)"
+)
+
+SINKS = ('postgres', 'ldap')
+
+
+class AuditWriter:
+    """Batches audit events to PostgreSQL and the LDAP audit DSA off the request path"""
+
+    def __init__(self, db_pool, ldap_pool, base_dn: str, spill_dir: str,
+                 max_queue: int = 10000, batch_size: int = 200, flush_interval: float = 1.0,
+                 jsonb_diffs: bool = False):
+        self.db_pool = db_pool
+        self.ldap_pool = ldap_pool
+        self.base_dn = base_dn
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.jsonb_diffs = jsonb_diffs
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _ensure_started(self):
+        """Start the writer thread lazily so every forked worker gets its own"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, event: Dict):
+        """Queue an event; never blocks the caller"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            audit_queue_depth.set(self._queue.qsize())
+        except queue.Full:
+            logger.warning("Audit queue full, spilling event to disk")
+            for sink in SINKS:
+                self._spill(sink, [event])
+
+    def submit_many(self, events: List[Dict]):
+        """Queue a batch of events; whatever does not fit is spilled in one write"""
+        self._ensure_started()
+        for position, event in enumerate(events):
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                logger.warning(f"Audit queue full, spilling {len(events) - position} events to disk")
+                for sink in SINKS:
+                    self._spill(sink, events[position:])
+                break
+        audit_queue_depth.set(self._queue.qsize())
+
+    def stop(self, timeout: float = 5.0):
+        """Flush outstanding events and stop the writer thread"""
+        self._stopping.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            audit_queue_depth.set(self._queue.qsize())
+            if batch:
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logger.error(f"Audit writer error: {e}")
+
+    def _next_batch(self) -> List[Dict]:
+        """Collect up to batch_size events, waiting at most flush_interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Dict]):
+        for sink, write in (('postgres', self._write_postgres), ('ldap', self._write_ldap)):
+            undelivered = write(batch)
+            if undelivered:
+                self._spill(sink, undelivered)
+            else:
+                self._replay(sink, write)
+
+    def _write_postgres(self, batch: List[Dict]) -> List[Dict]:
+        """Run the prepared insert for the whole batch in one round trip;
+        returns the events to spill. Rows PostgreSQL rejects outright
+        (DataError, IntegrityError) are found by retrying row by row and
+        dead-lettered, so one bad event cannot hold back the batch."""
+        try:
+            with self.db_pool.connection() as conn:
+                if conn is None:
+                    return batch
+                try:
+                    with conn.cursor() as cur:
+                        prepare(cur, 'audit_insert', AUDIT_INSERT_SQL)
+                        execute_batch(cur, AUDIT_INSERT_EXECUTE, [self._row(event) for event in batch],
+                                      page_size=self.batch_size)
+                    conn.commit()
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    conn.rollback()
+                    logger.warning(f"Audit batch rejected ({e}), retrying row by row")
+                    return self._write_rows(conn, batch)
+            audit_events_total.labels(sink='postgres', status='written').inc(len(batch))
+            return []
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.error(f"Audit log error: {e}")
+            return batch
+        except Exception as e:
+            logger.error(f"Audit log error: {e}")
+            self._dead_letter('postgres', batch, e)
+            return []
+
+    def _write_rows(self, conn, batch: List[Dict]) -> List[Dict]:
+        """Insert events one transaction each, dead-lettering rejected rows;
+        returns the events to spill if the connection fails midway"""
+        for position, event in enumerate(batch):
+            try:
+                with conn.cursor() as cur:
+                    prepare(cur, 'audit_insert', AUDIT_INSERT_SQL)
+                    cur.execute(AUDIT_INSERT_EXECUTE, self._row(event))
+                conn.commit()
+                audit_events_total.labels(sink='postgres', status='written').inc()
+            except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                conn.rollback()
+                self._dead_letter('postgres', [event], e)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logger.error(f"Audit log error: {e}")
+                return batch[position:]
+        return []
+
+    def _row(self, event: Dict) -> Dict:
+        """Parameters for audit_insert; JSON diffs go to the JSONB columns
+        when jsonb_diffs is enabled, anything else stays TEXT"""
+        row = dict(event, old_json=None, new_json=None)
+        if not self.jsonb_diffs:
+            return row
+        for column in ('old', 'new'):
+            value = event[f'{column}_value']
+            if value is None:
+                continue
+            try:
+                json.loads(value)
+            except (TypeError, ValueError):
+                continue
+            row[f'{column}_json'], row[f'{column}_value'] = value, None
+        return row
+
+    def _write_ldap(self, batch: List[Dict]) -> List[Dict]:
+        """Add the batch over one pooled audit connection; returns the events not written"""
+        done = 0
+        try:
+            with self.ldap_pool.connection() as conn:
+                if not conn:
+                    return batch
+                for event in batch:
+                    audit_dn, audit_entry = self._ldap_entry(event)
+                    try:
+                        added = conn.add(audit_dn, attributes=audit_entry)
+                        error = conn.result['description']
+                    except LDAPCommunicationError:
+                        raise
+                    except Exception as e:
+                        added, error = False, str(e)
+                    if added:
+                        audit_events_total.labels(sink='ldap', status='written').inc()
+                    else:
+                        # Rejected entries would be rejected again on replay
+                        logger.error(f"LDAP audit log error: {error} for {audit_dn}")
+                        audit_events_total.labels(sink='ldap', status='rejected').inc()
+                    done += 1
+            return []
+        except LDAPCommunicationError as e:
+            logger.error(f"LDAP audit log error: {e}")
+            return batch[done:]
+
+    def _ldap_entry(self, event: Dict):
+        timestamp = event['ldap_timestamp']
+        action = event['action']
+        cn = f"{action}-{timestamp}-{event['id']}"
+        audit_dn = f"cn={cn},ou=Audit,{self.base_dn}"
+        audit_entry = {
+            'objectClass': ['top', 'auditEntry'],
+            'cn': cn,
+            'auditTimestamp': timestamp,
+            'auditAction': action,
+            'auditActorDN': event['actor_dn'],
+            'auditTargetDN': event['target_dn'] or '',
+            'auditOldValue': event['old_value'] or '',
+            'auditNewValue': event['new_value'] or '',
+            'auditIP': event['ip_address'] or '',
+            'description': f"{action} performed by {event['actor_dn']}"
+        }
+        return audit_dn, audit_entry
+
+    def _spill_path(self, sink: str) -> str:
+        return os.path.join(self.spill_dir, f"audit-{sink}-{os.getpid()}.jsonl")
+
+    def _dead_letter(self, sink: str, events: List[Dict], error: Exception):
+        """Keep events a sink will never accept out of the replay cycle,
+        under dead-letter/ in the spill directory"""
+        logger.error(f"Audit {sink} rejected {len(events)} events, dead-lettering: {error}")
+        path = os.path.join(self.spill_dir, 'dead-letter', f"audit-{sink}-{os.getpid()}.jsonl")
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    for event in events:
+                        f.write(json.dumps(dict(event, error=str(error))) + '\n')
+            audit_events_total.labels(sink=sink, status='dead_lettered').inc(len(events))
+        except OSError as e:
+            logger.error(f"Audit dead-letter error, {len(events)} {sink} events lost: {e}")
+            audit_events_total.labels(sink=sink, status='lost').inc(len(events))
+
+    @staticmethod
+    def _claimable(path: str) -> bool:
+        """Whether a spill file may be replayed by this process: its own, or
+        one left by a worker that has exited. A live worker may be appending
+        to its file at any moment, so renaming it could lose events. A
+        claimed (.replay) file belongs to the worker that claimed it."""
+        try:
+            if path.endswith('.replay'):
+                pid = int(path.rsplit('.', 2)[1])
+            else:
+                pid = int(path.rsplit('-', 1)[1].split('.', 1)[0])
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            return False
+        return False
+
+    def _spill(self, sink: str, events: List[Dict]):
+        """Append events a sink could not take to this process's spill file"""
+        try:
+            with self._spill_lock:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(sink), 'a', encoding='utf-8') as f:
+                    for event in events:
+                        f.write(json.dumps(event) + '\n')
+            audit_events_total.labels(sink=sink, status='spilled').inc(len(events))
+        except OSError as e:
+            logger.error(f"Audit spill error, {len(events)} {sink} events lost: {e}")
+            audit_events_total.labels(sink=sink, status='lost').inc(len(events))
+
+    def _replay(self, sink: str, write: Callable[[List[Dict]], List[Dict]]):
+        """Deliver spilled events once their sink is reachable again, and
+        those of claimed files whose worker died before delivering them"""
+        pattern = os.path.join(self.spill_dir, f"audit-{sink}-*.jsonl")
+        for path in glob.glob(pattern) + glob.glob(pattern + '.*.replay'):
+            if not self._claimable(path):
+                continue
+            claimed = f"{path.split('.jsonl', 1)[0]}.jsonl.{os.getpid()}.replay"
+            try:
+                with self._spill_lock:
+                    os.rename(path, claimed)
+            except OSError:
+                continue  # claimed by another worker
+
+            with open(claimed, encoding='utf-8') as f:
+                events = (json.loads(line) for line in f if line.strip())
+                batch = []
+                for event in events:
+                    batch.append(event)
+                    if len(batch) < self.batch_size:
+                        continue
+                    undelivered = write(batch)
+                    batch = []
+                    if undelivered:
+                        # Still unavailable: put the remainder back
+                        self._spill(sink, undelivered + list(events))
+                        break
+                if batch:
+                    undelivered = write(batch)
+                    if undelivered:
+                        self._spill(sink, undelivered)
+            os.remove(claimed)
+            logger.info(f"Replayed spilled {sink} audit events from {path}")
+
+
+def make_event(action: str, actor_dn: str, target_dn: str = None,
+               old_value: str = None, new_value: str = None,
+               ip_address: str = None, status: str = 'success', when=None) -> Dict:
+    """Build a queued audit event, stamped with the time of the operation"""
+    when = when or datetime.now()
+    return {
+        'id': uuid.uuid4().hex[:8],
+        'timestamp': when.isoformat(),
+        'ldap_timestamp': when.strftime('%Y%m%d%H%M%S%z'),
+        'action': action,
+        'actor_dn': actor_dn,
+        'target_dn': target_dn,
+        'old_value': old_value,
+        'new_value': new_value,
+        'ip_address': ip_address,
+        'status': status,
+    }
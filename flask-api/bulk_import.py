@@ -0,0 +1,302 @@
+"""
+Bulk LDAP import
+Parallel CSV loader behind scripts/csv_import.py: creates parent OUs up
+front, hashes passwords in a process pool and fans adds out over a pool of
+bound connections, with a resumable checkpoint and a per-row report
+"""
+
+import base64
+import csv
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from ldap3.core.exceptions import LDAPCommunicationError
+from ldap3.utils.dn import to_dn
+
+logger = logging.getLogger(__name__)
+
+REPORT_FIELDS = ['row', 'dn', 'status', 'message']
+
+# LDAP result codes
+ENTRY_ALREADY_EXISTS = 68
+
+
+def hash_password(password: str) -> str:
+    """Hash password using SSHA512"""
+    salt = os.urandom(8)
+    sha = hashlib.sha512()
+    sha.update(password.encode('utf-8'))
+    sha.update(salt)
+    digest = sha.digest()
+    b64 = base64.b64encode(digest + salt).decode('utf-8')
+    return f'{{SSHA512}}{b64}'
+
+
+def ou_path(row: Dict, base_dn: str) -> str:
+    """Container DN for a CSV row, by user type"""
+    user_type = (row.get('type') or 'studentEntry').strip().lower()
+    if user_type == 'studententry':
+        if (row.get('degree_type') or '').lower() == 'postgraduate':
+            return f"ou=Postgraduate,ou=Students,ou=People,{base_dn}"
+        return f"ou=Undergraduate,ou=Students,ou=People,{base_dn}"
+    if user_type == 'facultymember':
+        return f"ou=Faculty,ou=People,{base_dn}"
+    if user_type == 'staffentry':
+        return f"ou=Staff,ou=People,{base_dn}"
+    return f"ou=People,{base_dn}"
+
+
+def _split(value) -> List[str]:
+    values = value.split(',') if isinstance(value, str) else value
+    return [v.strip() for v in values]
+
+
+def build_entry(row: Dict, base_dn: str) -> Tuple[str, Dict, Optional[str]]:
+    """(dn, attributes, plaintext password) for a CSV row; the password is
+    hashed separately so it can happen off the main thread. Raises
+    ValueError for rows that cannot be imported."""
+    user_type = (row.get('type') or 'studentEntry').strip().lower()
+    cn = row.get('cn') or row.get('username')
+    if not cn:
+        raise ValueError('Missing CN/username')
+
+    dn = f"cn={cn},{ou_path(row, base_dn)}"
+
+    # Build attributes
+    attributes = {
+        'objectClass': ['top', 'person', 'organizationalPerson', 'inetOrgPerson'],
+        'cn': cn,
+        'sn': row.get('sn') or cn,
+    }
+
+    if row.get('givenName'):
+        attributes['givenName'] = row['givenName']
+    if row.get('mail'):
+        attributes['mail'] = row['mail']
+
+    # Add type-specific attributes
+    if user_type == 'studententry':
+        attributes['objectClass'].append('studentEntry')
+        for attr in ('rollNumber', 'departmentCode', 'yearOfStudy', 'CGPA', 'hostelBlock'):
+            if row.get(attr):
+                attributes[attr] = row[attr]
+
+    elif user_type == 'facultymember':
+        attributes['objectClass'].append('facultyMember')
+        for attr in ('empID', 'specialization'):
+            if row.get(attr):
+                attributes[attr] = row[attr]
+        for attr in ('researchProjects', 'publications'):
+            if row.get(attr):
+                attributes[attr] = _split(row[attr])
+
+    elif user_type == 'staffentry':
+        attributes['objectClass'].append('staffEntry')
+        for attr in ('empID', 'employeeLevel'):
+            if row.get(attr):
+                attributes[attr] = row[attr]
+
+    return dn, attributes, row.get('password') or None
+
+
+def parent_ous(container_dn: str, base_dn: str) -> List[str]:
+    """container_dn and each of its ancestors below base_dn, shallowest first"""
+    rdns = to_dn(container_dn)
+    depth = len(rdns) - len(to_dn(base_dn))
+    return [','.join(rdns[i:]) for i in range(depth - 1, -1, -1)]
+
+
+class BulkImporter:
+    """Loads CSV rows in batches: hashing in worker processes, adds on
+    `workers` threads sharing an LDAPConnectionPool
+
+    A checkpoint records how many rows have been fully processed after each
+    batch so an interrupted run resumes where it stopped; rows of the
+    interrupted batch that did make it in are reported as 'exists'.
+    """
+
+    def __init__(self, ldap_pool, base_dn: str, workers: int = 8, batch_size: int = 500,
+                 hash_workers: Optional[int] = None, dry_run: bool = False):
+        self.ldap_pool = ldap_pool
+        self.base_dn = base_dn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.hash_workers = os.cpu_count() if hash_workers is None else hash_workers
+        self.dry_run = dry_run
+
+    def ensure_ous(self, containers) -> List[str]:
+        """Create every missing container OU (parents before children)"""
+        ous = sorted({ou for dn in containers for ou in parent_ous(dn, self.base_dn)},
+                     key=lambda dn: len(to_dn(dn)))
+        created = []
+        with self.ldap_pool.connection() as conn:
+            if not conn:
+                raise ConnectionError('LDAP connection failed')
+            for dn in ous:
+                ou = to_dn(dn, decompose=True)[0][1]
+                if conn.add(dn, attributes={'objectClass': ['top', 'organizationalUnit'], 'ou': ou}):
+                    created.append(dn)
+                elif conn.result['result'] != ENTRY_ALREADY_EXISTS:
+                    raise RuntimeError(f"Cannot create {dn}: {conn.result['description']}")
+        return created
+
+    def _add(self, dn: str, attributes: Dict) -> Tuple[str, str]:
+        """(status, message) for one add; retried once on a dropped connection"""
+        for attempt in range(2):
+            try:
+                with self.ldap_pool.connection() as conn:
+                    if not conn:
+                        return 'error', 'LDAP connection failed'
+                    if conn.add(dn, attributes=attributes):
+                        return 'added', ''
+                    if conn.result['result'] == ENTRY_ALREADY_EXISTS:
+                        return 'exists', conn.result['description']
+                    return 'error', conn.result['description']
+            except LDAPCommunicationError as e:
+                if attempt:
+                    return 'error', str(e)
+            except Exception as e:
+                return 'error', str(e)
+
+    @staticmethod
+    def _batches(reader: Iterator[Dict], skip: int, size: int) -> Iterator[List[Tuple[int, Dict]]]:
+        batch = []
+        for number, row in enumerate(reader, start=1):
+            if number <= skip:
+                continue
+            batch.append((number, row))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _load_checkpoint(path: str, csv_path: str) -> Dict[str, int]:
+        """Counts so far, if the checkpoint belongs to this CSV file"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        stat = os.stat(csv_path)
+        if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != stat.st_mtime:
+            logger.warning(f"Ignoring checkpoint {path}: {csv_path} has changed")
+            return {}
+        return dict(checkpoint.get('counts', {}), rows=int(checkpoint.get('rows_done', 0)))
+
+    @staticmethod
+    def _save_checkpoint(path: str, csv_path: str, rows_done: int, counts: Dict[str, int]):
+        stat = os.stat(csv_path)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'csv': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'rows_done': rows_done, 'counts': counts}, f)
+        os.replace(tmp, path)
+
+    def _hash(self, executor, passwords: List[str]) -> List[str]:
+        if executor is None:
+            return [hash_password(p) for p in passwords]
+        chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+        return list(executor.map(hash_password, passwords, chunksize=chunksize))
+
+    def run(self, csv_path: str, checkpoint_path: Optional[str] = None,
+            report_path: Optional[str] = None, resume: bool = True,
+            progress: Optional[Callable[[Dict[str, int]], None]] = None,
+            on_row: Optional[Callable[[int, str, str, str], None]] = None,
+            should_stop: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+        """Import csv_path; returns counts per status plus 'rows' processed
+        and 'total'. progress gets the counts after every batch and on_row
+        each (row, dn, status, message); when should_stop returns True the
+        run ends after the current batch with 'stopped' set and the
+        checkpoint kept."""
+        checkpoint_path = checkpoint_path or f"{csv_path}.checkpoint.json"
+        report_path = report_path or f"{csv_path}.report.csv"
+        counts = {'rows': 0, 'added': 0, 'exists': 0, 'error': 0, 'dry_run': 0}
+        if resume:
+            counts.update(self._load_checkpoint(checkpoint_path, csv_path))
+        skip = counts['rows']
+        if skip:
+            logger.info(f"Resuming {csv_path} after row {skip}")
+
+        # First pass: only container DNs, so the OUs exist before any add
+        containers = set()
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            for counts['total'], row in enumerate(csv.DictReader(f), start=1):
+                containers.add(ou_path(row, self.base_dn))
+        counts.setdefault('total', 0)
+        if not self.dry_run:
+            for dn in self.ensure_ous(containers):
+                logger.info(f"Created {dn}")
+
+        stopped = False
+        hash_executor = ProcessPoolExecutor(self.hash_workers) if self.hash_workers and not self.dry_run else None
+        add_executor = ThreadPoolExecutor(self.workers, thread_name_prefix='ldap-import')
+        report_mode = 'a' if skip and os.path.exists(report_path) else 'w'
+        try:
+            with open(csv_path, 'r', encoding='utf-8', newline='') as f, \
+                    open(report_path, report_mode, encoding='utf-8', newline='') as report_file:
+                report = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+                if report_mode == 'w':
+                    report.writeheader()
+
+                for batch in self._batches(csv.DictReader(f), skip, self.batch_size):
+                    if should_stop and should_stop():
+                        stopped = True
+                        break
+                    results = self._run_batch(batch, hash_executor, add_executor)
+                    for number, dn, status, message in results:
+                        counts[status] += 1
+                        report.writerow({'row': number, 'dn': dn, 'status': status, 'message': message})
+                        if on_row:
+                            on_row(number, dn, status, message)
+                    report_file.flush()
+
+                    counts['rows'] = batch[-1][0]
+                    if not self.dry_run:
+                        self._save_checkpoint(checkpoint_path, csv_path, counts['rows'], counts)
+                    if progress:
+                        progress(dict(counts))
+        finally:
+            add_executor.shutdown(wait=True)
+            if hash_executor is not None:
+                hash_executor.shutdown(wait=True)
+
+        if stopped:
+            counts['stopped'] = True
+        elif not self.dry_run and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return counts
+
+    def _run_batch(self, batch: List[Tuple[int, Dict]], hash_executor,
+                   add_executor) -> List[Tuple[int, str, str, str]]:
+        """(row, dn, status, message) for every row of the batch, in order"""
+        results, entries = {}, []
+        for number, row in batch:
+            try:
+                dn, attributes, password = build_entry(row, self.base_dn)
+            except ValueError as e:
+                results[number] = ('', 'error', str(e))
+                continue
+            entries.append((number, dn, attributes, password))
+
+        if self.dry_run:
+            for number, dn, _, _ in entries:
+                results[number] = (dn, 'dry_run', '')
+        else:
+            with_password = [entry for entry in entries if entry[3]]
+            hashed = self._hash(hash_executor, [entry[3] for entry in with_password])
+            for (_, _, attributes, _), value in zip(with_password, hashed):
+                attributes['userPassword'] = value
+
+            futures = [(number, dn, add_executor.submit(self._add, dn, attributes))
+                       for number, dn, attributes, _ in entries]
+            for number, dn, future in futures:
+                status, message = future.result()
+                results[number] = (dn, status, message)
+
+        return [(number,) + results[number] for number, _ in batch]
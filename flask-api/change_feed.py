@@ -0,0 +1,500 @@
+"""
+Directory change feed
+Follows the master with the LDAP Content Synchronization operation
+(RFC 4533, served by OpenLDAP's syncprov overlay) in refreshAndPersist mode
+and turns its messages into normalized change events. One worker holds a
+Redis lock and runs the sync session; it keeps the sync cookie and an
+entryUUID -> DN map in Redis so a restart resumes where it stopped, and
+publishes events on a Redis channel that every worker dispatches to its
+local handlers.
+"""
+
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import ldap3
+from ldap3.core.exceptions import LDAPException, LDAPSessionTerminatedByServerError
+from ldap3.protocol.controls import build_control
+from prometheus_client import Counter, Gauge
+from pyasn1.codec.ber import decoder
+from pyasn1.type import namedtype, namedval, tag, univ
+
+from ldap_search import json_value
+from redis_lock import RedisLock
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+change_feed_events_total = Counter(
+    'change_feed_events_total',
+    'Directory change events read from the sync session',
+    ['action']
+)
+change_feed_leader = Gauge(
+    'change_feed_leader',
+    'Whether this worker runs the directory sync session'
+)
+
+SYNC_REQUEST_OID = '1.3.6.1.4.1.4203.1.9.1.1'
+SYNC_STATE_OID = '1.3.6.1.4.1.4203.1.9.1.2'
+SYNC_DONE_OID = '1.3.6.1.4.1.4203.1.9.1.3'
+SYNC_INFO_OID = '1.3.6.1.4.1.4203.1.9.1.4'
+
+# resultCode telling the client its cookie is no longer usable
+E_SYNC_REFRESH_REQUIRED = 4096
+
+# RFC 4533 control and message values
+
+class SyncRequestValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('mode', univ.Enumerated(
+            namedValues=namedval.NamedValues(('refreshOnly', 1), ('refreshAndPersist', 3)))),
+        namedtype.OptionalNamedType('cookie', univ.OctetString()),
+        namedtype.DefaultedNamedType('reloadHint', univ.Boolean(False)),
+    )
+
+
+class SyncStateValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('state', univ.Enumerated(
+            namedValues=namedval.NamedValues(('present', 0), ('add', 1), ('modify', 2), ('delete', 3)))),
+        namedtype.NamedType('entryUUID', univ.OctetString()),
+        namedtype.OptionalNamedType('cookie', univ.OctetString()),
+    )
+
+
+class SyncDoneValue(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.OptionalNamedType('cookie', univ.OctetString()),
+        namedtype.DefaultedNamedType('refreshDeletes', univ.Boolean(False)),
+    )
+
+
+class _RefreshDone(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.OptionalNamedType('cookie', univ.OctetString()),
+        namedtype.DefaultedNamedType('refreshDone', univ.Boolean(True)),
+    )
+
+
+class _RefreshDelete(_RefreshDone):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 1))
+
+
+class _RefreshPresent(_RefreshDone):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 2))
+
+
+class _SyncIdSet(univ.Sequence):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 3))
+    componentType = namedtype.NamedTypes(
+        namedtype.OptionalNamedType('cookie', univ.OctetString()),
+        namedtype.DefaultedNamedType('refreshDeletes', univ.Boolean(False)),
+        namedtype.NamedType('syncUUIDs', univ.SetOf(componentType=univ.OctetString())),
+    )
+
+
+class SyncInfoValue(univ.Choice):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('newcookie', univ.OctetString().subtype(
+            implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+        namedtype.NamedType('refreshDelete', _RefreshDelete()),
+        namedtype.NamedType('refreshPresent', _RefreshPresent()),
+        namedtype.NamedType('syncIdSet', _SyncIdSet()),
+    )
+
+
+def sync_request_control(cookie: Optional[bytes] = None, persist: bool = True):
+    value = SyncRequestValue()
+    value['mode'] = 'refreshAndPersist' if persist else 'refreshOnly'
+    if cookie:
+        value['cookie'] = cookie
+    return build_control(SYNC_REQUEST_OID, True, value)
+
+
+def _optional(value, name):
+    component = value[name]
+    return bytes(component) if component.isValue else None
+
+
+def _control_value(response: Dict, oid: str) -> Optional[bytes]:
+    control = (response.get('controls') or {}).get(oid)
+    return control['value'] if control else None
+
+
+def decode_sync_state(value: bytes) -> Dict:
+    decoded, _ = decoder.decode(value, asn1Spec=SyncStateValue())
+    return {
+        'state': str(decoded['state'].prettyPrint()),
+        'entry_uuid': str(uuid.UUID(bytes=bytes(decoded['entryUUID']))),
+        'cookie': _optional(decoded, 'cookie'),
+    }
+
+
+def decode_sync_done(value: Optional[bytes]) -> Dict:
+    if not value:
+        return {'cookie': None, 'refresh_deletes': False}
+    decoded, _ = decoder.decode(value, asn1Spec=SyncDoneValue())
+    return {'cookie': _optional(decoded, 'cookie'), 'refresh_deletes': bool(decoded['refreshDeletes'])}
+
+
+def decode_sync_info(value: bytes) -> Dict:
+    """{'kind': newcookie|refreshDelete|refreshPresent|syncIdSet, 'cookie', ...}"""
+    decoded, _ = decoder.decode(value, asn1Spec=SyncInfoValue())
+    kind = decoded.getName()
+    component = decoded.getComponent()
+    if kind == 'newcookie':
+        return {'kind': kind, 'cookie': bytes(component)}
+    info = {'kind': kind, 'cookie': _optional(component, 'cookie')}
+    if kind == 'syncIdSet':
+        info['refresh_deletes'] = bool(component['refreshDeletes'])
+        info['uuids'] = [str(uuid.UUID(bytes=bytes(value))) for value in component['syncUUIDs']]
+    else:
+        info['refresh_done'] = bool(component['refreshDone'])
+    return info
+
+
+def change_event(action: str, dn: Optional[str], entry_uuid: Optional[str] = None,
+                 attributes: Optional[Dict] = None, previous_dn: Optional[str] = None) -> Dict:
+    """A normalized change: action is add, modify, rename, delete or resync
+    (anything may have changed; dn is None)"""
+    event = {'action': action, 'dn': dn, 'entry_uuid': entry_uuid,
+             'timestamp': datetime.now().isoformat()}
+    if attributes is not None:
+        event['attributes'] = attributes
+    if previous_dn is not None:
+        event['previous_dn'] = previous_dn
+    return event
+
+
+class SyncRefreshRequired(LDAPException):
+    """The server no longer accepts our cookie; the next session starts over"""
+
+
+class _SyncSession:
+    """State of one sync operation: turns each LDAP message into events and
+    tracks the cookie and the entryUUID -> DN map"""
+
+    def __init__(self, cookie: Optional[bytes], uuids: Dict[str, str]):
+        self.cookie = cookie
+        self.uuids = uuids
+        # Without a cookie the refresh stage is the whole directory: take it
+        # as the baseline instead of reporting every entry as added
+        self.baseline = cookie is None
+        self.refreshing = True
+        self.present = set()
+        self.mapped = {}
+        self.saved_cookie = cookie
+
+    def _map(self, entry_uuid: str, dn: Optional[str]):
+        if dn is None:
+            self.uuids.pop(entry_uuid, None)
+        else:
+            self.uuids[entry_uuid] = dn
+        self.mapped[entry_uuid] = dn
+
+    def _deleted(self, entry_uuid: str, dn: Optional[str] = None) -> Optional[Dict]:
+        dn = dn or self.uuids.get(entry_uuid)
+        self._map(entry_uuid, None)
+        if self.baseline:
+            return None
+        # An entry deleted by UUID that was never seen: scope unknown
+        return change_event('delete', dn, entry_uuid) if dn else change_event('resync', None)
+
+    def entry(self, response: Dict) -> List[Dict]:
+        value = _control_value(response, SYNC_STATE_OID)
+        if value is None:
+            return []
+        state = decode_sync_state(value)
+        if state['cookie']:
+            self.cookie = state['cookie']
+        entry_uuid, dn = state['entry_uuid'], response['dn']
+        if self.refreshing:
+            self.present.add(entry_uuid)
+        if state['state'] == 'present':
+            return []
+        if state['state'] == 'delete':
+            event = self._deleted(entry_uuid, dn)
+            return [event] if event else []
+
+        attributes = {attr: [json_value(v) for v in (values if isinstance(values, list) else [values])]
+                      for attr, values in response.get('attributes', {}).items()}
+        previous_dn = self.uuids.get(entry_uuid)
+        self._map(entry_uuid, dn)
+        if self.baseline:
+            return []
+        if previous_dn is None:
+            return [change_event('add', dn, entry_uuid, attributes)]
+        if previous_dn.lower() != dn.lower():
+            return [change_event('rename', dn, entry_uuid, attributes, previous_dn=previous_dn)]
+        return [change_event('modify', dn, entry_uuid, attributes)]
+
+    def info(self, response: Dict) -> List[Dict]:
+        if response.get('responseName') != SYNC_INFO_OID:
+            return []
+        info = decode_sync_info(response['responseValue'])
+        if info['cookie']:
+            self.cookie = info['cookie']
+        events = []
+        if info['kind'] == 'syncIdSet':
+            if info['refresh_deletes']:
+                events = [event for event in map(self._deleted, info['uuids']) if event]
+            else:
+                self.present.update(info['uuids'])
+        elif info['kind'] == 'refreshPresent' and info['refresh_done'] and self.refreshing:
+            # Present phase: whatever the server did not mention is gone
+            events = [event for event in map(self._deleted, set(self.uuids) - self.present) if event]
+        if info['kind'] in ('refreshPresent', 'refreshDelete') and info['refresh_done'] and self.refreshing:
+            events.extend(self._refresh_done())
+        return events
+
+    def _refresh_done(self) -> List[Dict]:
+        self.refreshing = False
+        present, self.present = self.present, set()
+        if not self.baseline:
+            return []
+        # The baseline listed every entry: forget UUIDs left by older sessions
+        for entry_uuid in set(self.uuids) - present:
+            self._map(entry_uuid, None)
+        self.baseline = False
+        return [change_event('resync', None)]
+
+    def done(self, response: Dict) -> List[Dict]:
+        """searchResDone: the session is over (refreshOnly, or the server
+        ended it)"""
+        done = decode_sync_done(_control_value(response, SYNC_DONE_OID))
+        if done['cookie']:
+            self.cookie = done['cookie']
+        if response.get('result') == E_SYNC_REFRESH_REQUIRED:
+            raise SyncRefreshRequired(response.get('message') or 'sync refresh required')
+        if response.get('result') != 0:
+            raise LDAPException(f"Sync search failed: {response.get('description')}")
+        return self._refresh_done() if self.refreshing else []
+
+    def take_map_changes(self) -> Dict[str, Optional[str]]:
+        mapped, self.mapped = self.mapped, {}
+        return mapped
+
+
+class ChangeFeed:
+    """Runs the sync session in the worker holding the leader lock and hands
+    its events to registered handlers.
+
+    Handlers registered with every_worker=True run in each worker (events
+    travel over the Redis channel), the others only in the leader, once
+    per change for the whole deployment. Both receive a list of events.
+    """
+
+    def __init__(self, uri: str, bind_dn: str, bind_password: str, base_dn: str,
+                 attributes: List[str], redis_client=None, key_prefix: str = 'ldap:changes:',
+                 lock_ttl: float = 30.0, retry_interval: float = 5.0, timeout: float = 10.0):
+        self.server = ldap3.Server(uri, get_info=ldap3.NONE, connect_timeout=timeout)
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.base_dn = base_dn
+        self.attributes = attributes
+        self.redis_client = redis_client
+        self.channel = key_prefix + 'events'
+        self.cookie_key = key_prefix + 'cookie'
+        self.uuids_key = key_prefix + 'uuids'
+        self.lock = RedisLock(redis_client, key_prefix + 'leader', lock_ttl)
+        self.lock_ttl = lock_ttl
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._handlers = []
+        self._cookie = None
+        self._uuids = {}
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def on_change(self, handler: Callable[[List[Dict]], None], every_worker: bool = False):
+        self._handlers.append((handler, every_worker))
+
+    def start(self):
+        """Start the sync and channel threads lazily so every forked worker
+        gets its own"""
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+                return
+            self._pid = os.getpid()
+            self.lock.reset_token()
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._run, name='change-feed', daemon=True)]
+            if self.redis_client is not None:
+                self._threads.append(threading.Thread(target=self._listen, name='change-feed-listen', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.lock.release()
+
+    # Dispatch
+
+    def _call(self, events: List[Dict], every_worker: bool):
+        for handler, handler_every_worker in self._handlers:
+            if handler_every_worker == every_worker:
+                try:
+                    handler(events)
+                except Exception as e:
+                    logger.error(f"Change feed handler error: {e}")
+
+    def _publish(self, events: List[Dict]):
+        for event in events:
+            change_feed_events_total.labels(action=event['action']).inc()
+        self._call(events, every_worker=False)
+        if self.redis_client is None:
+            self._call(events, every_worker=True)
+            return
+        try:
+            self.redis_client.publish(self.channel, json.dumps(events, default=str))
+        except Exception as e:
+            logger.error(f"Change feed cannot publish events: {e}")
+
+    def _listen(self):
+        """Deliver the leader's events to this worker's handlers"""
+        while not self._stopping.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self._call(json.loads(message['data']), every_worker=True)
+            except Exception as e:
+                logger.warning(f"Change feed channel error: {e}")
+                self._stopping.wait(self.retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    # Leadership and sync state
+
+    def _load_state(self):
+        """(cookie, entryUUID -> DN) saved by the last leader"""
+        if self.redis_client is None:
+            return self._cookie, dict(self._uuids)
+        cookie = self.redis_client.get(self.cookie_key)
+        uuids = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+                 for k, v in self.redis_client.hgetall(self.uuids_key).items()}
+        return cookie, uuids
+
+    def _save_state(self, session: _SyncSession):
+        mapped = session.take_map_changes()
+        if not mapped and session.cookie == session.saved_cookie:
+            return
+        session.saved_cookie = session.cookie
+        if self.redis_client is None:
+            self._cookie, self._uuids = session.cookie, session.uuids
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        removed = [entry_uuid for entry_uuid, dn in mapped.items() if dn is None]
+        stored = {entry_uuid: dn for entry_uuid, dn in mapped.items() if dn is not None}
+        if removed:
+            pipe.hdel(self.uuids_key, *removed)
+        if stored:
+            pipe.hset(self.uuids_key, mapping=stored)
+        if session.cookie:
+            pipe.set(self.cookie_key, session.cookie)
+        pipe.execute()
+
+    def _reset_state(self):
+        if self.redis_client is None:
+            self._cookie = None
+            return
+        self.redis_client.delete(self.cookie_key)
+
+    # Sync session
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self.lock.acquire():
+                self._stopping.wait(self.lock_ttl / 3)
+                continue
+            change_feed_leader.set(1)
+            try:
+                self._follow()
+            except SyncRefreshRequired as e:
+                logger.warning(f"Change feed cookie rejected, starting over: {e}")
+                self._reset_state()
+                continue
+            except Exception as e:
+                logger.error(f"Change feed session error: {e}")
+            finally:
+                change_feed_leader.set(0)
+            self.lock.release()
+            self._stopping.wait(self.retry_interval)
+
+    def _follow(self):
+        """Run one refreshAndPersist session while this worker leads"""
+        # ldap3's persistent search on an ASYNC_STREAM connection hands each
+        # message of the search to a callback (on its receiver thread) and
+        # keeps none of them; notifications=False leaves out its own
+        # persistent search control, so only the sync request is sent
+        conn = ldap3.Connection(self.server, user=self.bind_dn, password=self.bind_password,
+                                client_strategy=ldap3.ASYNC_STREAM, receive_timeout=math.ceil(self.timeout))
+        messages = queue.Queue()
+        try:
+            if not conn.bind():
+                raise LDAPException(f"Change feed bind failed: {conn.result}")
+
+            cookie, uuids = self._load_state()
+            session = _SyncSession(cookie, uuids)
+            conn.extend.standard.persistent_search(
+                self.base_dn, '(objectClass=*)', ldap3.SUBTREE, attributes=self.attributes,
+                controls=[sync_request_control(cookie)], notifications=False, callback=messages.put)
+            logger.info(f"Change feed following {self.server.host} ({'resuming' if cookie else 'from now'})")
+
+            renew_interval = self.lock_ttl / 3
+            renewed_at = time.monotonic()
+            while not self._stopping.is_set():
+                try:
+                    response = messages.get(timeout=min(renew_interval, 1.0))
+                except queue.Empty:
+                    response = {}
+                if time.monotonic() - renewed_at >= renew_interval:
+                    if not self.lock.renew():
+                        logger.warning('Change feed lost the leader lock')
+                        return
+                    renewed_at = time.monotonic()
+                if not response and conn.closed:
+                    raise LDAPSessionTerminatedByServerError('sync connection closed')
+                kind = response.get('type')
+                if kind == 'searchResEntry':
+                    events = session.entry(response)
+                elif kind == 'intermediateResponse':
+                    events = session.info(response)
+                elif kind == 'searchResDone':
+                    events = session.done(response)
+                    self._save_state(session)
+                    if events:
+                        self._publish(events)
+                    return
+                else:
+                    continue
+                if events:
+                    self._publish(events)
+                # The baseline refresh is saved once it completes, not per entry
+                if events or kind == 'intermediateResponse' or not session.refreshing:
+                    self._save_state(session)
+        finally:
+            try:
+                conn.unbind()
+            except Exception:
+                pass
@@ -0,0 +1,130 @@
+"""
+PostgreSQL connection pooling
+Thread-safe pool shared by the audit writer, session storage and the
+audit log endpoints, with per-connection prepared statements
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+db_pool_in_use = Gauge(
+    'db_pool_in_use',
+    'Database pool connections currently checked out',
+    ['pool']
+)
+db_pool_max = Gauge(
+    'db_pool_max_connections',
+    'Maximum connections the database pool may open',
+    ['pool']
+)
+db_pool_checkout_duration = Histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a pooled database connection',
+    ['pool']
+)
+db_pool_exhausted_total = Counter(
+    'db_pool_exhausted_total',
+    'Checkouts that timed out because every pooled connection was in use',
+    ['pool']
+)
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers the statements prepared on it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def prepare(cur, name: str, sql: str):
+    """PREPARE sql as name once per connection; later calls are no-ops"""
+    conn = cur.connection
+    if name in conn.prepared:
+        return
+    cur.execute(f"PREPARE {name} AS {sql}")
+    conn.prepared.add(name)
+
+
+class DatabasePool:
+    """Lazily created ThreadedConnectionPool that waits for a free connection
+    instead of failing as soon as maxconn are checked out"""
+
+    def __init__(self, dsn: str, name: str = 'default', minconn: int = 2,
+                 maxconn: int = 10, timeout: float = 5.0):
+        self.dsn = dsn
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        db_pool_max.labels(pool=name).set(maxconn)
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    self.minconn, self.maxconn, self.dsn,
+                    connection_factory=PreparedConnection
+                )
+            return self._pool
+
+    def _checkout(self):
+        start_time = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            db_pool_exhausted_total.labels(pool=self.name).inc()
+            logger.error(f"Database pool {self.name}: exhausted ({self.maxconn} connections in use)")
+            return None
+        try:
+            conn = self._get_pool().getconn()
+        except Exception as e:
+            self._slots.release()
+            logger.error(f"Database connection error: {e}")
+            return None
+        db_pool_checkout_duration.labels(pool=self.name).observe(time.monotonic() - start_time)
+        db_pool_in_use.labels(pool=self.name).inc()
+        return conn
+
+    def _checkin(self, conn):
+        try:
+            self._get_pool().putconn(conn, close=bool(conn.closed))
+        except Exception as e:
+            logger.error(f"Database pool {self.name}: failed to return connection: {e}")
+        finally:
+            db_pool_in_use.labels(pool=self.name).dec()
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection (None if unavailable); rolls back on error"""
+        conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
@@ -0,0 +1,433 @@
+"""
+Dashboard statistics
+Per-OU, per-objectClass, department and year counts plus recent audit
+activity, rebuilt by a background scan in one elected worker, kept current
+between scans by the add/modify/delete handlers and the directory change
+feed, and shared with the other workers through Redis
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from ldap3.utils.dn import to_dn
+from prometheus_client import Gauge, Histogram
+
+from ldap_search import iter_paged
+from redis_lock import RedisLock
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+stats_refresh_duration = Histogram(
+    'directory_stats_refresh_seconds',
+    'Time spent rebuilding the dashboard statistics'
+)
+stats_entries = Gauge(
+    'directory_stats_entries',
+    'Entries counted by the last dashboard statistics refresh'
+)
+
+STATS_ATTRIBUTES = ['objectClass', 'departmentCode', 'yearOfStudy']
+
+RECENT_ACTIVITY_SQL = """
+    SELECT action, COUNT(*) FROM audit_logs
+    WHERE timestamp >= %s
+    GROUP BY action
+"""
+
+
+def _values(attributes: Dict, name: str) -> list:
+    for attr, values in (attributes or {}).items():
+        if attr.lower() == name.lower():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            return [str(value) for value in values if value not in (None, '')]
+    return []
+
+
+def _key(dn: str) -> str:
+    try:
+        return ','.join(rdn.strip() for rdn in to_dn(dn.lower()))
+    except Exception:
+        return dn.lower()
+
+
+def _tracked(attributes: Dict) -> Dict[str, list]:
+    return {name: _values(attributes, name) for name in STATS_ATTRIBUTES}
+
+
+def parent_dn(dn: str) -> str:
+    """DN of the entry's parent, normalized to lower case"""
+    try:
+        return ','.join(rdn.strip() for rdn in to_dn(dn.lower())[1:])
+    except Exception:
+        return dn.lower().split(',', 1)[-1]
+
+
+class DirectoryStats:
+    """Aggregated directory counts served from memory
+
+    One worker, elected with a Redis lock, keeps the tracked attributes of
+    every entry: it rescans the directory every refresh_interval seconds,
+    applies changes in between and publishes the resulting counts to Redis,
+    from which the other workers serve /stats. Those workers hand the writes
+    and audit activity they see to the refresher through a Redis list; with
+    follow_feed set their writes are left to the change feed, which reports
+    them to the refresher anyway. Without Redis every worker does it all.
+    Because the refresher keeps each entry's attributes, a change reported
+    both by a write and by the feed is only counted once.
+    """
+
+    def __init__(self, base_dn: str, connection: Callable, db_pool=None,
+                 refresh_interval: float = 300.0, activity_window: float = 86400.0,
+                 page_size: int = 500, redis_client=None, key_prefix: str = 'ldap:stats:',
+                 lock_ttl: float = 30.0, publish_interval: float = 1.0, follow_feed: bool = False,
+                 max_inbox: int = 100000):
+        self.base_dn = base_dn
+        self.connection = connection
+        self.db_pool = db_pool
+        self.refresh_interval = refresh_interval
+        self.activity_window = activity_window
+        self.page_size = page_size
+        self.redis_client = redis_client
+        self.snapshot_key = key_prefix + 'snapshot'
+        self.inbox_key = key_prefix + 'inbox'
+        self.lock = RedisLock(redis_client, key_prefix + 'leader', lock_ttl)
+        self.publish_interval = publish_interval
+        self.follow_feed = follow_feed
+        self.max_inbox = max_inbox
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._leading = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._dirty = False
+        self._refresh_requested = False
+        self._published = None
+        self._published_at = 0.0
+        # Changes for the refresher, pushed to its inbox by the refresh
+        # thread so writers (event loop included) never wait on Redis
+        self._outbox = deque(maxlen=max_inbox)
+        self._reset()
+
+    def _reset(self):
+        """Forget the counts (on losing the lead they are served from Redis)"""
+        self._total = 0
+        self._counts = {name: Counter() for name in ('ou', 'object_class', 'department', 'year')}
+        self._names = {}
+        self._entries: Dict[str, Dict[str, list]] = {}
+        self._activity = Counter()
+        self._recent = deque()
+        self._refreshed_at = None
+
+    def _ensure_started(self):
+        """Start the refresh and lock threads lazily so every forked worker
+        gets its own"""
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+                return
+            self._pid = os.getpid()
+            self.lock.reset_token()
+            self._leading.clear()
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._hold_lock, name='directory-stats-lock', daemon=True),
+                             threading.Thread(target=self._run, name='directory-stats', daemon=True)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._leading.is_set():
+            self._leading.clear()
+            self.lock.release()
+
+    def leading(self) -> bool:
+        return self.redis_client is None or self._leading.is_set()
+
+    def _hold_lock(self):
+        """Take or keep the refresher lock, apart from the (possibly long) scans"""
+        while not self._stopping.is_set():
+            if self._leading.is_set():
+                if not self.lock.renew():
+                    logger.warning('Directory stats lost the refresher lock')
+                    self._leading.clear()
+            elif self.lock.acquire():
+                logger.info('Directory stats refresher elected')
+                self._leading.set()
+                self._wake.set()
+            self._stopping.wait(self.lock.ttl / 3)
+
+    def _run(self):
+        next_refresh = 0.0
+        led = False
+        while not self._stopping.is_set():
+            self._send_outbox()
+            leading = self.leading()
+            if led and not leading:
+                with self._lock:
+                    self._reset()
+            if leading:
+                try:
+                    if not led or self._refresh_requested or time.monotonic() >= next_refresh:
+                        self._refresh_requested = False
+                        next_refresh = time.monotonic() + self.refresh_interval
+                        self.refresh()
+                    self._drain()
+                    self._publish()
+                except Exception as e:
+                    logger.error(f"Directory stats refresh error: {e}")
+            led = leading
+            self._wake.wait(self.publish_interval if self.redis_client is not None else self.refresh_interval)
+            self._wake.clear()
+
+    def request_refresh(self):
+        """Rescan now rather than at the next interval (done by the refresher)"""
+        self._refresh_requested = True
+        self._wake.set()
+
+    def refresh(self):
+        """Rebuild every count from a paged scan and the audit table"""
+        start_time = time.monotonic()
+        counts, names, entries = {name: Counter() for name in self._counts}, {}, {}
+        with self.connection() as conn:
+            if not conn:
+                raise ConnectionError('no LDAP connection for statistics')
+            for entry in iter_paged(conn, self.base_dn, '(objectClass=*)', STATS_ATTRIBUTES, self.page_size):
+                tracked = _tracked(entry)
+                entries[_key(entry['dn'])] = tracked
+                self._apply(counts, names, entry['dn'], tracked, 1)
+        total = len(entries)
+
+        activity, activity_since = self._load_activity()
+
+        with self._lock:
+            self._total, self._counts, self._names, self._entries = total, counts, names, entries
+            if activity is not None:
+                # Events recorded from the moment the query started may be
+                # missing from it: keep those, the rest are in activity
+                self._activity = activity
+                while self._recent and self._recent[0][0] < activity_since:
+                    self._recent.popleft()
+            self._refreshed_at = datetime.utcnow()
+            self._dirty = True
+        self._ready.set()
+        stats_entries.set(total)
+        stats_refresh_duration.observe(time.monotonic() - start_time)
+
+    def _load_activity(self):
+        """Audit events per action inside the activity window and the time
+        the query started (None, None if unavailable)"""
+        if self.db_pool is None:
+            return None, None
+        started = datetime.now()
+        since = started - timedelta(seconds=self.activity_window)
+        try:
+            with self.db_pool.connection() as conn:
+                if conn is None:
+                    return None, None
+                with conn.cursor() as cur:
+                    cur.execute(RECENT_ACTIVITY_SQL, (since,))
+                    rows = cur.fetchall()
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Directory stats activity error: {e}")
+            return None, None
+        return Counter({action: count for action, count in rows}), started
+
+    @staticmethod
+    def _apply(counts: Dict[str, Counter], names: Dict[str, str], dn: str, attributes: Dict,
+               sign: int):
+        counts['ou'][parent_dn(dn)] += sign
+        for object_class in _values(attributes, 'objectClass'):
+            key = object_class.lower()
+            names.setdefault(key, object_class)
+            counts['object_class'][key] += sign
+        for department in _values(attributes, 'departmentCode'):
+            counts['department'][department.upper()] += sign
+        for year in _values(attributes, 'yearOfStudy'):
+            counts['year'][year] += sign
+
+    # Changes: applied by the refresher, queued for it by everyone else
+
+    def _replace(self, dn: str, tracked: Optional[Dict[str, list]]):
+        """Swap the counted attributes of dn for tracked (None: the entry is
+        gone); caller holds the lock"""
+        key = _key(dn)
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._total -= 1
+            self._apply(self._counts, self._names, dn, old, -1)
+        if tracked is not None:
+            self._entries[key] = tracked
+            self._total += 1
+            self._apply(self._counts, self._names, dn, tracked, 1)
+        self._dirty = True
+
+    def _handle(self, message: Dict):
+        with self._lock:
+            op = message['op']
+            if op == 'replace':
+                self._replace(message['dn'], message['tracked'])
+            elif op == 'delete':
+                self._replace(message['dn'], None)
+            elif op == 'modify':
+                tracked = dict(self._entries.get(_key(message['dn'])) or message['old'])
+                tracked.update(message['changes'])
+                self._replace(message['dn'], tracked)
+            elif op == 'activity':
+                self._recent.append((datetime.fromisoformat(message['at']), message['action']))
+                self._dirty = True
+
+    def _submit(self, message: Dict, source: str = 'api'):
+        """Apply a change here if this worker is the refresher, else queue it
+        for the refresher (feed changes already reach it directly); never
+        touches Redis"""
+        self._ensure_started()
+        if self.leading():
+            self._handle(message)
+        elif source == 'feed' or (self.follow_feed and message['op'] != 'activity'):
+            return
+        else:
+            self._outbox.append(message)
+            self._wake.set()
+
+    def _send_outbox(self):
+        """Push queued changes to the refresher's inbox in one round trip,
+        or apply them here if this worker has become the refresher"""
+        messages = []
+        while self._outbox:
+            messages.append(self._outbox.popleft())
+        if not messages:
+            return
+        if self.leading():
+            for message in messages:
+                self._handle(message)
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.rpush(self.inbox_key, *[json.dumps(message) for message in messages])
+            pipe.ltrim(self.inbox_key, -self.max_inbox, -1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Directory stats cannot queue {len(messages)} changes: {e}")
+
+    def _drain(self, batch: int = 1000):
+        """Apply the changes other workers queued"""
+        if self.redis_client is None:
+            return
+        while True:
+            messages = self.redis_client.lpop(self.inbox_key, batch)
+            for message in messages or []:
+                try:
+                    self._handle(json.loads(message))
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Directory stats skipped a malformed change: {e}")
+            if not messages or len(messages) < batch:
+                return
+
+    def entry_changed(self, dn: str, attributes: Dict, source: str = 'api'):
+        """dn now exists with attributes (which include every tracked one)"""
+        self._submit({'op': 'replace', 'dn': dn, 'tracked': _tracked(attributes)}, source)
+
+    def entry_added(self, dn: str, attributes: Dict, source: str = 'api'):
+        self.entry_changed(dn, attributes, source)
+
+    def entry_deleted(self, dn: str, attributes: Dict = None, source: str = 'api'):
+        self._submit({'op': 'delete', 'dn': dn}, source)
+
+    def entry_modified(self, dn: str, old_attributes: Dict, new_attributes: Dict, source: str = 'api'):
+        """Move counts for the tracked attributes that a modify replaced"""
+        names = {name.lower(): name for name in STATS_ATTRIBUTES}
+        changes = {names[attr.lower()]: _values(new_attributes, attr)
+                   for attr in new_attributes if attr.lower() in names}
+        if changes:
+            self._submit({'op': 'modify', 'dn': dn, 'old': _tracked(old_attributes), 'changes': changes}, source)
+
+    def record_activity(self, action: str):
+        """Count an audit event made since the last refresh"""
+        self._submit({'op': 'activity', 'action': action, 'at': datetime.now().isoformat()})
+
+    # Serving
+
+    def _publish(self):
+        """Share the counts with the other workers when they changed"""
+        if self.redis_client is None or not self._ready.is_set():
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        try:
+            self.redis_client.set(self.snapshot_key, json.dumps(self._local_snapshot()))
+        except Exception as e:
+            logger.warning(f"Directory stats cannot publish counts: {e}")
+            self._dirty = True
+
+    def _fetch_published(self) -> Optional[Dict]:
+        """Counts published by the refresher, re-read at most every
+        publish_interval seconds"""
+        now = time.monotonic()
+        if self._published is None or now - self._published_at >= self.publish_interval:
+            try:
+                value = self.redis_client.get(self.snapshot_key)
+            except Exception as e:
+                logger.warning(f"Directory stats cannot read published counts: {e}")
+                value = None
+            if value:
+                self._published, self._published_at = json.loads(value), now
+                self._ready.set()
+        return self._published
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Start the background threads and wait for the first counts"""
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        while not self._ready.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.redis_client is not None and not self.leading():
+                self._fetch_published()
+            self._ready.wait(min(remaining, self.publish_interval))
+        return self._ready.is_set()
+
+    def snapshot(self) -> Dict:
+        if not self.leading():
+            published = self._fetch_published()
+            if published is not None:
+                return published
+        return self._local_snapshot()
+
+    def _local_snapshot(self) -> Dict:
+        with self._lock:
+            counts = {name: {key: value for key, value in counter.items() if value > 0}
+                      for name, counter in self._counts.items()}
+            counts['object_class'] = {self._names.get(key, key): value
+                                      for key, value in counts['object_class'].items()}
+            activity = Counter(self._activity)
+            activity.update(action for when, action in self._recent)
+            return {
+                'total_entries': self._total,
+                'by_ou': counts['ou'],
+                'by_object_class': counts['object_class'],
+                'by_department': counts['department'],
+                'by_year': counts['year'],
+                'recent_activity': {
+                    'window_seconds': self.activity_window,
+                    'total': sum(activity.values()),
+                    'by_action': dict(activity),
+                },
+                'refreshed_at': self._refreshed_at.isoformat() if self._refreshed_at else None,
+            }
@@ -0,0 +1,308 @@
+"""
+Directory change events for websocket clients
+Coalesces ldap_update events over a short window and emits them to
+per-subtree Socket.IO rooms. With Flask-SocketIO's Redis message queue the
+emits reach clients on every worker, and Redis hashes counting subscribers
+per room let each worker skip subtrees nobody is watching. Each worker keeps
+its own hash under a TTL it renews, so a killed worker's rooms expire.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from prometheus_client import Counter
+
+from rbac import normalize_dn
+
+logger = logging.getLogger(__name__)
+
+ROOM_PREFIX = 'subtree:'
+
+# Prometheus metrics
+ws_events_total = Counter(
+    'ws_events_total',
+    'Directory change events handled by the websocket event bus',
+    ['stage']
+)
+ws_messages_total = Counter(
+    'ws_messages_total',
+    'ldap_update messages emitted to subtree rooms'
+)
+
+
+def _room(rdns) -> str:
+    return ROOM_PREFIX + ','.join(reversed(rdns))
+
+
+def subtree_room(dn: str) -> str:
+    """Room of the subtree rooted at dn; raises ValueError"""
+    return _room(normalize_dn(dn))
+
+
+def ancestor_rooms(dn: str) -> List[str]:
+    """Rooms whose subtree contains dn, suffix first; raises ValueError"""
+    rdns = normalize_dn(dn)
+    return [_room(rdns[:depth]) for depth in range(1, len(rdns) + 1)]
+
+
+class EventBus:
+    """Queues change events and emits them in coalesced batches to the rooms
+    of every subtree containing them; tracks which rooms each client is in.
+
+    A client's rooms never overlap (joining a subtree already covered is a
+    no-op, joining an ancestor leaves the descendants), so every event
+    reaches a client at most once.
+    """
+
+    def __init__(self, socketio, redis_client=None, window: float = 0.25, max_operations: int = 100,
+                 room_refresh: float = 1.0, key: str = 'ldap:ws:rooms', namespace: str = '/',
+                 follow_feed: bool = False, room_ttl: float = 30.0):
+        self.socketio = socketio
+        self.redis_client = redis_client
+        self.window = window
+        self.max_operations = max_operations
+        self.room_refresh = room_refresh
+        self.key = key
+        self.room_ttl = room_ttl
+        self.namespace = namespace
+        # With the change feed running it reports every write, the API's
+        # included, so the API's own publishes would only duplicate them
+        self.follow_feed = follow_feed
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._clients: Dict[str, Dict] = {}
+        self._clients_lock = threading.Lock()
+        self._active: Optional[Set[str]] = None
+        self._active_at = 0.0
+        # This worker's room counts live in their own hash, listed in a
+        # sorted set of workers scored by when their hash expires
+        self._workers_key = f'{key}:workers'
+        self._worker_key = None
+        self._renewed_at = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _ensure_started(self):
+        """Start the flush thread lazily so every forked worker gets its own"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._worker_key = f'{self.key}:{socket.gethostname()}:{self._pid}'
+            self._renewed_at = None
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify()
+        if self.redis_client is not None and self._worker_key:
+            try:
+                self.redis_client.zrem(self._workers_key, self._worker_key)
+                self.redis_client.delete(self._worker_key)
+            except Exception:
+                pass
+
+    # Publishing
+
+    def publish(self, action: str, dn: str, when: datetime = None):
+        self.publish_many([{'action': action, 'dn': dn}], when)
+
+    def publish_many(self, changes: Iterable[Dict], when: datetime = None, source: str = 'api'):
+        """Queue changes ({'action', 'dn'}); within a window only the latest
+        change per DN is kept, and an entry added then deleted is dropped"""
+        if self.follow_feed and source != 'feed':
+            return
+        self._ensure_started()
+        timestamp = (when or datetime.now()).isoformat()
+        count = 0
+        with self._cond:
+            for change in changes:
+                count += 1
+                key = change['dn'].lower()
+                action = change['action']
+                previous = self._pending.pop(key, None)
+                if previous is not None and previous['action'] == 'add':
+                    if action == 'delete':
+                        continue
+                    action = 'add'
+                self._pending[key] = {'action': action, 'dn': change['dn'], 'timestamp': timestamp}
+            self._cond.notify()
+        ws_events_total.labels(stage='published').inc(count)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._renew_rooms()
+            with self._cond:
+                if not self._pending and not self._stopping.is_set():
+                    self._cond.wait(self.room_ttl / 3)
+                if not self._pending:
+                    continue
+            # Let the rest of a bulk operation arrive before emitting
+            self._stopping.wait(self.window)
+            with self._cond:
+                events, self._pending = list(self._pending.values()), OrderedDict()
+            if events:
+                try:
+                    self._flush(events)
+                except Exception as e:
+                    logger.error(f"Event bus flush error: {e}")
+
+    def _message(self, events: List[Dict]) -> Dict:
+        if len(events) == 1:
+            return events[0]
+        return {
+            'action': 'batch',
+            'count': len(events),
+            'operations': [{'action': e['action'], 'dn': e['dn']} for e in events[:self.max_operations]],
+            'truncated': len(events) > self.max_operations,
+            'timestamp': events[-1]['timestamp'],
+        }
+
+    def _flush(self, events: List[Dict]):
+        active = self._active_rooms()
+        by_room = OrderedDict()
+        for event in events:
+            try:
+                rooms = ancestor_rooms(event['dn'])
+            except ValueError:
+                continue
+            for room in rooms:
+                if active is None or room in active:
+                    by_room.setdefault(room, []).append(event)
+        for room, room_events in by_room.items():
+            self.socketio.emit('ldap_update', self._message(room_events), to=room, namespace=self.namespace)
+        ws_events_total.labels(stage='emitted').inc(len(events))
+        ws_messages_total.inc(len(by_room))
+
+    def _active_rooms(self) -> Optional[Set[str]]:
+        """Rooms with subscribers on any worker (cached for room_refresh
+        seconds); None when unknown, meaning every room"""
+        if self.redis_client is None:
+            return None
+        now = time.monotonic()
+        if self._active is None or now - self._active_at >= self.room_refresh:
+            try:
+                self.redis_client.zremrangebyscore(self._workers_key, '-inf', time.time())
+                workers = self.redis_client.zrange(self._workers_key, 0, -1)
+                pipe = self.redis_client.pipeline(transaction=False)
+                for worker in workers:
+                    pipe.hgetall(worker)
+                counts = pipe.execute()
+            except Exception as e:
+                logger.warning(f"Event bus cannot read active rooms: {e}")
+                return None
+            self._active = {room.decode() if isinstance(room, bytes) else room
+                            for worker_counts in counts
+                            for room, count in worker_counts.items() if int(count) > 0}
+            self._active_at = now
+        return self._active
+
+    # Subscriptions
+
+    def _room_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._clients_lock:
+            for client in self._clients.values():
+                for room in client['rooms']:
+                    counts[room] = counts.get(room, 0) + 1
+        return counts
+
+    def _renew_rooms(self):
+        """Rewrite this worker's room counts from its clients and push their
+        expiry room_ttl seconds out; every room_ttl / 3 seconds"""
+        if self.redis_client is None:
+            return
+        now = time.monotonic()
+        if self._renewed_at is not None and now - self._renewed_at < self.room_ttl / 3:
+            return
+        counts = self._room_counts()
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.delete(self._worker_key)
+            if counts:
+                pipe.hset(self._worker_key, mapping=counts)
+                pipe.pexpire(self._worker_key, int(self.room_ttl * 1000))
+            pipe.zadd(self._workers_key, {self._worker_key: time.time() + self.room_ttl})
+            pipe.execute()
+            self._renewed_at = now
+        except Exception as e:
+            logger.warning(f"Event bus cannot renew room counts: {e}")
+
+    def _count(self, room: str, delta: int):
+        if self._active is not None and delta > 0:
+            self._active.add(room)
+        if self.redis_client is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hincrby(self._worker_key, room, delta)
+            pipe.pexpire(self._worker_key, int(self.room_ttl * 1000))
+            pipe.zadd(self._workers_key, {self._worker_key: time.time() + self.room_ttl})
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Event bus cannot update room count: {e}")
+
+    def register(self, sid: str, identity: str, role: str):
+        self._ensure_started()
+        with self._clients_lock:
+            self._clients[sid] = {'identity': identity, 'role': role, 'rooms': {}}
+
+    def client(self, sid: str) -> Optional[Dict]:
+        with self._clients_lock:
+            return self._clients.get(sid)
+
+    def rooms(self, sid: str) -> List[str]:
+        with self._clients_lock:
+            client = self._clients.get(sid)
+            return sorted(client['rooms']) if client else []
+
+    def subscribe(self, sid: str, dn: str) -> str:
+        """Put sid in the room of dn's subtree; returns the room that now
+        covers dn. Raises ValueError for a bad DN, KeyError for an unknown sid."""
+        rdns = normalize_dn(dn)
+        with self._clients_lock:
+            rooms = self._clients[sid]['rooms']
+            for room, room_rdns in rooms.items():
+                if rdns[:len(room_rdns)] == room_rdns:
+                    return room
+            for room, room_rdns in list(rooms.items()):
+                if room_rdns[:len(rdns)] == rdns:
+                    self._leave(sid, rooms, room)
+            room = _room(rdns)
+            rooms[room] = rdns
+        self.socketio.server.enter_room(sid, room, namespace=self.namespace)
+        self._count(room, 1)
+        return room
+
+    def unsubscribe(self, sid: str, dn: str) -> bool:
+        room = subtree_room(dn)
+        with self._clients_lock:
+            client = self._clients.get(sid)
+            if client is None or room not in client['rooms']:
+                return False
+            self._leave(sid, client['rooms'], room)
+        return True
+
+    def _leave(self, sid: str, rooms: Dict, room: str):
+        del rooms[room]
+        self.socketio.server.leave_room(sid, room, namespace=self.namespace)
+        self._count(room, -1)
+
+    def disconnect(self, sid: str):
+        with self._clients_lock:
+            client = self._clients.pop(sid, None)
+        for room in (client or {}).get('rooms', ()):
+            self._count(room, -1)
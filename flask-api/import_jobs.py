@@ -0,0 +1,195 @@
+"""
+CSV import jobs
+Redis-backed job queue for /import_csv: uploads are spooled to disk, job
+state lives in Redis and a separate worker process runs BulkImporter so
+imports never occupy API workers and survive restarts of either side
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from bulk_import import BulkImporter
+
+logger = logging.getLogger(__name__)
+
+COUNT_FIELDS = ('total', 'rows', 'added', 'exists', 'error')
+FINISHED = ('completed', 'failed', 'cancelled')
+
+
+class ImportJobQueue:
+    """Job records are hashes under {prefix}job:<id>; ids move from the
+    pending list to the processing list while a worker owns them, so a
+    worker that dies mid-import leaves its job to be requeued"""
+
+    def __init__(self, redis_client, upload_dir: str, key_prefix: str = 'ldap:import:',
+                 max_error_rows: int = 1000, stale_after: float = 120.0):
+        self.redis = redis_client
+        self.upload_dir = upload_dir
+        self.prefix = key_prefix
+        self.max_error_rows = max_error_rows
+        self.stale_after = stale_after
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}"
+
+    def _errors_key(self, job_id: str) -> str:
+        return f"{self.prefix}job:{job_id}:errors"
+
+    @property
+    def _pending(self) -> str:
+        return f"{self.prefix}pending"
+
+    @property
+    def _processing(self) -> str:
+        return f"{self.prefix}processing"
+
+    def create(self, stream, owner: str, filename: str, chunk_size: int = 1024 * 1024) -> str:
+        """Copy an upload stream to disk in chunks and queue it; returns the job id"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, f"{job_id}.csv")
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, chunk_size)
+
+        now = time.time()
+        self.redis.hset(self._job_key(job_id), mapping={
+            'id': job_id,
+            'status': 'queued',
+            'owner': owner,
+            'filename': filename or '',
+            'path': path,
+            'bytes': os.path.getsize(path),
+            'created_at': now,
+            'updated_at': now,
+        })
+        self.redis.lpush(self._pending, job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job status with counts, throughput (rows/s) and an ETA while running"""
+        raw = self.redis.hgetall(self._job_key(job_id))
+        if not raw:
+            return None
+        job = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+               for k, v in raw.items()}
+        for field in COUNT_FIELDS + ('bytes',):
+            job[field] = int(job.get(field, 0))
+        for field in ('created_at', 'started_at', 'run_started_at', 'finished_at', 'updated_at'):
+            if field in job:
+                job[field] = float(job[field])
+
+        job['throughput'] = None
+        job['eta_seconds'] = None
+        # Throughput covers the current (or last) run only, not rows done before a restart
+        processed = job['rows'] - int(job.get('resumed_rows', 0))
+        if 'run_started_at' in job and processed > 0:
+            elapsed = job.get('finished_at', job['updated_at']) - job['run_started_at']
+            if elapsed > 0:
+                job['throughput'] = round(processed / elapsed, 1)
+                if job['status'] == 'running' and job['total']:
+                    job['eta_seconds'] = round((job['total'] - job['rows']) / job['throughput'], 1)
+        job.pop('path', None)
+        job.pop('heartbeat', None)
+        job.pop('resumed_rows', None)
+        job.pop('run_started_at', None)
+        job['cancel_requested'] = job.get('cancel_requested') == '1'
+        return job
+
+    def error_rows(self, job_id: str, limit: int = 100) -> List[Dict]:
+        return [json.loads(item) for item in self.redis.lrange(self._errors_key(job_id), 0, limit - 1)]
+
+    def cancel(self, job_id: str) -> bool:
+        """Ask for a job to stop; queued jobs are cancelled at once. Returns
+        False for unknown or already finished jobs"""
+        key = self._job_key(job_id)
+        status = self.redis.hget(key, 'status')
+        if status is None or status.decode() in FINISHED:
+            return False
+        self.redis.hset(key, 'cancel_requested', '1')
+        if self.redis.lrem(self._pending, 0, job_id):
+            self._finish(job_id, 'cancelled')
+        return True
+
+    def _update(self, job_id: str, **fields):
+        fields['updated_at'] = fields['heartbeat'] = time.time()
+        self.redis.hset(self._job_key(job_id), mapping=fields)
+
+    def _finish(self, job_id: str, status: str, **fields):
+        self._update(job_id, status=status, finished_at=time.time(), **fields)
+        path = self.redis.hget(self._job_key(job_id), 'path')
+        if path:
+            path = path.decode()
+            for leftover in (path, f"{path}.checkpoint.json"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def requeue_stale(self):
+        """Put jobs whose worker stopped sending heartbeats back on the queue"""
+        now = time.time()
+        for raw_id in self.redis.lrange(self._processing, 0, -1):
+            job_id = raw_id.decode()
+            heartbeat = self.redis.hget(self._job_key(job_id), 'heartbeat')
+            if heartbeat is None or now - float(heartbeat) > self.stale_after:
+                if self.redis.lrem(self._processing, 1, job_id):
+                    logger.warning(f"Requeueing import job {job_id}: worker went away")
+                    self.redis.rpush(self._pending, job_id)
+
+    def work(self, importer_factory: Callable[[], BulkImporter], poll_timeout: int = 5):
+        """Worker loop: claim jobs one at a time and run them to completion"""
+        while True:
+            self.requeue_stale()
+            raw_id = self.redis.brpoplpush(self._pending, self._processing, timeout=poll_timeout)
+            if raw_id is None:
+                continue
+            job_id = raw_id.decode()
+            try:
+                self.run_job(job_id, importer_factory())
+            except Exception as e:
+                logger.error(f"Import job {job_id} failed: {e}")
+                self._finish(job_id, 'failed', message=str(e))
+            finally:
+                self.redis.lrem(self._processing, 1, job_id)
+
+    def run_job(self, job_id: str, importer: BulkImporter):
+        key = self._job_key(job_id)
+        path = self.redis.hget(key, 'path')
+        if path is None:
+            return
+        path = path.decode()
+        if self.redis.hget(key, 'cancel_requested') == b'1':
+            self._finish(job_id, 'cancelled')
+            return
+
+        now = time.time()
+        if not self.redis.hexists(key, 'started_at'):
+            self._update(job_id, started_at=now)
+        resumed_rows = int(self.redis.hget(key, 'rows') or 0)
+        self._update(job_id, status='running', run_started_at=now, resumed_rows=resumed_rows)
+        logger.info(f"Import job {job_id}: starting {path} after row {resumed_rows}")
+
+        def progress(counts):
+            self._update(job_id, **{field: counts.get(field, 0) for field in COUNT_FIELDS})
+
+        def on_row(number, dn, status, message):
+            if status == 'error':
+                errors = self._errors_key(job_id)
+                self.redis.rpush(errors, json.dumps({'row': number, 'dn': dn, 'message': message}))
+                self.redis.ltrim(errors, 0, self.max_error_rows - 1)
+
+        def should_stop():
+            self.redis.hset(key, 'heartbeat', time.time())
+            return self.redis.hget(key, 'cancel_requested') == b'1'
+
+        counts = importer.run(path, report_path=f"{path}.report.csv", progress=progress,
+                              on_row=on_row, should_stop=should_stop)
+        fields = {field: counts.get(field, 0) for field in COUNT_FIELDS}
+        if counts.get('stopped'):
+            self._finish(job_id, 'cancelled', **fields)
+        else:
+            self._finish(job_id, 'completed', **fields)
+        logger.info(f"Import job {job_id}: {counts}")
@@ -0,0 +1,325 @@
+"""
+Backup formats
+Paged raw-entry iteration, RFC 2849 LDIF and JSON-lines writers,
+gzip/zstd compressed output and the manifests that chain incremental
+backups, shared by scripts/backup.py, scripts/restore.py and /export
+"""
+
+import base64
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import ldap3
+
+from ldap_search import paged_cookie
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for --compress zstd
+    zstandard = None
+
+LDIF_LINE_WIDTH = 76
+
+COMPRESSION_SUFFIXES = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def iter_raw_entries(conn: ldap3.Connection, base_dn: str, search_filter: str = '(objectClass=*)',
+                     attributes=None, page_size: int = 500,
+                     search_scope=ldap3.SUBTREE) -> Iterator[Tuple[str, Dict[str, List[bytes]]]]:
+    """Yield (dn, {attribute: [raw bytes values]}) page by page, in the order
+    the server sent them, so a subtree export lists parents before children
+
+    ldap3's paged_search generator pops each page off the end, reversing
+    it, so pages are requested here directly.
+    """
+    cookie = None
+    while True:
+        conn.search(base_dn, search_filter, search_scope=search_scope, attributes=attributes or ['*'],
+                    paged_size=page_size, paged_cookie=cookie)
+        response = conn.response or []
+        cookie = paged_cookie(conn)
+        for item in response:
+            if item.get('type') == 'searchResEntry':
+                yield item['dn'], item['raw_attributes']
+        if not cookie:
+            return
+
+
+def _is_safe_string(value: bytes) -> bool:
+    """RFC 2849 SAFE-STRING: printable ASCII without a leading space, colon
+    or '<' (trailing spaces are base64-encoded too, so they survive)"""
+    if not value:
+        return True
+    if value[0] in b' :<' or value[-1:] == b' ':
+        return False
+    return all(0x01 <= byte <= 0x7f and byte not in (0x0a, 0x0d) for byte in value)
+
+
+def ldif_line(name: str, value: bytes) -> bytes:
+    """One attrval-spec, base64-encoded when needed and folded at 76 columns"""
+    if _is_safe_string(value):
+        line = f"{name}: ".encode('ascii') + value
+    else:
+        line = f"{name}:: ".encode('ascii') + base64.b64encode(value)
+    if len(line) <= LDIF_LINE_WIDTH:
+        return line + b'\n'
+    folded = [line[:LDIF_LINE_WIDTH]]
+    for start in range(LDIF_LINE_WIDTH, len(line), LDIF_LINE_WIDTH - 1):
+        folded.append(b' ' + line[start:start + LDIF_LINE_WIDTH - 1])
+    return b'\n'.join(folded) + b'\n'
+
+
+def ldif_record(dn: str, attributes: Dict[str, List[bytes]]) -> bytes:
+    lines = [ldif_line('dn', dn.encode('utf-8'))]
+    for attr, values in attributes.items():
+        for value in values:
+            lines.append(ldif_line(attr, value))
+    return b''.join(lines) + b'\n'
+
+
+def json_record(dn: str, attributes: Dict[str, List[bytes]]) -> bytes:
+    """One JSON line: values are UTF-8 strings, or {"base64": ...} for
+    values that are not valid UTF-8"""
+    encoded = {}
+    for attr, values in attributes.items():
+        encoded[attr] = []
+        for value in values:
+            try:
+                encoded[attr].append(value.decode('utf-8'))
+            except UnicodeDecodeError:
+                encoded[attr].append({'base64': base64.b64encode(value).decode('ascii')})
+    return json.dumps({'dn': dn, 'attributes': encoded}, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class LDIFWriter:
+    """Writes LDIF records to a binary stream"""
+
+    def __init__(self, stream, comment: Optional[str] = None):
+        self.stream = stream
+        if comment:
+            for line in comment.splitlines():
+                self.stream.write(f"# {line}\n".encode('utf-8'))
+        self.stream.write(b'version: 1\n\n')
+
+    def write(self, dn: str, attributes: Dict[str, List[bytes]]):
+        self.stream.write(ldif_record(dn, attributes))
+
+
+class JSONLinesWriter:
+    """Writes one JSON object per entry to a binary stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, dn: str, attributes: Dict[str, List[bytes]]):
+        self.stream.write(json_record(dn, attributes))
+
+
+def open_output(path: str, compression: str = 'none', level: Optional[int] = None):
+    """Binary file for writing, compressed with gzip or zstd"""
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6 if level is None else level)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        raw = open(path, 'wb')
+        return zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw)
+    if compression == 'none':
+        return open(path, 'wb')
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def buffered(chunks: Iterable[bytes], size: int = 64 * 1024) -> Iterator[bytes]:
+    """Coalesce small chunks into pieces of at least size bytes"""
+    pending, length = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(pending)
+            pending, length = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip a stream of chunks incrementally (one gzip member)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_etag(context_csn: Dict[int, str], *params) -> Optional[str]:
+    """Entity tag for an export: changes whenever any server's contextCSN
+    or the export parameters do; None when the server publishes no CSN"""
+    if not context_csn:
+        return None
+    digest = hashlib.sha256()
+    for sid in sorted(context_csn):
+        digest.update(f"{sid}={context_csn[sid]};".encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def open_input(path: str):
+    """Binary file for reading, decompressed according to its suffix"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstd backups require the zstandard package')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+def read_json_records(stream) -> Iterator[Tuple[str, Dict[str, List[bytes]]]]:
+    """Inverse of JSONLinesWriter: yield (dn, {attribute: [bytes values]})"""
+    for line in stream:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        attributes = {}
+        for attr, values in record['attributes'].items():
+            attributes[attr] = [base64.b64decode(v['base64']) if isinstance(v, dict) else v.encode('utf-8')
+                                for v in values]
+        yield record['dn'], attributes
+
+
+def _ldif_records(stream) -> Iterator[List[bytes]]:
+    """Unfolded lines of each LDIF record, comments and the version line dropped"""
+    record, last = [], None
+    for raw in stream:
+        line = raw.rstrip(b'\r\n')
+        if line.startswith(b' ') and last is not None:
+            record[-1] += line[1:]
+            continue
+        if not line:
+            if record:
+                yield record
+            record, last = [], None
+        elif line.startswith(b'#'):
+            last = None
+        elif not record and line.startswith(b'version:'):
+            last = None
+        else:
+            record.append(line)
+            last = line
+    if record:
+        yield record
+
+
+def read_ldif_records(stream) -> Iterator[Tuple[str, Dict[str, List[bytes]]]]:
+    """Parse content records (as written by LDIFWriter) from a binary stream:
+    yield (dn, {attribute: [bytes values]})"""
+    for lines in _ldif_records(stream):
+        dn, attributes = None, {}
+        for line in lines:
+            name, sep, value = line.partition(b':')
+            if not sep:
+                raise ValueError(f"Malformed LDIF line: {line[:80]!r}")
+            if value.startswith(b':'):
+                value = base64.b64decode(value[1:].strip())
+            elif value.startswith(b'<'):
+                raise ValueError('URL values are not supported in LDIF backups')
+            else:
+                value = value.lstrip(b' ')
+            name = name.decode('ascii')
+            if dn is None:
+                if name.lower() != 'dn':
+                    raise ValueError(f"LDIF record does not start with dn: {line[:80]!r}")
+                dn = value.decode('utf-8')
+            else:
+                attributes.setdefault(name, []).append(value)
+        yield dn, attributes
+
+
+def read_records(path: str) -> Iterator[Tuple[str, Dict[str, List[bytes]]]]:
+    """Entries of an LDIF or JSON-lines backup file, chosen by its suffix"""
+    reader = read_json_records if '.jsonl' in os.path.basename(path) else read_ldif_records
+    with open_input(path) as f:
+        yield from reader(f)
+
+
+def open_dn_list(path: str):
+    """Text file (gzip) for writing one DN per line"""
+    return gzip.open(path, 'wt', encoding='utf-8')
+
+
+def write_dn_list(path: str, dns: Iterable[str]) -> int:
+    """Write one DN per line (gzip); returns how many were written"""
+    count = 0
+    with open_dn_list(path) as f:
+        for dn in dns:
+            f.write(dn + '\n')
+            count += 1
+    return count
+
+
+def read_dn_list(path: str) -> Iterator[str]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+
+
+def dn_depth(dn: str) -> int:
+    """Number of RDNs, ignoring escaped commas"""
+    depth, escaped = 1, False
+    for char in dn:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == ',':
+            depth += 1
+    return depth
+
+
+def save_manifest(path: str, manifest: Dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_manifest(path: str) -> Dict:
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['path'] = os.path.abspath(path)
+    return manifest
+
+
+def manifest_file(manifest: Dict, name: str) -> Optional[str]:
+    """Absolute path of a file a manifest refers to (stored relative to it)"""
+    filename = manifest.get('files', {}).get(name)
+    if not filename:
+        return None
+    return os.path.join(os.path.dirname(manifest['path']), filename)
+
+
+def latest_manifest(backup_dir: str) -> Optional[Dict]:
+    paths = sorted(glob.glob(os.path.join(backup_dir, 'ldap_backup_*.manifest.json')))
+    return load_manifest(paths[-1]) if paths else None
+
+
+def backup_chain(manifest_path: str) -> List[Dict]:
+    """The full backup a manifest builds on followed by each incremental up
+    to and including it, oldest first; raises ValueError if a link is missing"""
+    chain = [load_manifest(manifest_path)]
+    while chain[0]['type'] == 'incremental':
+        parent = os.path.join(os.path.dirname(chain[0]['path']), chain[0]['parent'])
+        if not os.path.exists(parent):
+            raise ValueError(f"Backup chain broken: {parent} is missing")
+        chain.insert(0, load_manifest(parent))
+    return chain
+
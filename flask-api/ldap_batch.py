@@ -0,0 +1,173 @@
+"""
+Batch LDAP writes
+Validates /batch operation lists and runs them in order on one connection,
+optionally inside an RFC 5805 LDAP transaction when the server supports it
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import ldap3
+from pyasn1.codec.ber import encoder
+from pyasn1.type import namedtype, univ
+
+logger = logging.getLogger(__name__)
+
+# RFC 5805 LDAP Transactions
+START_TXN_OID = '1.3.6.1.1.21.1'
+TXN_SPECIFICATION_OID = '1.3.6.1.1.21.2'
+END_TXN_OID = '1.3.6.1.1.21.3'
+
+OPERATIONS = ('add', 'modify', 'delete')
+
+
+class TxnEndRequest(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.DefaultedNamedType('commit', univ.Boolean(True)),
+        namedtype.NamedType('identifier', univ.OctetString()),
+    )
+
+
+def parse_operations(operations, max_operations: int) -> List[Dict]:
+    """Validate a /batch operation list; raises ValueError naming the first
+    bad operation"""
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('operations must be a non-empty list')
+    if len(operations) > max_operations:
+        raise ValueError(f"At most {max_operations} operations per batch")
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise ValueError(f"Operation {index}: must be an object")
+        op, dn = operation.get('op'), operation.get('dn')
+        if op not in OPERATIONS:
+            raise ValueError(f"Operation {index}: op must be one of {', '.join(OPERATIONS)}")
+        if not dn or not isinstance(dn, str):
+            raise ValueError(f"Operation {index}: dn required")
+        item = {'index': index, 'op': op, 'dn': dn}
+        if op == 'add':
+            attributes = operation.get('attributes')
+            if not isinstance(attributes, dict) or 'objectClass' not in attributes:
+                raise ValueError(f"Operation {index}: attributes with objectClass required")
+            item['attributes'] = attributes
+        elif op == 'modify':
+            modifications = operation.get('modifications')
+            if not isinstance(modifications, dict) or not modifications:
+                raise ValueError(f"Operation {index}: modifications required")
+            item['modifications'] = modifications
+        parsed.append(item)
+    return parsed
+
+
+def supports_transactions(conn: ldap3.Connection) -> bool:
+    info = conn.server.info
+    return bool(info and any(ext[0] == START_TXN_OID for ext in info.supported_extensions or []))
+
+
+def start_transaction(conn: ldap3.Connection) -> Optional[bytes]:
+    """Transaction identifier, or None if the server refused to start one"""
+    if not conn.extended(START_TXN_OID):
+        return None
+    return conn.result.get('responseValue') or None
+
+
+def end_transaction(conn: ldap3.Connection, identifier: bytes, commit: bool = True) -> bool:
+    request = TxnEndRequest()
+    request['commit'] = commit
+    request['identifier'] = identifier
+    return conn.extended(END_TXN_OID, encoder.encode(request), no_encode=True)
+
+
+def replace_changes(modifications: Dict) -> Dict:
+    """Replace semantics, as /modify_user"""
+    return {attr: [(ldap3.MODIFY_REPLACE, value if isinstance(value, list) else [value])]
+            for attr, value in modifications.items()}
+
+
+def _read_before(conn: ldap3.Connection, operation: Dict) -> Dict:
+    """Current attributes of a delete/modify target (the modified ones only),
+    for audit values, stats and role cache invalidation"""
+    attributes = ['*'] if operation['op'] == 'delete' else list(operation['modifications'])
+    conn.search(operation['dn'], '(objectClass=*)', search_scope=ldap3.BASE, attributes=attributes)
+    return conn.entries[0].entry_attributes_as_dict if conn.entries else {}
+
+
+def _apply(conn: ldap3.Connection, operation: Dict, controls=None) -> bool:
+    if operation['op'] == 'add':
+        return conn.add(operation['dn'], attributes=operation['attributes'], controls=controls)
+    if operation['op'] == 'delete':
+        return conn.delete(operation['dn'], controls=controls)
+    return conn.modify(operation['dn'], replace_changes(operation['modifications']), controls=controls)
+
+
+def batch_results(operations: List[Dict]) -> List[Dict]:
+    """One result per operation, all 'skipped' until run"""
+    return [{'index': op['index'], 'op': op['op'], 'dn': op['dn'], 'status': 'skipped'}
+            for op in operations]
+
+
+def run_operations(conn: ldap3.Connection, operations: List[Dict], transaction: bool = False,
+                   stop_on_error: bool = False, results: Optional[List[Dict]] = None) -> Tuple[List[Dict], bool]:
+    """Apply operations in order; returns (per-operation results, whether
+    changes were made). Results carry 'status' (success, error, skipped or
+    rolled_back), 'error' and, for successful deletes/modifies, the
+    'old_attributes' read beforehand.
+
+    In a transaction the first failure aborts it: nothing is applied and
+    earlier operations are reported as rolled_back.
+
+    Pass results from batch_results() to keep them if an operation raises
+    (e.g. the connection drops): the operations already applied stay
+    'success' (rolled_back in a transaction, which is never committed) and
+    the one that raised is an 'error'.
+    """
+    if results is None:
+        results = batch_results(operations)
+    controls, identifier = None, None
+    if transaction:
+        identifier = start_transaction(conn)
+        if identifier is None:
+            raise RuntimeError(f"Cannot start LDAP transaction: {conn.result['description']}")
+        controls = [(TXN_SPECIFICATION_OID, True, identifier)]
+
+    failed = False
+    for operation, result in zip(operations, results):
+        try:
+            if operation['op'] != 'add':
+                result['old_attributes'] = _read_before(conn, operation)
+            applied = _apply(conn, operation, controls)
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+            if transaction:
+                _roll_back(results)
+            raise
+        if applied:
+            result['status'] = 'success'
+        else:
+            result['status'] = 'error'
+            result['error'] = conn.result['description']
+            failed = True
+            if transaction or stop_on_error:
+                break
+
+    if not transaction:
+        return results, any(result['status'] == 'success' for result in results)
+
+    committed = end_transaction(conn, identifier, commit=not failed) and not failed
+    if not committed:
+        if failed:
+            _roll_back(results)
+        else:
+            message = conn.result['description']
+            for result in results:
+                if result['status'] == 'success':
+                    result['status'] = 'error'
+                    result['error'] = message
+    return results, committed
+
+
+def _roll_back(results: List[Dict]):
+    for result in results:
+        if result['status'] == 'success':
+            result['status'] = 'rolled_back'
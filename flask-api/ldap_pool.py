@@ -0,0 +1,198 @@
+"""
+LDAP connection pooling for the API gateway
+Keeps long-lived, bound ldap3 connections per directory server so requests
+skip the TCP/TLS handshake, bind and root DSE/schema read
+"""
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import ldap3
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPException
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+ldap_pool_size = Gauge(
+    'ldap_pool_size',
+    'Open connections held by the LDAP pool',
+    ['pool']
+)
+ldap_pool_in_use = Gauge(
+    'ldap_pool_in_use',
+    'LDAP pool connections currently checked out',
+    ['pool']
+)
+ldap_pool_checkout_duration = Histogram(
+    'ldap_pool_checkout_seconds',
+    'Time spent waiting for a pooled LDAP connection',
+    ['pool']
+)
+ldap_pool_reconnects_total = Counter(
+    'ldap_pool_reconnects_total',
+    'Pooled LDAP connections replaced after failing a health check',
+    ['pool']
+)
+
+
+class LDAPConnectionPool:
+    """Fixed-size pool of bound connections to a single LDAP server"""
+
+    def __init__(self, name: str, uri: str, bind_dn: str, bind_password: str,
+                 size: int = 10, timeout: float = 5.0, max_idle: float = 60.0,
+                 get_info=ldap3.ALL):
+        self.name = name
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        # One Server object per pool: the DSE/schema is read by the first
+        # bind and then shared by every connection opened afterwards
+        self.server = ldap3.Server(uri, get_info=get_info, connect_timeout=timeout)
+        # Idle (connection, last used) pairs, most recent last; waiters for a
+        # connection or a free slot sleep on _available
+        self._idle = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._open_count = 0
+
+    def _open(self) -> Optional[ldap3.Connection]:
+        """Open and bind a new connection, reading server info only once"""
+        try:
+            conn = ldap3.Connection(
+                self.server,
+                user=self.bind_dn,
+                password=self.bind_password,
+                receive_timeout=math.ceil(self.timeout)  # ldap3 packs it as an integer
+            )
+            if not conn.bind(read_server_info=self.server.info is None):
+                logger.error(f"LDAP pool {self.name}: bind failed: {conn.result}")
+                return None
+            return conn
+        except LDAPException as e:
+            logger.error(f"LDAP pool {self.name}: connection error: {e}")
+            return None
+
+    def _is_healthy(self, conn: ldap3.Connection, idle_for: float) -> bool:
+        """Rebind dropped sessions and probe connections that sat idle too long"""
+        try:
+            if conn.closed or not conn.bound:
+                if not conn.bind(read_server_info=False):
+                    return False
+            if idle_for > self.max_idle:
+                return conn.search('', '(objectClass=*)', search_scope=ldap3.BASE, attributes=['1.1'])
+            return True
+        except LDAPException as e:
+            logger.warning(f"LDAP pool {self.name}: health check failed: {e}")
+            return False
+
+    def _discard(self, conn: ldap3.Connection):
+        """Drop a connection and free its slot"""
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+        self._release_slot()
+
+    def _release_slot(self):
+        """Free a slot and wake a thread waiting for one"""
+        with self._available:
+            self._open_count -= 1
+            ldap_pool_size.labels(pool=self.name).set(self._open_count)
+            self._available.notify()
+
+    def _checkout(self, deadline: float):
+        """(idle connection, last used), (None, None) after reserving a slot
+        for a new one, or None once deadline passes with neither available"""
+        with self._available:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._open_count < self.size:
+                    self._open_count += 1
+                    ldap_pool_size.labels(pool=self.name).set(self._open_count)
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+
+    def acquire(self) -> Optional[ldap3.Connection]:
+        """Check out a healthy connection, or None if the server is unreachable
+        or the pool stays exhausted for longer than the checkout timeout"""
+        start_time = time.monotonic()
+        deadline = start_time + self.timeout
+
+        while True:
+            checked_out = self._checkout(deadline)
+            if checked_out is None:
+                logger.error(f"LDAP pool {self.name}: exhausted ({self.size} connections in use)")
+                return None
+            conn, last_used = checked_out
+            if conn is None:
+                conn = self._open()
+                if conn is None:
+                    self._release_slot()
+                    return None
+                break
+
+            if self._is_healthy(conn, time.monotonic() - last_used):
+                break
+            ldap_pool_reconnects_total.labels(pool=self.name).inc()
+            self._discard(conn)
+
+        ldap_pool_checkout_duration.labels(pool=self.name).observe(time.monotonic() - start_time)
+        ldap_pool_in_use.labels(pool=self.name).inc()
+        return conn
+
+    def release(self, conn: ldap3.Connection, broken: bool = False):
+        """Return a connection to the pool, dropping it if it is no longer usable"""
+        ldap_pool_in_use.labels(pool=self.name).dec()
+        if broken or conn.closed:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager around acquire/release; yields None on failure"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self.release(conn, broken=broken)
+
+    def open_dedicated(self) -> Optional[ldap3.Connection]:
+        """Open a connection outside the pool that reuses its server info;
+        the caller owns it and must unbind it"""
+        return self._open()
+
+    def warm_up(self) -> bool:
+        """Open the first connection so the schema is fetched at startup"""
+        conn = self.acquire()
+        if conn is None:
+            return False
+        self.release(conn)
+        logger.info(f"LDAP pool {self.name} ready: {self.uri} (size {self.size})")
+        return True
+
+    def close(self):
+        """Unbind every idle connection"""
+        with self._available:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
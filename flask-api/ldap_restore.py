@@ -0,0 +1,211 @@
+"""
+Parallel LDAP restore
+Loads LDIF/JSON-lines backups behind scripts/restore.py: entries are spooled
+to one temporary file per DN depth in a single streaming pass, then each
+depth is loaded in turn with siblings fanned out over a pool of bound
+connections, so parents always exist before their children
+"""
+
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import ldap3
+from ldap3.core.exceptions import LDAPCommunicationError
+
+from ldap_backup import dn_depth, json_record, open_input, open_output, read_json_records
+
+logger = logging.getLogger(__name__)
+
+# LDAP result codes
+NO_SUCH_OBJECT = 32
+ENTRY_ALREADY_EXISTS = 68
+
+Record = Tuple[str, Dict[str, List[bytes]]]
+
+
+def _windows(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        window = list(islice(items, size))
+        if not window:
+            return
+        yield window
+
+
+def _by_name(attributes: Dict[str, List]) -> Dict[str, List]:
+    return {attr.lower(): values for attr, values in attributes.items()}
+
+
+class BackupRestorer:
+    """Restores entries on `workers` threads sharing an LDAPConnectionPool
+
+    With replace=True an entry that already exists is rewritten to match
+    the backup (attributes missing from the backup are removed); otherwise
+    it is left alone and reported as 'exists'.
+    """
+
+    def __init__(self, ldap_pool, workers: int = 8, batch_size: int = 1000, replace: bool = True):
+        self.ldap_pool = ldap_pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.replace = replace
+
+    def _with_connection(self, operation: Callable, *args) -> Tuple[str, str]:
+        """Run operation(conn, *args) -> (status, message) on a pooled
+        connection; retried once on a dropped connection"""
+        for attempt in range(2):
+            try:
+                with self.ldap_pool.connection() as conn:
+                    if not conn:
+                        return 'error', 'LDAP connection failed'
+                    return operation(conn, *args)
+            except LDAPCommunicationError as e:
+                if attempt:
+                    return 'error', str(e)
+            except Exception as e:
+                return 'error', str(e)
+
+    def _replace(self, conn: ldap3.Connection, dn: str, attributes: Dict[str, List[bytes]]) -> bool:
+        changes = {attr: [(ldap3.MODIFY_REPLACE, values)] for attr, values in attributes.items()}
+        if conn.search(dn, '(objectClass=*)', search_scope=ldap3.BASE, attributes=['*']) and conn.response:
+            backed_up = _by_name(attributes)
+            for attr in conn.response[0]['raw_attributes']:
+                if attr.lower() not in backed_up:
+                    changes[attr] = [(ldap3.MODIFY_DELETE, [])]
+        return conn.modify(dn, changes)
+
+    def _restore_entry(self, conn: ldap3.Connection, dn: str,
+                       attributes: Dict[str, List[bytes]]) -> Tuple[str, str]:
+        if conn.add(dn, attributes=attributes):
+            return 'added', ''
+        if conn.result['result'] != ENTRY_ALREADY_EXISTS:
+            return 'error', conn.result['description']
+        if not self.replace:
+            return 'exists', ''
+        if self._replace(conn, dn, attributes):
+            return 'replaced', ''
+        return 'error', conn.result['description']
+
+    def _delete_entry(self, conn: ldap3.Connection, dn: str) -> Tuple[str, str]:
+        if conn.delete(dn):
+            return 'deleted', ''
+        if conn.result['result'] == NO_SUCH_OBJECT:
+            return 'absent', ''
+        return 'error', conn.result['description']
+
+    def _verify_entry(self, conn: ldap3.Connection, dn: str,
+                      attributes: Optional[Dict[str, List[bytes]]]) -> Tuple[str, str]:
+        """'ok', 'missing' or 'mismatch' against the backup; attributes=None
+        means the entry was deleted and must be absent ('unexpected' if not)"""
+        found = conn.search(dn, '(objectClass=*)', search_scope=ldap3.BASE,
+                            attributes=['*'] if attributes is not None else ['1.1'])
+        if not found:
+            if conn.result['result'] != NO_SUCH_OBJECT:
+                return 'error', conn.result['description']
+            return ('missing', '') if attributes is not None else ('ok', '')
+        if attributes is None:
+            return 'unexpected', 'deleted entry is present'
+
+        expected = _by_name(attributes)
+        actual = _by_name(conn.response[0]['raw_attributes'])
+        differing = sorted(attr for attr in set(expected) | set(actual)
+                           if set(expected.get(attr, [])) != set(actual.get(attr, [])))
+        if differing:
+            return 'mismatch', ', '.join(differing)
+        return 'ok', ''
+
+    def _fan_out(self, executor: ThreadPoolExecutor, operation: Callable, items: Iterable[Tuple],
+                 counts: Dict[str, int], on_result: Optional[Callable[[str, str, str], None]]):
+        """Run operation over items (tuples starting with the DN), batch_size
+        at a time, tallying statuses"""
+        for window in _windows(items, self.batch_size):
+            futures = [(item[0], executor.submit(self._with_connection, operation, *item)) for item in window]
+            for dn, future in futures:
+                status, message = future.result()
+                counts[status] = counts.get(status, 0) + 1
+                if on_result:
+                    on_result(dn, status, message)
+
+    @staticmethod
+    def _spool(records: Iterable[Record], directory: str) -> Dict[int, str]:
+        """Write records to one gzip JSON-lines file per DN depth; returns
+        {depth: path}"""
+        streams, paths = {}, {}
+        try:
+            for dn, attributes in records:
+                depth = dn_depth(dn)
+                if depth not in streams:
+                    paths[depth] = os.path.join(directory, f"depth-{depth:03d}.jsonl.gz")
+                    streams[depth] = open_output(paths[depth], 'gzip', level=1)
+                streams[depth].write(json_record(dn, attributes))
+        finally:
+            for stream in streams.values():
+                stream.close()
+        return paths
+
+    @staticmethod
+    def _read_spool(path: str) -> Iterator[Record]:
+        with open_input(path) as f:
+            yield from read_json_records(f)
+
+    def restore(self, records: Iterable[Record], deleted: Iterable[str] = (),
+                verify: bool = False,
+                on_result: Optional[Callable[[str, str, str], None]] = None) -> Dict[str, int]:
+        """Load records shallowest depth first, then delete `deleted` DNs
+        deepest first; with verify, re-read every entry afterwards. Returns
+        counts per status; on_result gets each (dn, status, message)."""
+        counts = {'added': 0, 'replaced': 0, 'exists': 0, 'deleted': 0, 'error': 0}
+        deleted = sorted(set(deleted), key=dn_depth, reverse=True)
+        with tempfile.TemporaryDirectory(prefix='ldap-restore-') as spool_dir, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix='ldap-restore') as executor:
+            levels = self._spool(records, spool_dir)
+            for depth in sorted(levels):
+                logger.info(f"Restoring entries at depth {depth}")
+                self._fan_out(executor, self._restore_entry, self._read_spool(levels[depth]),
+                              counts, on_result)
+
+            # Deepest first so children go before their parents; siblings in parallel
+            for depth, window in self._depth_groups(deleted):
+                self._fan_out(executor, self._delete_entry, ((dn,) for dn in window), counts, on_result)
+
+            if verify:
+                gone = {dn.lower() for dn in deleted}
+                verified = self.verify((record for depth in sorted(levels)
+                                        for record in self._read_spool(levels[depth])
+                                        if record[0].lower() not in gone),
+                                       deleted, executor, on_result)
+                counts.update({f"verify_{status}": count for status, count in verified.items()})
+        return counts
+
+    @staticmethod
+    def _depth_groups(dns: List[str]) -> Iterator[Tuple[int, List[str]]]:
+        group, depth = [], None
+        for dn in dns:
+            if dn_depth(dn) != depth and group:
+                yield depth, group
+                group = []
+            depth = dn_depth(dn)
+            group.append(dn)
+        if group:
+            yield depth, group
+
+    def verify(self, records: Iterable[Record], absent: Iterable[str] = (),
+               executor: Optional[ThreadPoolExecutor] = None,
+               on_result: Optional[Callable[[str, str, str], None]] = None) -> Dict[str, int]:
+        """Compare each record with the directory and check that every DN in
+        absent is gone; returns counts of ok/missing/mismatch/unexpected/error"""
+        counts = {'ok': 0, 'missing': 0, 'mismatch': 0, 'unexpected': 0, 'error': 0}
+        owned = executor is None
+        if owned:
+            executor = ThreadPoolExecutor(self.workers, thread_name_prefix='ldap-verify')
+        try:
+            self._fan_out(executor, self._verify_entry, records, counts, on_result)
+            self._fan_out(executor, self._verify_entry, ((dn, None) for dn in absent), counts, on_result)
+        finally:
+            if owned:
+                executor.shutdown(wait=True)
+        return counts
@@ -0,0 +1,317 @@
+"""
+Search helpers for the API gateway
+Entry serialization, RFC 2696 paged iteration and resumable paged-search
+cursors for /search and /tree
+"""
+
+import base64
+import json
+import logging
+import math
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import ldap3
+from ldap3.utils.dn import to_dn
+
+logger = logging.getLogger(__name__)
+
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+# hasSubordinates/numSubordinates are operational and must be asked for by name
+TREE_ATTRIBUTES = ['objectClass', 'hasSubordinates', 'numSubordinates']
+
+
+def json_value(value):
+    """Make a decoded attribute value JSON serializable"""
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode('ascii')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def entry_to_dict(dn: str, attributes: Dict) -> Dict:
+    """Flatten an entry the way /search has always returned it:
+    single values as scalars, multiple values as lists"""
+    result = {}
+    for attr, values in attributes.items():
+        if not isinstance(values, list):
+            values = [values]
+        if not values:
+            continue
+        values = [json_value(v) for v in values]
+        result[attr] = values if len(values) > 1 else values[0]
+    result['dn'] = str(dn)
+    return result
+
+
+def response_entries(response) -> Iterator[Dict]:
+    """Yield search result entries from a raw ldap3 response list"""
+    for item in response or []:
+        if item.get('type') == 'searchResEntry':
+            yield entry_to_dict(item['dn'], item['attributes'])
+
+
+def iter_paged(conn: ldap3.Connection, base_dn: str, search_filter: str,
+               attributes: List[str], page_size: int = 500,
+               search_scope=ldap3.SUBTREE) -> Iterator[Dict]:
+    """Yield entries page by page so memory stays bounded by page_size"""
+    for item in conn.extend.standard.paged_search(
+            base_dn, search_filter, search_scope=search_scope,
+            attributes=attributes, paged_size=page_size, generator=True):
+        if item.get('type') == 'searchResEntry':
+            yield entry_to_dict(item['dn'], item['attributes'])
+
+
+def tree_node(entry: Dict) -> Dict:
+    """Child summary for /tree: RDN, object classes and subordinate hints
+    (None when the server does not publish them)"""
+    dn = entry['dn']
+    object_classes = entry.get('objectClass', [])
+    has_subordinates = entry.get('hasSubordinates')
+    num_subordinates = entry.get('numSubordinates')
+    if isinstance(has_subordinates, str):
+        has_subordinates = has_subordinates.upper() == 'TRUE'
+    if num_subordinates is not None:
+        num_subordinates = int(num_subordinates)
+        if has_subordinates is None:
+            has_subordinates = num_subordinates > 0
+    return {
+        'dn': dn,
+        'rdn': to_dn(dn)[0] if dn else dn,
+        'objectClass': object_classes if isinstance(object_classes, list) else [object_classes],
+        'hasSubordinates': has_subordinates,
+        'numSubordinates': num_subordinates,
+    }
+
+
+def paged_cookie(conn: ldap3.Connection) -> Optional[bytes]:
+    """Paged-results cookie from the last search, None when it was the last page"""
+    try:
+        cookie = conn.result['controls'][PAGED_RESULTS_OID]['value']['cookie']
+    except (KeyError, TypeError):
+        return None
+    return cookie or None
+
+
+class PagedSearchCursors:
+    """Resumable paged searches keyed by opaque cursor ids
+
+    Paged-results cookies are only valid on the connection that issued
+    them, so each cursor keeps a dedicated connection until its last page
+    has been read or it sits idle for longer than ttl seconds (a background
+    thread closes idle ones). With a Redis client, a cursor's search, its
+    server and the last DN returned are shared too: a worker asked for a
+    cursor it does not hold (or holds at an older position) opens a
+    connection to the same server with connect(server name), runs the
+    search again past that DN and carries on from there. This relies on
+    the server returning an unchanged search in the same order (OpenLDAP
+    does: entry ID order); if the last DN is gone the cursor has expired.
+    Re-reading costs the entries already returned, so sticky routing
+    remains the cheaper setup for long paged searches.
+    """
+
+    def __init__(self, max_cursors: int = 50, ttl: float = 120.0, redis_client=None,
+                 connect: Optional[Callable[[str], Optional[ldap3.Connection]]] = None,
+                 key_prefix: str = 'ldap:cursor:'):
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.connect = connect
+        self.key_prefix = key_prefix
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _ensure_started(self):
+        """Start the reaper lazily so every forked worker gets its own"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='search-cursors', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(max(1.0, self.ttl / 4)):
+            try:
+                self._reap()
+            except Exception as e:
+                logger.error(f"Paged search reaper error: {e}")
+
+    def _reap(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [cid for cid, c in self._cursors.items() if now - c['last_used'] > self.ttl]
+            stale = [self._cursors.pop(cid) for cid in expired]
+        for cursor in stale:
+            self._close(cursor)
+
+    @staticmethod
+    def _close(cursor):
+        try:
+            cursor['conn'].unbind()
+        except Exception:
+            pass
+
+    # Shared cursor state
+
+    def _save(self, cursor_id: str, cursor):
+        if self.redis_client is None:
+            return
+        state = {name: cursor[name] for name in
+                 ('owner', 'base_dn', 'filter', 'scope', 'attributes', 'page_size', 'offset',
+                  'server', 'last_dn')}
+        try:
+            self.redis_client.setex(self.key_prefix + cursor_id, math.ceil(self.ttl), json.dumps(state))
+        except Exception as e:
+            logger.warning(f"Cannot share paged search state: {e}")
+
+    def _forget(self, cursor_id: str):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.delete(self.key_prefix + cursor_id)
+        except Exception as e:
+            logger.warning(f"Cannot drop paged search state: {e}")
+
+    def _shared(self, cursor_id: str) -> Optional[Dict]:
+        """Shared state of a cursor, None when unknown (or without Redis)"""
+        if self.redis_client is None:
+            return None
+        try:
+            value = self.redis_client.get(self.key_prefix + cursor_id)
+        except Exception as e:
+            logger.warning(f"Cannot read paged search state: {e}")
+            return None
+        return json.loads(value) if value else None
+
+    def _finish(self, cursor_id: str, cursor):
+        with self._lock:
+            if self._cursors.get(cursor_id) is cursor:
+                del self._cursors[cursor_id]
+        self._forget(cursor_id)
+        self._close(cursor)
+
+    def _search_page(self, cursor):
+        conn = cursor['conn']
+        conn.search(cursor['base_dn'], cursor['filter'], cursor['scope'],
+                    attributes=cursor['attributes'],
+                    paged_size=cursor['page_size'],
+                    paged_cookie=cursor['cookie'])
+        cursor['cookie'] = paged_cookie(conn)
+        return list(response_entries(conn.response))
+
+    def _skip_past(self, cursor, results: List[Dict], dn: str) -> List[Dict]:
+        """Entries after dn, reading on until it turns up; raises KeyError
+        when the search ends without it"""
+        dn = dn.lower()
+        while True:
+            for position, entry in enumerate(results):
+                if entry['dn'].lower() == dn:
+                    results = results[position + 1:]
+                    if not results and cursor['cookie'] is not None:
+                        results = self._search_page(cursor)
+                    return results
+            if cursor['cookie'] is None:
+                raise KeyError(dn)
+            results = self._search_page(cursor)
+
+    def _fetch(self, cursor_id: str, cursor, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Next page of a cursor, after passing over the entries up to the
+        DN after (the last one returned, when resuming elsewhere)"""
+        try:
+            results = self._search_page(cursor)
+            if after is not None:
+                results = self._skip_past(cursor, results, after)
+        except Exception:
+            self._finish(cursor_id, cursor)
+            raise
+        if results:
+            cursor['last_dn'] = results[-1]['dn']
+        cursor['offset'] += len(results)
+        if cursor['cookie'] is None:
+            self._finish(cursor_id, cursor)
+            return results, None
+        cursor['last_used'] = time.monotonic()
+        self._save(cursor_id, cursor)
+        return results, cursor_id
+
+    def _add(self, cursor_id: str, conn: ldap3.Connection, state: Dict):
+        """Register a cursor on conn; the caller holds the lock"""
+        if len(self._cursors) >= self.max_cursors:
+            self._close({'conn': conn})
+            raise OverflowError('Too many open paged searches')
+        cursor = dict(state, conn=conn, cookie=None, last_used=time.monotonic(), lock=threading.Lock())
+        self._cursors[cursor_id] = cursor
+        return cursor
+
+    def start(self, conn: ldap3.Connection, owner: str, base_dn: str, search_filter: str,
+              attributes: List[str], page_size: int,
+              search_scope=ldap3.SUBTREE) -> Tuple[List[Dict], Optional[str]]:
+        """Run the first page on conn; the cursor takes ownership of conn"""
+        self._ensure_started()
+        self._reap()
+        cursor_id = secrets.token_urlsafe(16)
+        with self._lock:
+            cursor = self._add(cursor_id, conn, {
+                'owner': owner,
+                'base_dn': base_dn,
+                'filter': search_filter,
+                'scope': search_scope,
+                'attributes': attributes,
+                'page_size': page_size,
+                'offset': 0,
+                'server': conn.server.name,
+                'last_dn': None,
+            })
+        with cursor['lock']:
+            return self._fetch(cursor_id, cursor)
+
+    def next(self, cursor_id: str, owner: str) -> Tuple[List[Dict], Optional[str]]:
+        """Fetch the next page; raises KeyError for unknown or expired cursors"""
+        self._ensure_started()
+        self._reap()
+        shared = self._shared(cursor_id)
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+            if cursor is not None and shared is not None and cursor['offset'] != shared['offset']:
+                # Another worker has served pages of this cursor since
+                del self._cursors[cursor_id]
+                self._close(cursor)
+                cursor = None
+        if cursor is None:
+            return self._resume(cursor_id, owner, shared)
+        if cursor['owner'] != owner:
+            raise KeyError(cursor_id)
+        with cursor['lock']:
+            return self._fetch(cursor_id, cursor)
+
+    def _resume(self, cursor_id: str, owner: str, shared: Optional[Dict]) -> Tuple[List[Dict], Optional[str]]:
+        """Take over a cursor started on another worker, on the same server"""
+        if shared is None or shared['owner'] != owner or self.connect is None:
+            raise KeyError(cursor_id)
+        conn = self.connect(shared['server'])
+        if not conn:
+            raise ConnectionError('LDAP connection failed')
+        with self._lock:
+            cursor = self._add(cursor_id, conn, shared)
+        with cursor['lock']:
+            return self._fetch(cursor_id, cursor, after=shared['last_dn'])
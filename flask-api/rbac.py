@@ -1,4 +1,13 @@
-from typing import Literal
+import json
+import logging
+import os
+import string
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Literal, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 Role = Literal["admin", "faculty", "staff", "student"]
 
@@ -14,25 +23,210 @@ ROLE_PERMISSIONS = {
     },
 }
 
-def is_allowed(role: Role, dn: str, action: str) -> bool:
-    perms = ROLE_PERMISSIONS.get(role, {})
-    if "*" in perms and action in perms["*"]:
-        return True
-    # Find the most specific matching DN policy
-    applicable = []
-    for base, actions in perms.items():
-        if dn.lower().endswith(base.lower()) and action in actions:
-            applicable.append(base)
-    if not applicable:
+# Characters escaped with a backslash in normalized DN values (RFC 4514)
+DN_SPECIAL_CHARACTERS = '"+,;<>\\'
+
+
+def _split_unescaped(value: str, separators: str) -> List[str]:
+    """Split on separators that are not backslash-escaped or quoted"""
+    parts, current, escaped, quoted = [], [], False, False
+    for char in value:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            current.append(char)
+            quoted = not quoted
+        elif char in separators and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _strip_value(value: str) -> str:
+    """Trim surrounding spaces, keeping a backslash-escaped trailing one"""
+    stripped = value.strip()
+    trailing_backslashes = len(stripped) - len(stripped.rstrip("\\"))
+    if trailing_backslashes % 2 and len(stripped) < len(value.lstrip()):
+        stripped += " "
+    return stripped
+
+
+def _canonical_value(value: str) -> str:
+    """Attribute value with its escapes decoded ("\\2C", "\\," and a quoted
+    "," alike) and re-escaped one way, so equal values compare equal"""
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    raw, i = bytearray(), 0
+    while i < len(value):
+        char = value[i]
+        if char == "\\" and i + 1 < len(value):
+            pair = value[i + 1:i + 3]
+            if len(pair) == 2 and all(c in string.hexdigits for c in pair):
+                raw += bytes.fromhex(pair)
+                i += 3
+                continue
+            i += 1
+            char = value[i]
+        raw += char.encode("utf-8")
+        i += 1
+    decoded = raw.decode("utf-8", errors="replace")
+    last = len(decoded) - 1
+    return "".join("\\" + char if char in DN_SPECIAL_CHARACTERS or (char == " " and index in (0, last))
+                   or (char == "#" and index == 0) else char
+                   for index, char in enumerate(decoded))
+
+
+def _normalize_rdn(rdn: str) -> str:
+    avas = []
+    for ava in (_split_unescaped(rdn, "+") if "+" in rdn else [rdn]):
+        attr, sep, value = ava.partition("=")
+        if not sep or not attr.strip():
+            raise ValueError(f"Invalid RDN: {rdn!r}")
+        value = _strip_value(value)
+        if "\\" in value or '"' in value:
+            value = _canonical_value(value)
+        avas.append(f"{attr.strip().lower()}={value.lower()}")
+    return "+".join(sorted(avas))
+
+
+@lru_cache(maxsize=16384)
+def normalize_dn(dn: str) -> Tuple[str, ...]:
+    """RDNs of dn, case-folded and trimmed, suffix first
+    ("cn=A, ou=B" -> ("ou=b", "cn=a")); raises ValueError"""
+    if not dn.strip():
+        return ()
+    rdns = _split_unescaped(dn, ",") if "\\" in dn or '"' in dn else dn.split(",")
+    return tuple(_normalize_rdn(rdn) for rdn in reversed(rdns))
+
+
+class _Node:
+    __slots__ = ("children", "actions")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.actions: FrozenSet[str] = frozenset()
+
+
+class CompiledPolicy:
+    """Per-role suffix tries: a DN is allowed an action when the policy grants
+    it on the DN itself or on any ancestor, found in one walk down its RDNs"""
+
+    def __init__(self, permissions: Mapping[str, Mapping[str, List[str]]]):
+        self.wildcard: Dict[str, FrozenSet[str]] = {}
+        self.roots: Dict[str, _Node] = {}
+        for role, bases in permissions.items():
+            root = self.roots[role] = _Node()
+            for base, actions in bases.items():
+                if base == "*":
+                    self.wildcard[role] = frozenset(actions)
+                    continue
+                node = root
+                for rdn in normalize_dn(base):
+                    node = node.children.setdefault(rdn, _Node())
+                node.actions = node.actions | frozenset(actions)
+
+    def is_allowed(self, role: str, dn: str, action: str) -> bool:
+        if action in self.wildcard.get(role, ()):
+            return True
+        node = self.roots.get(role)
+        if node is None:
+            return False
+        try:
+            rdns = normalize_dn(dn)
+        except ValueError:
+            return False
+        if action in node.actions:
+            return True
+        for rdn in rdns:
+            node = node.children.get(rdn)
+            if node is None:
+                return False
+            if action in node.actions:
+                return True
         return False
-    # Prefer the longest (most specific) base
-    applicable.sort(key=len, reverse=True)
-    return True
+
+    def granted_bases(self, role: str, action: str) -> List[str]:
+        """Normalized DNs where the policy grants role the action (ancestors
+        before descendants), or ["*"] for a wildcard grant"""
+        if action in self.wildcard.get(role, ()):
+            return ["*"]
+        bases, stack = [], [((), self.roots.get(role))] if role in self.roots else []
+        while stack:
+            rdns, node = stack.pop()
+            if action in node.actions:
+                bases.append(rdns)
+            stack.extend((rdns + (rdn,), child) for rdn, child in node.children.items())
+        return [",".join(reversed(rdns)) for rdns in sorted(bases, key=len)]
 
 
+class PolicyStore:
+    """Holds the compiled policy; when given a JSON file (same shape as
+    ROLE_PERMISSIONS) it is re-read whenever its mtime changes, checked at
+    most every reload_interval seconds. A file that fails to load keeps the
+    previous policy in force."""
 
+    def __init__(self, permissions: Mapping = ROLE_PERMISSIONS, path: Optional[str] = None,
+                 reload_interval: float = 5.0):
+        self.policy = CompiledPolicy(permissions)
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if path:
+            self.reload()
 
+    def reload(self) -> bool:
+        """Load the policy file if it changed; returns True if it was replaced"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error(f"RBAC policy file {self.path} unavailable: {e}")
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                policy = CompiledPolicy(json.load(f))
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            logger.error(f"Keeping current RBAC policy, cannot load {self.path}: {e}")
+            self._mtime = mtime
+            return False
+        self.policy, self._mtime = policy, mtime
+        logger.info(f"Loaded RBAC policy from {self.path}")
+        return True
+
+    def current(self) -> CompiledPolicy:
+        if self.path:
+            now = time.monotonic()
+            if now - self._checked_at >= self.reload_interval and self._lock.acquire(blocking=False):
+                try:
+                    self._checked_at = now
+                    self.reload()
+                finally:
+                    self._lock.release()
+        return self.policy
+
+
+_store = PolicyStore()
 
 
+def load_policies(path: Optional[str], reload_interval: float = 5.0):
+    """Use policies from a JSON file (hot-reloaded) instead of ROLE_PERMISSIONS"""
+    global _store
+    _store = PolicyStore(path=path, reload_interval=reload_interval) if path else PolicyStore()
+
+
+def is_allowed(role: Role, dn: str, action: str) -> bool:
+    return _store.current().is_allowed(role, dn, action)
 
 
+def granted_bases(role: Role, action: str) -> List[str]:
+    return _store.current().granted_bases(role, action)
@@ -0,0 +1,420 @@
+"""
+Replica read routing
+Spreads reads over a list of replica pools: a background probe tracks each
+replica's health, latency and replication lag, requests go to the replica
+with the fewest outstanding requests (or lowest latency), circuit breakers
+eject failing replicas without a connect timeout per request, and hedged
+reads retry slow requests on a second replica
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, List, Optional
+
+import ldap3
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPException
+from prometheus_client import Counter, Gauge
+
+from replication import compare_csns, csn_reached, read_context_csn
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Prometheus metrics
+ldap_read_requests_total = Counter(
+    'ldap_read_requests_total',
+    'Reads routed per target server',
+    ['target']
+)
+ldap_read_hedged_total = Counter(
+    'ldap_read_hedged_total',
+    'Reads that were hedged onto a second replica'
+)
+ldap_read_consistency_total = Counter(
+    'ldap_read_consistency_total',
+    'Reads carrying a consistency token, by how they were served',
+    ['outcome']
+)
+ldap_replica_breaker_state = Gauge(
+    'ldap_replica_breaker_state',
+    'Replica circuit breaker (0 closed, 1 half-open, 2 open)',
+    ['replica']
+)
+ldap_replica_lag_seconds = Gauge(
+    'ldap_replica_lag_seconds',
+    'Replication lag measured by the last probe',
+    ['replica']
+)
+
+
+class ReplicaUnavailable(Exception):
+    pass
+
+
+class Replica:
+    """Routing state of one replica pool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.name = pool.name
+        self.outstanding = 0
+        self.latency = None  # EWMA, seconds
+        self.lag = None
+        self.context_csn: Dict[int, str] = {}
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_error = None
+        self.probed_at = None
+
+    def as_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'uri': self.pool.uri,
+            'state': self.state,
+            'outstanding': self.outstanding,
+            'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+            'lag_seconds': self.lag,
+            'last_error': self.last_error,
+            'probed_at': self.probed_at,
+        }
+
+
+class ReadRouter:
+    """Chooses a replica per read, falling back to the master pool when no
+    replica is healthy and within max_lag seconds of the master"""
+
+    def __init__(self, replica_pools, master_pool, base_dn: str, strategy: str = 'least_outstanding',
+                 probe_interval: float = 5.0, max_lag: Optional[float] = 30.0,
+                 failure_threshold: int = 3, open_seconds: float = 30.0,
+                 hedge_after: Optional[float] = None, hedge_workers: int = 8):
+        if strategy not in ('least_outstanding', 'latency'):
+            raise ValueError(f"Unknown read routing strategy: {strategy}")
+        self.replicas = [Replica(pool) for pool in replica_pools]
+        self.master_pool = master_pool
+        self.base_dn = base_dn
+        self.strategy = strategy
+        self.probe_interval = probe_interval
+        self.max_lag = max_lag
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.hedge_after = hedge_after
+        self.hedge_workers = hedge_workers
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._pid = None
+        # (time.monotonic() when read, master contextCSN) of recent probes
+        self._master_csns = deque(maxlen=16)
+
+    def _ensure_started(self):
+        """Start the probe thread lazily so every forked worker gets its own"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(self.hedge_workers, thread_name_prefix='ldap-hedge')
+            self._thread = threading.Thread(target=self._run, name='read-router', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """Start probing now rather than on the first read"""
+        self._ensure_started()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Replica probe error: {e}")
+            self._stopping.wait(self.probe_interval)
+
+    # Circuit breaker
+
+    def _record_success(self, replica: Replica, elapsed: Optional[float] = None):
+        with self._lock:
+            if elapsed is not None:
+                replica.latency = elapsed if replica.latency is None else 0.8 * replica.latency + 0.2 * elapsed
+            if replica.state != CLOSED:
+                logger.info(f"Replica {replica.name} recovered, closing circuit")
+            replica.state, replica.failures, replica.trial_in_flight = CLOSED, 0, False
+            replica.last_error = None
+        ldap_replica_breaker_state.labels(replica=replica.name).set(BREAKER_STATES[CLOSED])
+
+    def _record_failure(self, replica: Replica, error: str):
+        with self._lock:
+            replica.failures += 1
+            replica.last_error = error
+            replica.trial_in_flight = False
+            if replica.state == HALF_OPEN or replica.failures >= self.failure_threshold:
+                if replica.state != OPEN:
+                    logger.warning(f"Replica {replica.name} ejected after {replica.failures} failures: {error}")
+                replica.state, replica.opened_at = OPEN, time.monotonic()
+        ldap_replica_breaker_state.labels(replica=replica.name).set(BREAKER_STATES[replica.state])
+
+    def _admit(self, replica: Replica) -> bool:
+        """Whether a request may go to replica now (caller holds the lock);
+        an open breaker lets one trial request through after open_seconds"""
+        if replica.state == OPEN:
+            if time.monotonic() - replica.opened_at < self.open_seconds:
+                return False
+            replica.state = HALF_OPEN
+        if replica.state == HALF_OPEN:
+            if replica.trial_in_flight:
+                return False
+            replica.trial_in_flight = True
+        return True
+
+    # Selection
+
+    def _eligible(self, replica: Replica) -> bool:
+        if replica.state == OPEN and time.monotonic() - replica.opened_at < self.open_seconds:
+            return False
+        if self.max_lag is not None and replica.probed_at is not None:
+            return replica.lag is not None and replica.lag <= self.max_lag
+        return True
+
+    def _score(self, replica: Replica):
+        latency = replica.latency if replica.latency is not None else 0.0
+        if self.strategy == 'latency':
+            return (replica.outstanding + 1) * latency, replica.outstanding
+        return replica.outstanding, latency
+
+    def candidates(self, eligible: Optional[Callable[[Replica], bool]] = None) -> List[Replica]:
+        """Eligible replicas, best first"""
+        with self._lock:
+            usable = [r for r in self.replicas if self._eligible(r) and (eligible is None or eligible(r))]
+            return sorted(usable, key=self._score)
+
+    @contextmanager
+    def tracked(self, replica: Replica):
+        """Count a request against replica while it runs and feed its outcome
+        to the breaker: communication errors and ReplicaUnavailable are
+        failures, anything else that completes is a success. Raises
+        ReplicaUnavailable when the breaker refuses the request."""
+        with self._lock:
+            if not self._admit(replica):
+                raise ReplicaUnavailable(replica.name)
+            replica.outstanding += 1
+        start_time = time.monotonic()
+        try:
+            yield
+        except (LDAPCommunicationError, ReplicaUnavailable) as e:
+            self._record_failure(replica, str(e))
+            raise
+        except Exception:
+            self._record_success(replica, time.monotonic() - start_time)
+            raise
+        except BaseException:
+            # Cancelled (e.g. the slower half of a hedged read): no verdict
+            with self._lock:
+                replica.trial_in_flight = False
+            raise
+        else:
+            self._record_success(replica, time.monotonic() - start_time)
+        finally:
+            with self._lock:
+                replica.outstanding -= 1
+
+    @contextmanager
+    def _replica_connection(self, replica: Replica):
+        """Connection from replica's pool, tracked for routing; raises
+        ReplicaUnavailable when the breaker or the pool refuses"""
+        with self.tracked(replica):
+            conn = replica.pool.acquire()
+            if conn is None:
+                raise ReplicaUnavailable('connection failed')
+            broken = False
+            try:
+                ldap_read_requests_total.labels(target=replica.name).inc()
+                yield conn
+            except LDAPCommunicationError:
+                broken = True
+                raise
+            finally:
+                replica.pool.release(conn, broken=broken)
+
+    @contextmanager
+    def connection(self, eligible: Optional[Callable[[Replica], bool]] = None):
+        """Pooled read connection from the best replica, the master when none
+        is usable; yields None only if the master is unreachable too"""
+        self._ensure_started()
+        with ExitStack() as stack:
+            for replica in self.candidates(eligible):
+                try:
+                    conn = stack.enter_context(self._replica_connection(replica))
+                    break
+                except ReplicaUnavailable:
+                    continue
+            else:
+                conn = stack.enter_context(self.master_pool.connection())
+                if conn:
+                    ldap_read_requests_total.labels(target=self.master_pool.name).inc()
+            yield conn
+
+    def open_dedicated(self, eligible: Optional[Callable[[Replica], bool]] = None) -> Optional[ldap3.Connection]:
+        """Unpooled connection to the best replica (master as fallback) for
+        paged cursors; the caller owns it and must unbind it"""
+        self._ensure_started()
+        for replica in self.candidates(eligible):
+            conn = replica.pool.open_dedicated()
+            if conn is not None:
+                return conn
+            self._record_failure(replica, 'connection failed')
+        return self.master_pool.open_dedicated()
+
+    def open_dedicated_on(self, server_name: str) -> Optional[ldap3.Connection]:
+        """Unpooled connection to the replica (or master) whose server is
+        server_name, None if it is unknown or unreachable; for resuming a
+        paged cursor where it started"""
+        for pool in [replica.pool for replica in self.replicas] + [self.master_pool]:
+            if pool.server.name == server_name:
+                return pool.open_dedicated()
+        return None
+
+    def execute(self, operation: Callable[[ldap3.Connection], object],
+                eligible: Optional[Callable[[Replica], bool]] = None):
+        """Return operation(conn) from the best replica. With hedge_after set,
+        a request still running after that many seconds is also sent to the
+        next replica and the first answer wins. Raises ConnectionError when
+        no server can be reached."""
+        self._ensure_started()
+        candidates = self.candidates(eligible) if self.hedge_after else []
+        if len(candidates) < 2:
+            with self.connection(eligible) as conn:
+                if not conn:
+                    raise ConnectionError('LDAP connection failed')
+                return operation(conn)
+
+        def attempt(replica):
+            with self._replica_connection(replica) as conn:
+                return operation(conn)
+
+        pending = {self._executor.submit(attempt, candidates[0])}
+        done, _ = wait(pending, timeout=self.hedge_after)
+        if not done:
+            ldap_read_hedged_total.inc()
+            pending.add(self._executor.submit(attempt, candidates[1]))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                logger.warning(f"Hedged read failed: {future.exception()}")
+
+        with self.master_pool.connection() as conn:
+            if not conn:
+                raise ConnectionError('LDAP connection failed')
+            ldap_read_requests_total.labels(target=self.master_pool.name).inc()
+            return operation(conn)
+
+    # Read-your-writes
+
+    def _refresh_csn(self, replica: Replica):
+        try:
+            with self._replica_connection(replica) as conn:
+                context_csn = read_context_csn(conn, self.base_dn)
+        except (ReplicaUnavailable, LDAPException) as e:
+            logger.debug(f"Cannot refresh contextCSN of {replica.name}: {e}")
+            return
+        with self._lock:
+            replica.context_csn = context_csn
+
+    def consistent_with(self, target: Dict[int, str], timeout: float,
+                        poll_interval: float = 0.05) -> Callable[[Replica], bool]:
+        """Eligibility predicate for reads that must see the writes up to
+        target (a contextCSN by serverID). Replicas known to have caught up
+        qualify at once; otherwise usable replicas are re-read every
+        poll_interval for up to timeout seconds. If none gets there the
+        predicate rejects every replica, so the read goes to the master."""
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                ready = {r.name for r in self.replicas if csn_reached(r.context_csn, target)}
+            if ready:
+                ldap_read_consistency_total.labels(outcome='waited' if waited else 'replica').inc()
+                return lambda replica: replica.name in ready
+            if time.monotonic() >= deadline:
+                ldap_read_consistency_total.labels(outcome='master').inc()
+                return lambda replica: False
+            if waited:
+                time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+            waited = True
+            for replica in self.candidates():
+                self._refresh_csn(replica)
+
+    def fill_eligibility(self, since: Optional[float]) -> Optional[Callable[[Replica], bool]]:
+        """Replica filter for reads that fill a cache last invalidated at
+        since (time.monotonic(); None: any replica). Only replicas known to
+        have reached the master's contextCSN as first probed after since
+        qualify, so a lagging replica cannot cache again what a write just
+        invalidated; until the probe has read the master, none do and the
+        read goes to the master."""
+        if since is None:
+            return None
+        with self._lock:
+            target = next((csn for read_at, csn in self._master_csns if read_at >= since), None)
+            if target is None:
+                return lambda replica: False
+            ready = {r.name for r in self.replicas if csn_reached(r.context_csn, target)}
+        return lambda replica: replica.name in ready
+
+    # Probing
+
+    def probe(self):
+        """Read contextCSN from the master and every replica to update
+        latency, lag and breaker state"""
+        master_csn = None
+        read_at = time.monotonic()
+        with self.master_pool.connection() as conn:
+            if conn:
+                master_csn = read_context_csn(conn, self.base_dn)
+        if master_csn is not None:
+            with self._lock:
+                self._master_csns.append((read_at, master_csn))
+
+        for replica in self.replicas:
+            start_time = time.monotonic()
+            try:
+                conn = replica.pool.acquire()
+                if conn is None:
+                    raise ReplicaUnavailable('connection failed')
+                try:
+                    context_csn = read_context_csn(conn, self.base_dn)
+                finally:
+                    replica.pool.release(conn)
+            except Exception as e:
+                self._record_failure(replica, str(e))
+                replica.probed_at = time.time()
+                continue
+            self._record_success(replica, time.monotonic() - start_time)
+
+            lag = replica.lag
+            if master_csn is not None:
+                lags = [server['lag_seconds'] for server in compare_csns(master_csn, context_csn)]
+                lag = None if any(value is None for value in lags) else max(lags, default=0.0)
+            with self._lock:
+                replica.context_csn, replica.lag, replica.probed_at = context_csn, lag, time.time()
+            if lag is not None:
+                ldap_replica_lag_seconds.labels(replica=replica.name).set(lag)
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [replica.as_dict() for replica in self.replicas]
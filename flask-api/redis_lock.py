@@ -0,0 +1,67 @@
+"""
+Redis leader lock
+A SET NX PX lease identified by a per-process token, renewed and released
+only by its holder. Elects the one worker that follows the change feed and
+the one that rescans the directory for dashboard statistics.
+"""
+
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Releases or extends the lock only while this worker still holds it
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """Leader lease on key; without a Redis client every caller leads"""
+
+    def __init__(self, redis_client, key: str, ttl: float = 30.0):
+        self.redis_client = redis_client
+        self.key = key
+        self.ttl = ttl
+        self.reset_token()
+
+    def reset_token(self):
+        """New holder identity, e.g. after a fork"""
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+
+    def acquire(self) -> bool:
+        if self.redis_client is None:
+            return True
+        try:
+            return bool(self.redis_client.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)))
+        except Exception as e:
+            logger.warning(f"Cannot take lock {self.key}: {e}")
+            return False
+
+    def renew(self) -> bool:
+        if self.redis_client is None:
+            return True
+        try:
+            return bool(self.redis_client.eval(_RENEW_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)))
+        except Exception as e:
+            logger.warning(f"Cannot renew lock {self.key}: {e}")
+            return False
+
+    def release(self):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+        except Exception:
+            pass
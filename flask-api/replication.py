@@ -0,0 +1,161 @@
+"""
+Replication status helpers
+Reads contextCSN from the suffix entry of the provider and a consumer and
+reports per-serverID lag, with an optional digest mode that hashes entryCSN
+values per subtree to locate divergence without transferring the DIT
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import ldap3
+
+from ldap_search import iter_paged
+
+logger = logging.getLogger(__name__)
+
+CSN_TIME_FORMAT = '%Y%m%d%H%M%S.%fZ'
+
+
+def parse_csn(csn: str) -> Tuple[datetime, int, int, int]:
+    """Split a CSN (YYYYmmddHHMMSS.ffffffZ#count#sid#mod) into
+    (time, change count, serverID, modifier); raises ValueError"""
+    try:
+        timestamp, count, sid, mod = csn.split('#')
+        return datetime.strptime(timestamp, CSN_TIME_FORMAT), int(count, 16), int(sid, 16), int(mod, 16)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid CSN: {csn!r}") from e
+
+
+def format_csn(when: datetime, sid: int = 0) -> str:
+    """Lowest CSN at when for serverID sid, usable in (entryCSN>=...) filters"""
+    return f"{when.strftime(CSN_TIME_FORMAT)}#000000#{sid:03x}#000000"
+
+
+def csns_by_server(values: List[str]) -> Dict[int, str]:
+    """Newest CSN per serverID from a list of contextCSN values"""
+    latest = {}
+    for value in values or []:
+        try:
+            _, _, sid, _ = parse_csn(str(value))
+        except ValueError:
+            logger.warning(f"Ignoring unparsable contextCSN value {value!r}")
+            continue
+        if sid not in latest or parse_csn(latest[sid]) < parse_csn(str(value)):
+            latest[sid] = str(value)
+    return latest
+
+
+def read_context_csn(conn: ldap3.Connection, base_dn: str) -> Dict[int, str]:
+    """contextCSN of the suffix entry, by serverID: one BASE-scope search"""
+    conn.search(base_dn, '(objectClass=*)', search_scope=ldap3.BASE, attributes=['contextCSN'])
+    for item in conn.response or []:
+        if item.get('type') == 'searchResEntry':
+            return csns_by_server(item['attributes'].get('contextCSN', []))
+    return {}
+
+
+def format_csn_token(csns: Dict[int, str]) -> Optional[str]:
+    """Consistency token handed to clients after a write: the contextCSN
+    values joined by ';' (None when the server publishes none)"""
+    return ';'.join(csns[sid] for sid in sorted(csns)) or None
+
+
+def parse_csn_token(token: str) -> Dict[int, str]:
+    """Inverse of format_csn_token; raises ValueError"""
+    csns = {}
+    for value in token.split(';'):
+        sid = parse_csn(value.strip())[2]
+        csns[sid] = value.strip()
+    if not csns:
+        raise ValueError('Empty consistency token')
+    return csns
+
+
+def csn_reached(context_csn: Dict[int, str], target: Dict[int, str]) -> bool:
+    """Whether a server's contextCSN includes every change up to target"""
+    for sid, csn in target.items():
+        if sid not in context_csn or parse_csn(context_csn[sid]) < parse_csn(csn):
+            return False
+    return True
+
+
+def compare_csns(provider: Dict[int, str], consumer: Dict[int, str]) -> List[Dict]:
+    """Per-serverID comparison; lag_seconds is how far the consumer's CSN
+    trails the provider's (None when the consumer has nothing from that server)"""
+    servers = []
+    for sid in sorted(set(provider) | set(consumer)):
+        provider_csn, consumer_csn = provider.get(sid), consumer.get(sid)
+        if provider_csn == consumer_csn:
+            status, lag = 'synced', 0.0
+        elif consumer_csn is None:
+            status, lag = 'missing', None
+        elif provider_csn is None:
+            status, lag = 'ahead', 0.0
+        else:
+            provider_time, consumer_time = parse_csn(provider_csn)[0], parse_csn(consumer_csn)[0]
+            lag = max((provider_time - consumer_time).total_seconds(), 0.0)
+            status = 'behind' if parse_csn(provider_csn) > parse_csn(consumer_csn) else 'ahead'
+        servers.append({
+            'server_id': sid,
+            'provider_csn': provider_csn,
+            'consumer_csn': consumer_csn,
+            'lag_seconds': lag,
+            'status': status,
+        })
+    return servers
+
+
+def subtrees(conn: ldap3.Connection, base_dn: str) -> List[str]:
+    """DNs of the entries directly below base_dn"""
+    conn.search(base_dn, '(objectClass=*)', search_scope=ldap3.LEVEL, attributes=['1.1'])
+    return sorted(
+        item['dn'] for item in conn.response or []
+        if item.get('type') == 'searchResEntry' and item['dn'].lower() != base_dn.lower()
+    )
+
+
+def subtree_digest(conn: ldap3.Connection, base_dn: str, since_csn: str,
+                   page_size: int = 500) -> Tuple[int, str]:
+    """(entry count, sha256) over the sorted (DN, entryCSN) pairs of entries
+    under base_dn changed at or after since_csn; only entryCSN is fetched"""
+    pairs = sorted(
+        (entry['dn'].lower(), str(entry.get('entryCSN', '')))
+        for entry in iter_paged(conn, base_dn, f'(entryCSN>={since_csn})', ['entryCSN'], page_size)
+    )
+    digest = hashlib.sha256()
+    for dn, csn in pairs:
+        digest.update(f"{dn}\0{csn}\n".encode('utf-8'))
+    return len(pairs), digest.hexdigest()
+
+
+def digest_compare(provider_conn: ldap3.Connection, consumer_conn: ldap3.Connection,
+                   base_dn: str, since: datetime, page_size: int = 500) -> List[Dict]:
+    """Compare per-subtree entryCSN digests for changes since since; entries
+    modified before the window are not examined"""
+    since_csn = format_csn(since)
+    results = []
+    for dn in subtrees(provider_conn, base_dn):
+        provider_count, provider_digest = subtree_digest(provider_conn, dn, since_csn, page_size)
+        consumer_count, consumer_digest = subtree_digest(consumer_conn, dn, since_csn, page_size)
+        results.append({
+            'dn': dn,
+            'provider_entries': provider_count,
+            'consumer_entries': consumer_count,
+            'status': 'synced' if provider_digest == consumer_digest else 'divergent',
+        })
+    return results
+
+
+def digest_window_start(servers: List[Dict], window: timedelta) -> datetime:
+    """Start of the digest range: window before the oldest CSN the consumer
+    still lacks (or before now when every serverID is synced)"""
+    times = []
+    for server in servers:
+        if server['status'] == 'synced':
+            continue
+        csn = server['consumer_csn'] or server['provider_csn']
+        times.append(parse_csn(csn)[0])
+    return (min(times) if times else datetime.utcnow()) - window
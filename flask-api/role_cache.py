@@ -0,0 +1,170 @@
+"""
+Role resolution cache
+In-process TTL + LRU tier keyed by user DN, backed by an optional Redis tier
+shared between workers
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+role_cache_requests_total = Counter(
+    'role_cache_requests_total',
+    'Role cache lookups',
+    ['tier', 'result']
+)
+
+
+class RoleCache:
+    """Maps user DN -> resolved role with per-entry expiry"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0,
+                 redis_client=None, redis_ttl: int = 300, key_prefix: str = 'ldap:role:'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(user_dn: str) -> str:
+        return ','.join(part.strip() for part in user_dn.lower().split(','))
+
+    def _get_local(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                role, expires_at = cached
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    role_cache_requests_total.labels(tier='local', result='hit').inc()
+                    return role
+                del self._entries[key]
+        role_cache_requests_total.labels(tier='local', result='miss').inc()
+        return None
+
+    def _redis_value(self, key: str, value) -> Optional[str]:
+        if value is None:
+            role_cache_requests_total.labels(tier='redis', result='miss').inc()
+            return None
+        role_cache_requests_total.labels(tier='redis', result='hit').inc()
+        role = value.decode() if isinstance(value, bytes) else value
+        self._store_local(key, role)
+        return role
+
+    def get(self, user_dn: str) -> Optional[str]:
+        """Return the cached role, or None on a miss in both tiers"""
+        key = self._normalize(user_dn)
+        role = self._get_local(key)
+        if role is not None or self.redis_client is None:
+            return role
+        try:
+            value = self.redis_client.get(self.key_prefix + key)
+        except Exception as e:
+            logger.warning(f"Role cache Redis lookup failed: {e}")
+            return None
+        return self._redis_value(key, value)
+
+    def set(self, user_dn: str, role: str):
+        """Cache a resolved role in both tiers"""
+        key = self._normalize(user_dn)
+        self._store_local(key, role)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.setex(self.key_prefix + key, self.redis_ttl, role)
+        except Exception as e:
+            logger.warning(f"Role cache Redis store failed: {e}")
+
+    def _store_local(self, key: str, role: str):
+        with self._lock:
+            self._entries[key] = (role, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_dns: str, shared: bool = True):
+        """Forget the roles of the given users (in this worker only unless
+        shared)"""
+        keys = [self._normalize(dn) for dn in user_dns if dn]
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.redis_client is None or not keys or not shared:
+            return
+        try:
+            self.redis_client.delete(*[self.key_prefix + key for key in keys])
+        except Exception as e:
+            logger.warning(f"Role cache Redis invalidation failed: {e}")
+
+    def clear(self, shared: bool = True):
+        """Forget every cached role (in this worker only unless shared)"""
+        with self._lock:
+            self._entries.clear()
+        if self.redis_client is None or not shared:
+            return
+        try:
+            keys = list(self.redis_client.scan_iter(match=self.key_prefix + '*'))
+            if keys:
+                self.redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Role cache Redis clear failed: {e}")
+
+    # asyncio gateway: the same tiers with the Redis tier read and written
+    # through a redis.asyncio client
+
+    async def get_async(self, user_dn: str, redis_client) -> Optional[str]:
+        key = self._normalize(user_dn)
+        role = self._get_local(key)
+        if role is not None or redis_client is None:
+            return role
+        try:
+            value = await redis_client.get(self.key_prefix + key)
+        except Exception as e:
+            logger.warning(f"Role cache Redis lookup failed: {e}")
+            return None
+        return self._redis_value(key, value)
+
+    async def set_async(self, user_dn: str, role: str, redis_client):
+        key = self._normalize(user_dn)
+        self._store_local(key, role)
+        if redis_client is None:
+            return
+        try:
+            await redis_client.setex(self.key_prefix + key, self.redis_ttl, role)
+        except Exception as e:
+            logger.warning(f"Role cache Redis store failed: {e}")
+
+    async def invalidate_async(self, redis_client, *user_dns: str):
+        keys = [self._normalize(dn) for dn in user_dns if dn]
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if redis_client is None or not keys:
+            return
+        try:
+            await redis_client.delete(*[self.key_prefix + key for key in keys])
+        except Exception as e:
+            logger.warning(f"Role cache Redis invalidation failed: {e}")
+
+    async def clear_async(self, redis_client):
+        with self._lock:
+            self._entries.clear()
+        if redis_client is None:
+            return
+        try:
+            keys = [key async for key in redis_client.scan_iter(match=self.key_prefix + '*')]
+            if keys:
+                await redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Role cache Redis clear failed: {e}")
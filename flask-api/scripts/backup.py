@@ -1,16 +1,23 @@
 #!/usr/bin/env python3
 """
 LDAP Backup Script
-Exports LDAP directory to LDIF and JSON formats
+Exports LDAP directory to LDIF and JSON-lines formats in a single paged pass,
+either in full or incrementally since the previous backup's manifest
 """
 
 import os
 import sys
-import json
 import argparse
 import datetime
-import ldap3
-from ldap3 import Server, Connection, ALL, SUBTREE
+from ldap3 import Server, Connection, ALL
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldap_backup import (
+    COMPRESSION_SUFFIXES, JSONLinesWriter, LDIFWriter, iter_raw_entries, latest_manifest,
+    manifest_file, open_dn_list, open_output, read_dn_list, save_manifest, write_dn_list
+)
+from replication import parse_csn, read_context_csn
 
 # LDAP Configuration
 LDAP_URI = os.getenv('LDAP_MASTER_URI', 'ldap://localhost:389')
@@ -18,51 +25,89 @@ LDAP_BASE_DN = os.getenv('LDAP_BASE_DN', 'dc=college,dc=local')
 LDAP_BIND_DN = os.getenv('LDAP_BIND_DN', 'cn=admin,dc=college,dc=local')
 LDAP_BIND_PASSWORD = os.getenv('LDAP_BIND_PASSWORD', 'admin123')
 BACKUP_DIR = os.getenv('BACKUP_DIR', '/app/data/backups')
+BACKUP_PAGE_SIZE = int(os.getenv('BACKUP_PAGE_SIZE', '500'))
 
-
-def ensure_backup_dir():
+def ensure_backup_dir(path=BACKUP_DIR):
     """Ensure backup directory exists"""
-    os.makedirs(BACKUP_DIR, exist_ok=True)
-
-
-def export_ldif(conn, output_file):
-    """Export LDAP to LDIF format"""
-    conn.search(LDAP_BASE_DN, '(objectClass=*)', attributes=['*'], search_scope=SUBTREE)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for entry in conn.entries:
-            f.write(f"dn: {entry.entry_dn}\n")
-            for attr in entry.entry_attributes:
-                values = entry[attr].values if hasattr(entry[attr], 'values') else [str(entry[attr])]
-                for value in values:
-                    f.write(f"{attr}: {value}\n")
-            f.write("\n")
-    
-    print(f"LDIF export saved to: {output_file}")
-
-
-def export_json(conn, output_file):
-    """Export LDAP to JSON format"""
-    conn.search(LDAP_BASE_DN, '(objectClass=*)', attributes=['*'], search_scope=SUBTREE)
-    
-    results = []
-    for entry in conn.entries:
-        result = {}
-        for attr in entry.entry_attributes:
-            values = entry[attr].values if hasattr(entry[attr], 'values') else [str(entry[attr])]
-            result[attr] = values if len(values) > 1 else values[0]
-        result['dn'] = str(entry.entry_dn)
-        results.append(result)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'export_date': datetime.datetime.now().isoformat(),
-            'base_dn': LDAP_BASE_DN,
-            'count': len(results),
-            'entries': results
-        }, f, indent=2, ensure_ascii=False)
-    
-    print(f"JSON export saved to: {output_file}")
+    os.makedirs(path, exist_ok=True)
+
+
+class HighWater:
+    """Where the next incremental backup starts: the contextCSN (per
+    serverID) and the time, both read before the export begins
+
+    Exported entries never raise it: an entry modified behind the paged
+    search's position gets a CSN lower than entries changed and read after
+    it, so the highest entryCSN exported would make the next incremental
+    skip that entry.
+    """
+
+    def __init__(self, csns=None, modify_timestamp=None):
+        self.csns = dict(csns or {})
+        self.modify_timestamp = modify_timestamp
+
+    def as_manifest(self):
+        return {'csn': {str(sid): csn for sid, csn in self.csns.items()},
+                'modify_timestamp': self.modify_timestamp}
+
+
+def changes_filter(parent):
+    """Filter for entries changed since the parent backup's high-water mark"""
+    csns = list(parent.get('csn', {}).values())
+    if csns:
+        # The lowest per-server CSN: anything a server wrote after it may be new
+        return f"(entryCSN>={min(csns, key=parse_csn)})"
+    if parent.get('modify_timestamp'):
+        return f"(modifyTimestamp>={parent['modify_timestamp']})"
+    raise ValueError('Previous manifest has no entryCSN or modifyTimestamp to start from')
+
+
+def export_backup(conn, outputs, page_size=BACKUP_PAGE_SIZE, search_filter='(objectClass=*)',
+                  dn_sink=None):
+    """Stream every matching entry under the base DN to each (format, path,
+    compression) output from one paged search; returns the number of entries
+    written"""
+    comment = f"LDAP backup of {LDAP_BASE_DN}\nExported {datetime.datetime.now().isoformat()}"
+    streams, writers = [], []
+    try:
+        for fmt, path, compression in outputs:
+            stream = open_output(path, compression)
+            streams.append(stream)
+            writers.append(LDIFWriter(stream, comment) if fmt == 'ldif' else JSONLinesWriter(stream))
+
+        count = 0
+        for dn, entry in iter_raw_entries(conn, LDAP_BASE_DN, search_filter, ['*'], page_size):
+            if dn_sink is not None:
+                dn_sink(dn)
+            for writer in writers:
+                writer.write(dn, entry)
+            count += 1
+    finally:
+        for stream in streams:
+            stream.close()
+
+    for fmt, path, _ in outputs:
+        print(f"{fmt.upper()} export saved to: {path}")
+    return count
+
+
+def current_dns(conn, page_size):
+    """Every DN under the base DN, without attributes"""
+    for dn, _ in iter_raw_entries(conn, LDAP_BASE_DN, attributes=['1.1'], page_size=page_size):
+        yield dn
+
+
+def write_dn_diff(dns, path, parent):
+    """Write the current DN set to path; returns the parent's DNs that are gone"""
+    previous = {dn.lower(): dn for dn in read_dn_list(manifest_file(parent, 'dns'))}
+
+    def remaining():
+        for dn in dns:
+            previous.pop(dn.lower(), None)
+            yield dn
+
+    count = write_dn_list(path, remaining())
+    return count, sorted(previous.values())
 
 
 def main():
@@ -71,34 +116,76 @@ def main():
                        help='Export format')
     parser.add_argument('--output-dir', default=BACKUP_DIR,
                        help='Output directory for backups')
-    
+    parser.add_argument('--compress', choices=sorted(COMPRESSION_SUFFIXES), default='gzip',
+                       help='Compression for the backup files')
+    parser.add_argument('--page-size', type=int, default=BACKUP_PAGE_SIZE,
+                       help='Entries per paged search request')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Export only changes since the latest backup in --output-dir')
+
     args = parser.parse_args()
-    
-    ensure_backup_dir()
-    
+
+    ensure_backup_dir(args.output_dir)
+
+    parent = latest_manifest(args.output_dir) if args.incremental else None
+    if args.incremental and parent is None:
+        print("No previous backup found, taking a full backup")
+
     # Connect to LDAP
     server = Server(LDAP_URI, get_info=ALL)
     conn = Connection(server, user=LDAP_BIND_DN, password=LDAP_BIND_PASSWORD, auto_bind=True)
-    
+
     print(f"Connected to LDAP: {LDAP_URI}")
     print(f"Base DN: {LDAP_BASE_DN}")
-    
+
     # Generate timestamp
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    # Export
+    suffix = COMPRESSION_SUFFIXES[args.compress]
+    prefix = f'ldap_backup_{timestamp}'
+    files = {'dns': f'{prefix}.dns.gz'}
     if args.format in ['ldif', 'both']:
-        ldif_file = os.path.join(args.output_dir, f'ldap_backup_{timestamp}.ldif')
-        export_ldif(conn, ldif_file)
-    
+        files['ldif'] = f'{prefix}.ldif{suffix}'
     if args.format in ['json', 'both']:
-        json_file = os.path.join(args.output_dir, f'ldap_backup_{timestamp}.json')
-        export_json(conn, json_file)
-    
+        files['json'] = f'{prefix}.jsonl{suffix}'
+    outputs = [(fmt, os.path.join(args.output_dir, files[fmt]), args.compress)
+               for fmt in ('ldif', 'json') if fmt in files]
+    dns_path = os.path.join(args.output_dir, files['dns'])
+
+    # Changes committed while the export runs are picked up by the next one
+    started = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%SZ')
+    high_water = HighWater(read_context_csn(conn, LDAP_BASE_DN), started)
+    manifest = {
+        'type': 'incremental' if parent else 'full',
+        'timestamp': timestamp,
+        'base_dn': LDAP_BASE_DN,
+        'files': files,
+    }
+
+    if parent:
+        manifest['parent'] = os.path.basename(parent['path'])
+        search_filter = changes_filter(parent)
+        print(f"Incremental since {os.path.basename(parent['path'])}: {search_filter}")
+        count = export_backup(conn, outputs, page_size=args.page_size, search_filter=search_filter)
+        total, deleted = write_dn_diff(current_dns(conn, args.page_size), dns_path, parent)
+        files['deleted'] = f'{prefix}.deleted.gz'
+        write_dn_list(os.path.join(args.output_dir, files['deleted']), deleted)
+        manifest['deleted'] = len(deleted)
+    else:
+        # Every exported entry's DN goes straight to the DN list
+        with open_dn_list(dns_path) as dn_list:
+            count = export_backup(conn, outputs, page_size=args.page_size,
+                                  dn_sink=lambda dn: dn_list.write(dn + '\n'))
+        total = count
+
+    manifest.update(entries=count, total_entries=total, **high_water.as_manifest())
+    manifest_path = os.path.join(args.output_dir, f'{prefix}.manifest.json')
+    save_manifest(manifest_path, manifest)
+
     conn.unbind()
-    print("Backup complete!")
+    print(f"Manifest saved to: {manifest_path}")
+    print(f"Backup complete! {count} entries" +
+          (f", {manifest['deleted']} deleted" if parent else ''))
 
 
 if __name__ == '__main__':
     main()
-
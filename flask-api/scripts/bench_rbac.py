@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+RBAC micro-benchmark
+Times rbac.is_allowed against the previous linear endswith() scan over a
+policy set with many bases, for cached (repeated) and uncached DNs
+"""
+
+import os
+import sys
+import argparse
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rbac import CompiledPolicy, ROLE_PERMISSIONS, normalize_dn
+
+
+def linear_is_allowed(permissions, role, dn, action):
+    """The pre-trie implementation: every base of the role, every call"""
+    perms = permissions.get(role, {})
+    if "*" in perms and action in perms["*"]:
+        return True
+    applicable = []
+    for base, actions in perms.items():
+        if dn.lower().endswith(base.lower()) and action in actions:
+            applicable.append(base)
+    if not applicable:
+        return False
+    applicable.sort(key=len, reverse=True)
+    return True
+
+
+def build_permissions(departments):
+    """ROLE_PERMISSIONS plus one write grant per department OU for faculty"""
+    permissions = {role: dict(bases) for role, bases in ROLE_PERMISSIONS.items()}
+    for i in range(departments):
+        permissions["faculty"][f"ou=Dept{i},ou=Faculty,ou=People,dc=college,dc=local"] = ["read", "write"]
+    return permissions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rbac.is_allowed')
+    parser.add_argument('--departments', type=int, default=200, help='Extra policy bases for the role')
+    parser.add_argument('--dns', type=int, default=10000, help='Distinct DNs checked')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions (best is reported)')
+
+    args = parser.parse_args()
+
+    permissions = build_permissions(args.departments)
+    policy = CompiledPolicy(permissions)
+    rng = random.Random(0)
+    dns = [f"cn=user{i},ou=Dept{rng.randrange(args.departments * 2)},ou=Faculty,ou=People,dc=college,dc=local"
+           for i in range(args.dns)]
+
+    mismatches = sum(policy.is_allowed("faculty", dn, "write") != linear_is_allowed(permissions, "faculty", dn, "write")
+                     for dn in dns)
+    print(f"{len(permissions['faculty'])} faculty bases, {len(dns)} DNs, "
+          f"{mismatches} decisions differ from the linear scan")
+
+    def run(check):
+        return min(timeit.repeat(lambda: [check(dn) for dn in dns], number=1, repeat=args.repeat)) / len(dns) * 1e6
+
+    linear = run(lambda dn: linear_is_allowed(permissions, "faculty", dn, "write"))
+    normalize_dn.cache_clear()
+    uncached = run(lambda dn: (normalize_dn.cache_clear(), policy.is_allowed("faculty", dn, "write")))
+    cached = run(lambda dn: policy.is_allowed("faculty", dn, "write"))
+
+    print(f"linear scan:        {linear:8.2f} us/check")
+    print(f"trie (cold DN):     {uncached:8.2f} us/check")
+    print(f"trie (cached DN):   {cached:8.2f} us/check")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+CSV Import Worker
+Runs queued /import_csv jobs from Redis outside the API processes
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from bulk_import import BulkImporter
+from import_jobs import ImportJobQueue
+from ldap_pool import LDAPConnectionPool
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued CSV import jobs')
+    parser.add_argument('--workers', type=int, default=config.IMPORT_WORKERS,
+                       help='Concurrent LDAP connections used for adds')
+    parser.add_argument('--batch-size', type=int, default=config.IMPORT_BATCH_SIZE,
+                       help='Rows per batch (progress is checkpointed after each)')
+    parser.add_argument('--hash-workers', type=int, default=None,
+                       help='Password hashing processes (default: CPU count, 0 hashes inline)')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    pool = LDAPConnectionPool('import', config.LDAP_URI, config.LDAP_BIND_DN, config.LDAP_BIND_PASSWORD,
+                              size=args.workers)
+    jobs = ImportJobQueue(redis.from_url(config.REDIS_URL), config.IMPORT_UPLOAD_DIR)
+
+    def importer():
+        return BulkImporter(pool, config.LDAP_BASE_DN, workers=args.workers,
+                            batch_size=args.batch_size, hash_workers=args.hash_workers)
+
+    print(f"Import worker waiting for jobs ({config.LDAP_URI})")
+    try:
+        jobs.work(importer)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
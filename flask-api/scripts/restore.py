@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+LDAP Restore Script
+Loads an LDIF or JSON-lines backup, or replays a backup manifest's chain
+(the full backup, then each incremental in order), in parallel
+"""
+
+import os
+import sys
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldap_backup import backup_chain, latest_manifest, manifest_file, read_dn_list, read_records
+from ldap_pool import LDAPConnectionPool
+from ldap_restore import BackupRestorer
+
+# LDAP Configuration
+LDAP_URI = os.getenv('LDAP_MASTER_URI', 'ldap://localhost:389')
+LDAP_BIND_DN = os.getenv('LDAP_BIND_DN', 'cn=admin,dc=college,dc=local')
+LDAP_BIND_PASSWORD = os.getenv('LDAP_BIND_PASSWORD', 'admin123')
+BACKUP_DIR = os.getenv('BACKUP_DIR', '/app/data/backups')
+
+
+def entries_file(manifest):
+    """The manifest's JSON-lines file, or its LDIF file if it has none"""
+    path = manifest_file(manifest, 'json') or manifest_file(manifest, 'ldif')
+    if path is None:
+        raise ValueError(f"{manifest['path']} lists no backup file to restore from")
+    return path
+
+
+def verify_chain(restorer, chain, on_result):
+    """Verify the state a chain ends in: walking newest to oldest, each
+    entry is checked against the last backup that contains it"""
+    seen = set()
+    counts = {}
+
+    def unseen(records):
+        for dn, attributes in records:
+            if dn.lower() not in seen:
+                seen.add(dn.lower())
+                yield dn, attributes
+
+    for manifest in reversed(chain):
+        deleted_path = manifest_file(manifest, 'deleted')
+        deleted = [dn for dn in read_dn_list(deleted_path) if dn.lower() not in seen] if deleted_path else []
+        result = restorer.verify(unseen(read_records(entries_file(manifest))), deleted, on_result=on_result)
+        seen.update(dn.lower() for dn in deleted)
+        for status, count in result.items():
+            counts[status] = counts.get(status, 0) + count
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Restore LDAP directory from a backup')
+    parser.add_argument('backup', nargs='?',
+                       help='Manifest to restore up to, or a single .ldif/.jsonl backup file '
+                            '(default: latest manifest in --backup-dir)')
+    parser.add_argument('--backup-dir', default=BACKUP_DIR,
+                       help='Directory searched for the latest manifest')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Concurrent LDAP connections')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                       help='Entries in flight per batch')
+    parser.add_argument('--no-replace', action='store_true',
+                       help='Leave entries that already exist untouched')
+    parser.add_argument('--verify', action='store_true',
+                       help='Re-read every restored entry and compare it with the backup')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    path = args.backup
+    if path is None:
+        latest = latest_manifest(args.backup_dir)
+        if latest is None:
+            print(f"No backups found in {args.backup_dir}")
+            sys.exit(1)
+        path = latest['path']
+
+    chain = None
+    if path.endswith('.manifest.json'):
+        try:
+            chain = backup_chain(path)
+            for manifest in chain:
+                entries_file(manifest)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    pool = LDAPConnectionPool('restore', LDAP_URI, LDAP_BIND_DN, LDAP_BIND_PASSWORD, size=args.workers)
+    if not pool.warm_up():
+        print(f"Cannot connect to LDAP: {LDAP_URI}")
+        sys.exit(1)
+    print(f"Connected to LDAP: {LDAP_URI}")
+
+    restorer = BackupRestorer(pool, workers=args.workers, batch_size=args.batch_size,
+                              replace=not args.no_replace)
+
+    def on_result(dn, status, message):
+        if status in ('error', 'missing', 'mismatch', 'unexpected'):
+            print(f"  {status}: {dn}" + (f" ({message})" if message else ''))
+
+    try:
+        if chain is None:
+            print(f"Restoring {path}")
+            counts = restorer.restore(read_records(path), verify=args.verify, on_result=on_result)
+        else:
+            counts = {}
+            for manifest in chain:
+                print(f"Restoring {manifest['type']} backup {os.path.basename(manifest['path'])}")
+                deleted_path = manifest_file(manifest, 'deleted')
+                result = restorer.restore(read_records(entries_file(manifest)),
+                                          read_dn_list(deleted_path) if deleted_path else (),
+                                          on_result=on_result)
+                for status, count in result.items():
+                    counts[status] = counts.get(status, 0) + count
+            if args.verify:
+                print("Verifying")
+                verified = verify_chain(restorer, chain, on_result)
+                counts.update({f"verify_{status}": count for status, count in verified.items()})
+    finally:
+        pool.close()
+
+    print(f"Restore complete! {counts.get('added', 0)} added, {counts.get('replaced', 0)} replaced, "
+          f"{counts.get('exists', 0)} left as is, {counts.get('deleted', 0)} deleted, "
+          f"{counts.get('error', 0)} errors")
+    if args.verify:
+        print(f"Verify: {counts.get('verify_ok', 0)} ok, {counts.get('verify_missing', 0)} missing, "
+              f"{counts.get('verify_mismatch', 0)} mismatched, {counts.get('verify_unexpected', 0)} "
+              f"unexpectedly present, {counts.get('verify_error', 0)} errors")
+    if counts.get('error') or any(counts.get(f"verify_{s}") for s in ('missing', 'mismatch', 'unexpected', 'error')):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
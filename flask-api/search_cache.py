@@ -0,0 +1,429 @@
+"""
+Search result cache
+Serialized /search responses keyed by (base, scope, filter, attributes,
+caller's read scope) in an in-process LRU tier bounded by entry count and
+bytes, backed by an optional Redis tier shared between workers. Entries are
+dropped by DN: a change to an entry invalidates every cached search whose
+base is on the same branch of the tree, in both tiers and, over a Redis
+channel, in the in-process tier of every other worker.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from rbac import normalize_dn
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+search_cache_requests_total = Counter(
+    'search_cache_requests_total',
+    'Search cache lookups',
+    ['tier', 'result']
+)
+search_cache_evictions_total = Counter(
+    'search_cache_evictions_total',
+    'Search cache entries dropped or refused',
+    ['tier', 'reason']
+)
+search_cache_bytes = Gauge(
+    'search_cache_bytes',
+    'Bytes held by the in-process search cache tier'
+)
+
+
+def _same_branch(a: Tuple[str, ...], b: Tuple[str, ...]) -> bool:
+    """Whether one DN (as normalize_dn RDNs) is an ancestor-or-self of the other"""
+    depth = min(len(a), len(b))
+    return a[:depth] == b[:depth]
+
+
+class SearchCache:
+    """Maps a normalized search -> serialized response body with per-entry
+    expiry.
+
+    Results of a search made before an invalidation are not stored, so a
+    lookup racing a write cannot put the old data back. Nor may a search
+    made after it read a replica that has not replicated the write yet:
+    callers route fills by invalidated_at() (ReadRouter.fill_eligibility).
+    """
+
+    def __init__(self, max_size: int = 1000, max_bytes: int = 64 * 1024 * 1024,
+                 max_entry_bytes: int = 1024 * 1024, ttl: float = 30.0,
+                 redis_client=None, redis_ttl: int = 60, key_prefix: str = 'ldap:search:',
+                 index_depth: int = 3, retry_interval: float = 5.0):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+        # Redis bases are listed in sets keyed by their top index_depth RDNs,
+        # so an invalidation reads only the sets on its own branch
+        self.index_depth = index_depth
+        self.index_prefix = key_prefix + 'branch:'
+        self.indexes_key = key_prefix + 'branches'
+        self.channel = key_prefix + 'invalidations'
+        self.retry_interval = retry_interval
+        self._origin = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._entries = OrderedDict()
+        self._by_base: Dict[Tuple[str, ...], set] = {}
+        self._bytes = 0
+        self._generation = 0
+        self._invalidated_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(base_dn: str, scope: str, search_filter: str, attributes: Iterable[str],
+            read_scope: Iterable[str]) -> Tuple[Tuple[str, ...], str]:
+        """(base RDNs, cache key) of a search; raises ValueError for a bad base"""
+        base = normalize_dn(base_dn)
+        identity = json.dumps([
+            list(base), scope.lower(), search_filter.strip(),
+            sorted({attr.lower() for attr in attributes}), sorted(read_scope),
+        ])
+        return base, hashlib.sha256(identity.encode()).hexdigest()
+
+    def generation(self) -> int:
+        """Pass to set(): results are dropped if an invalidation ran since"""
+        return self._generation
+
+    def invalidated_at(self) -> Optional[float]:
+        """time.monotonic() of the last invalidation in this worker (None
+        before the first): searches filling the cache must see the writes
+        made before it"""
+        return self._invalidated_at
+
+    def _value_key(self, key: str) -> str:
+        return self.key_prefix + 'v:' + key
+
+    def _base_key(self, base: Tuple[str, ...]) -> str:
+        return self.key_prefix + 'base:' + ','.join(reversed(base))
+
+    def _index_key(self, base: Tuple[str, ...]) -> str:
+        return self.index_prefix + ','.join(reversed(base[:self.index_depth]))
+
+    # Invalidations from other workers
+
+    def _ensure_started(self):
+        """Start the channel thread lazily so every forked worker gets its own"""
+        if self.redis_client is None:
+            return
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._origin = uuid.uuid4().hex
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._listen, name='search-cache-listen', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _listen(self):
+        """Drop this worker's entries invalidated by writes in other workers"""
+        while not self._stopping.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stopping.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        invalidation = json.loads(message['data'])
+                        if invalidation['origin'] != self._origin:
+                            self._invalidate_local(self._parse(invalidation['dns']))
+            except Exception as e:
+                logger.warning(f"Search cache channel error: {e}")
+                # Entries stored while deaf to invalidations may go stale
+                self._invalidate_local([()])
+                self._stopping.wait(self.retry_interval)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def _invalidation(self, dns: Iterable[str]) -> str:
+        return json.dumps({'origin': self._origin, 'dns': list(dns)})
+
+    # In-process tier
+
+    def _get_local(self, key: str) -> Optional[bytes]:
+        self._ensure_started()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                body, expires_at, _ = cached
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    search_cache_requests_total.labels(tier='local', result='hit').inc()
+                    return body
+                self._drop(key)
+                search_cache_evictions_total.labels(tier='local', reason='expired').inc()
+        search_cache_requests_total.labels(tier='local', result='miss').inc()
+        return None
+
+    def _drop(self, key: str):
+        """Remove a local entry; caller holds the lock"""
+        body, _, base = self._entries.pop(key)
+        self._bytes -= len(body)
+        keys = self._by_base.get(base)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_base[base]
+
+    def _store_local(self, base: Tuple[str, ...], key: str, body: bytes):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (body, time.monotonic() + self.ttl, base)
+            self._by_base.setdefault(base, set()).add(key)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_size or self._bytes > self.max_bytes:
+                reason = 'size' if len(self._entries) > self.max_size else 'bytes'
+                self._drop(next(iter(self._entries)))
+                search_cache_evictions_total.labels(tier='local', reason=reason).inc()
+            search_cache_bytes.set(self._bytes)
+
+    def _invalidate_local(self, dns: List[Tuple[str, ...]]) -> int:
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at = time.monotonic()
+            bases = [base for base in self._by_base if any(_same_branch(base, dn) for dn in dns)]
+            keys = [key for base in bases for key in self._by_base[base]]
+            for key in keys:
+                self._drop(key)
+            search_cache_bytes.set(self._bytes)
+        if keys:
+            search_cache_evictions_total.labels(tier='local', reason='invalidated').inc(len(keys))
+        return len(keys)
+
+    # Both tiers
+
+    def _redis_value(self, base: Tuple[str, ...], key: str, value) -> Optional[bytes]:
+        if value is None:
+            search_cache_requests_total.labels(tier='redis', result='miss').inc()
+            return None
+        search_cache_requests_total.labels(tier='redis', result='hit').inc()
+        self._store_local(base, key, value)
+        return value
+
+    def get(self, base: Tuple[str, ...], key: str) -> Optional[bytes]:
+        """Return the cached response body, or None on a miss in both tiers"""
+        body = self._get_local(key)
+        if body is not None or self.redis_client is None:
+            return body
+        try:
+            value = self.redis_client.get(self._value_key(key))
+        except Exception as e:
+            logger.warning(f"Search cache Redis lookup failed: {e}")
+            return None
+        return self._redis_value(base, key, value)
+
+    def _admit(self, body: bytes, generation: int) -> bool:
+        if generation != self._generation:
+            return False
+        if len(body) > self.max_entry_bytes:
+            search_cache_evictions_total.labels(tier='local', reason='too_large').inc()
+            return False
+        return True
+
+    def _redis_store(self, pipe, base: Tuple[str, ...], key: str, body: bytes):
+        base_key = self._base_key(base)
+        index_key = self._index_key(base)
+        pipe.setex(self._value_key(key), self.redis_ttl, body)
+        pipe.sadd(base_key, key)
+        pipe.expire(base_key, self.redis_ttl)
+        pipe.sadd(index_key, ','.join(reversed(base)))
+        pipe.expire(index_key, self.redis_ttl)
+        pipe.sadd(self.indexes_key, index_key)
+
+    def set(self, base: Tuple[str, ...], key: str, body: bytes, generation: int):
+        """Cache a response body in both tiers"""
+        if not self._admit(body, generation):
+            return
+        self._store_local(base, key, body)
+        if self.redis_client is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._redis_store(pipe, base, key, body)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Search cache Redis store failed: {e}")
+
+    def _scans_indexes(self, dns: List[Tuple[str, ...]]) -> bool:
+        """Whether a DN sits above the index depth, so its descendants may be
+        listed under any index and the list of indexes must be read"""
+        return any(len(dn) < self.index_depth for dn in dns)
+
+    def _index_keys(self, dns: List[Tuple[str, ...]], indexes=()) -> List[str]:
+        """Index sets that may list a base on the branch of one of dns: those
+        of its ancestors above the index depth and of its own top RDNs, or
+        (from indexes) every index below a DN above that depth"""
+        keys = set()
+        for dn in dns:
+            if len(dn) >= self.index_depth:
+                keys.update(self._index_key(dn[:depth]) for depth in range(self.index_depth + 1))
+        for key in indexes:
+            key = key.decode() if isinstance(key, bytes) else key
+            try:
+                index = normalize_dn(key[len(self.index_prefix):])
+            except ValueError:
+                continue
+            if any(len(dn) < self.index_depth and _same_branch(index, dn) for dn in dns):
+                keys.add(key)
+        return sorted(keys)
+
+    def _affected_bases(self, indexed, dns: List[Tuple[str, ...]]) -> List[Tuple[str, str]]:
+        """(base, index key) of the bases listed in indexed (one member
+        list per index) that are on the branch of one of dns"""
+        affected = []
+        for members in indexed:
+            for value in members:
+                value = value.decode() if isinstance(value, bytes) else value
+                try:
+                    base = normalize_dn(value)
+                except ValueError:
+                    continue
+                if any(_same_branch(base, dn) for dn in dns):
+                    affected.append((value, self._index_key(base)))
+        return affected
+
+    def _parse(self, dns: Iterable[str]) -> List[Tuple[str, ...]]:
+        parsed = []
+        for dn in dns:
+            try:
+                parsed.append(normalize_dn(dn))
+            except ValueError:
+                parsed.append(())  # unparseable: treat as the root, dropping everything
+        return parsed
+
+    def invalidate(self, *dns: str, shared: bool = True, broadcast: bool = True):
+        """Forget searches whose base is an ancestor or descendant of any of
+        dns (in this worker only unless shared). Shared invalidations also
+        reach the other workers' in-process tiers unless broadcast is False
+        (each of them hears of the change another way)."""
+        dns = [dn for dn in dns if dn]
+        parsed = self._parse(dns)
+        if not parsed:
+            return
+        self._invalidate_local(parsed)
+        if self.redis_client is None or not shared:
+            return
+        try:
+            indexes = self.redis_client.smembers(self.indexes_key) if self._scans_indexes(parsed) else ()
+            pipe = self.redis_client.pipeline(transaction=False)
+            for index_key in self._index_keys(parsed, indexes):
+                pipe.smembers(index_key)
+            affected = self._affected_bases(pipe.execute(), parsed)
+            if affected:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for base, _ in affected:
+                    pipe.smembers(self.key_prefix + 'base:' + base)
+                self._redis_drop(self.redis_client.pipeline(transaction=False), affected, pipe.execute()).execute()
+        except Exception as e:
+            logger.warning(f"Search cache Redis invalidation failed: {e}")
+        if broadcast:
+            try:
+                self.redis_client.publish(self.channel, self._invalidation(dns))
+            except Exception as e:
+                logger.warning(f"Search cache cannot broadcast invalidation: {e}")
+
+    def _redis_drop(self, pipe, affected: List[Tuple[str, str]], members):
+        """Queue on pipe the deletion of the affected bases' entries"""
+        keys = [self._value_key(k.decode() if isinstance(k, bytes) else k) for keys in members for k in keys]
+        if keys:
+            pipe.delete(*keys)
+            search_cache_evictions_total.labels(tier='redis', reason='invalidated').inc(len(keys))
+        pipe.delete(*[self.key_prefix + 'base:' + base for base, _ in affected])
+        for base, index_key in affected:
+            pipe.srem(index_key, base)
+        return pipe
+
+    def clear(self, shared: bool = True):
+        """Forget every cached search (in this worker only unless shared)"""
+        self._invalidate_local([()])
+        if self.redis_client is None or not shared:
+            return
+        try:
+            keys = list(self.redis_client.scan_iter(match=self.key_prefix + '*'))
+            if keys:
+                self.redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Search cache Redis clear failed: {e}")
+
+    # asyncio gateway: the same tiers with the Redis tier read and written
+    # through a redis.asyncio client
+
+    async def get_async(self, base: Tuple[str, ...], key: str, redis_client) -> Optional[bytes]:
+        body = self._get_local(key)
+        if body is not None or redis_client is None:
+            return body
+        try:
+            value = await redis_client.get(self._value_key(key))
+        except Exception as e:
+            logger.warning(f"Search cache Redis lookup failed: {e}")
+            return None
+        return self._redis_value(base, key, value)
+
+    async def set_async(self, base: Tuple[str, ...], key: str, body: bytes, generation: int, redis_client):
+        if not self._admit(body, generation):
+            return
+        self._store_local(base, key, body)
+        if redis_client is None:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            self._redis_store(pipe, base, key, body)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Search cache Redis store failed: {e}")
+
+    async def invalidate_async(self, redis_client, *dns: str):
+        dns = [dn for dn in dns if dn]
+        parsed = self._parse(dns)
+        if not parsed:
+            return
+        self._invalidate_local(parsed)
+        if redis_client is None:
+            return
+        try:
+            indexes = await redis_client.smembers(self.indexes_key) if self._scans_indexes(parsed) else ()
+            pipe = redis_client.pipeline(transaction=False)
+            for index_key in self._index_keys(parsed, indexes):
+                pipe.smembers(index_key)
+            affected = self._affected_bases(await pipe.execute(), parsed)
+            if affected:
+                pipe = redis_client.pipeline(transaction=False)
+                for base, _ in affected:
+                    pipe.smembers(self.key_prefix + 'base:' + base)
+                members = await pipe.execute()
+                await self._redis_drop(redis_client.pipeline(transaction=False), affected, members).execute()
+        except Exception as e:
+            logger.warning(f"Search cache Redis invalidation failed: {e}")
+        try:
+            await redis_client.publish(self.channel, self._invalidation(dns))
+        except Exception as e:
+            logger.warning(f"Search cache cannot broadcast invalidation: {e}")
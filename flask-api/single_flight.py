@@ -0,0 +1,96 @@
+"""
+Request coalescing
+Concurrent identical directory reads share one in-flight LDAP operation:
+the first caller for a key runs it and every caller arriving while it runs
+waits for (and receives) the same result or exception.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Hashable
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics
+single_flight_requests_total = Counter(
+    'single_flight_requests_total',
+    'Coalesced reads by whether the caller ran the operation or shared one in flight',
+    ['flight', 'role']
+)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key, in threads (do) or on the event
+    loop (do_async). Results are not kept once the operation finishes."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, operation: Callable[[], object]):
+        """Return operation(), or the result of the identical call in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            single_flight_requests_total.labels(flight=self.name, role='follower').inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        single_flight_requests_total.labels(flight=self.name, role='leader').inc()
+        try:
+            call.result = operation()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: Hashable, operation: Callable[[], Awaitable]):
+        """Await operation(), or the identical call in flight. The operation
+        runs as its own task, so a cancelled caller does not cancel it for
+        the others."""
+        task = self._tasks.get(key)
+        if task is None:
+            single_flight_requests_total.labels(flight=self.name, role='leader').inc()
+            task = self._tasks[key] = asyncio.ensure_future(operation())
+            task.add_done_callback(lambda done: self._forget_task(key, done))
+        else:
+            single_flight_requests_total.labels(flight=self.name, role='follower').inc()
+        return await asyncio.shield(task)
+
+    def _forget_task(self, key: Hashable, task: asyncio.Future):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here too, so a failure nobody awaited is not reported twice
+            logger.debug(f"{self.name} flight failed: {task.exception()}")
+
+    def forget(self):
+        """Let calls from now on start fresh operations instead of joining
+        those in flight (e.g. after a write they must see)"""
+        with self._lock:
+            self._calls.clear()
+        self._tasks.clear()
@@ -0,0 +1,59 @@
+"""Replay of spilled audit events"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from audit_writer import AuditWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    return AuditWriter(None, None, 'dc=college,dc=local', str(tmp_path))
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def spill_file(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def replay(writer, sink='postgres'):
+    delivered = []
+
+    def write(batch):
+        delivered.extend(batch)
+        return []
+
+    writer._replay(sink, write)
+    return delivered
+
+
+def test_replays_a_dead_workers_spill_file(writer, tmp_path):
+    spill_file(tmp_path / f'audit-postgres-{dead_pid()}.jsonl', [{'id': 1}, {'id': 2}])
+    assert replay(writer) == [{'id': 1}, {'id': 2}]
+    assert os.listdir(tmp_path) == []
+
+
+def test_replays_a_file_claimed_by_a_worker_that_died(writer, tmp_path):
+    claimed = tmp_path / f'audit-postgres-{dead_pid()}.jsonl.{dead_pid()}.replay'
+    spill_file(claimed, [{'id': 3}])
+    assert replay(writer) == [{'id': 3}]
+    assert os.listdir(tmp_path) == []
+
+
+def test_leaves_files_of_live_workers(writer, tmp_path):
+    live = os.getppid()
+    spill_file(tmp_path / f'audit-postgres-{live}.jsonl', [{'id': 4}])
+    spill_file(tmp_path / f'audit-postgres-{dead_pid()}.jsonl.{live}.replay', [{'id': 5}])
+    assert replay(writer) == []
+    assert len(os.listdir(tmp_path)) == 2
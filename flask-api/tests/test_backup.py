@@ -0,0 +1,69 @@
+"""Incremental backup high-water mark"""
+
+import ldap3
+import pytest
+
+import backup
+from replication import read_context_csn
+
+BASE_DN = backup.LDAP_BASE_DN
+
+
+def csn(day: int) -> str:
+    return f'202601{day:02d}000000.000000Z#000000#000#000000'
+
+
+@pytest.fixture
+def conn():
+    conn = ldap3.Connection(ldap3.Server('mock'), client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(BASE_DN, {'objectClass': ['domain'], 'dc': 'college', 'contextCSN': csn(10)})
+    for uid, day in (('a', 1), ('b', 2), ('c', 3)):
+        conn.strategy.add_entry(f'uid={uid},{BASE_DN}', {'objectClass': ['person'], 'uid': uid,
+                                                         'sn': uid, 'cn': uid, 'entryCSN': csn(day)})
+    conn.bind()
+    yield conn
+    conn.unbind()
+
+
+def set_csn(conn, dn, value):
+    conn.strategy.entries[ldap3.utils.dn.safe_dn(dn)]['entryCSN'] = [value.encode('ascii')]
+
+
+def test_entry_modified_behind_the_cursor_is_in_the_next_incremental(conn, tmp_path):
+    high_water = backup.HighWater(read_context_csn(conn, BASE_DN))
+    exported = []
+
+    def modify_during_export(dn):
+        if not exported:
+            # The entry just read changes, then one the search has not reached yet
+            set_csn(conn, dn, csn(11))
+            later = next(other for other in (f'uid={uid},{BASE_DN}' for uid in 'abc') if other != dn)
+            set_csn(conn, later, csn(12))
+        exported.append(dn)
+
+    count = backup.export_backup(conn, [('ldif', str(tmp_path / 'full.ldif'), 'none')], page_size=1,
+                                 dn_sink=modify_during_export)
+    assert count == 4
+
+    manifest = high_water.as_manifest()
+    assert manifest['csn'] == {'0': csn(10)}
+    conn.search(BASE_DN, backup.changes_filter(manifest), attributes=['1.1'])
+    changed = {item['dn'] for item in conn.response if item['type'] == 'searchResEntry'}
+    assert exported[0] in changed
+
+
+def test_exported_entries_do_not_move_the_high_water_mark(conn, tmp_path):
+    high_water = backup.HighWater(read_context_csn(conn, BASE_DN), '20260110000000Z')
+    set_csn(conn, f'uid=c,{BASE_DN}', csn(20))
+    backup.export_backup(conn, [('json', str(tmp_path / 'full.jsonl'), 'none')])
+    assert high_water.as_manifest() == {'csn': {'0': csn(10)}, 'modify_timestamp': '20260110000000Z'}
+
+
+def test_changes_filter_starts_from_the_lowest_server_csn():
+    manifest = {'csn': {'1': '20260105000000.000000Z#000000#001#000000',
+                        '2': '20260103000000.000000Z#000000#002#000000'}}
+    assert backup.changes_filter(manifest) == '(entryCSN>=20260103000000.000000Z#000000#002#000000)'
+    assert backup.changes_filter({'csn': {}, 'modify_timestamp': '20260110000000Z'}) == \
+        '(modifyTimestamp>=20260110000000Z)'
+    with pytest.raises(ValueError):
+        backup.changes_filter({'csn': {}})
@@ -0,0 +1,168 @@
+"""Sync session events and saved state from encoded RFC 4533 messages"""
+
+import uuid
+
+import pytest
+from pyasn1.codec.ber import encoder
+
+from change_feed import (E_SYNC_REFRESH_REQUIRED, SYNC_DONE_OID, SYNC_INFO_OID, SYNC_STATE_OID,
+                         ChangeFeed, SyncDoneValue, SyncInfoValue, SyncRefreshRequired,
+                         SyncStateValue, _SyncSession, decode_sync_info)
+
+BASE_DN = 'dc=college,dc=local'
+ALICE, BOB, CAROL, DAVE = (str(uuid.uuid4()) for _ in range(4))
+
+
+def dn(uid):
+    return f'uid={uid},ou=People,{BASE_DN}'
+
+
+def entry(state, entry_uuid, dn, cookie=None, **attributes):
+    value = SyncStateValue()
+    value['state'] = state
+    value['entryUUID'] = uuid.UUID(entry_uuid).bytes
+    if cookie:
+        value['cookie'] = cookie
+    return {'type': 'searchResEntry', 'dn': dn, 'attributes': attributes,
+            'controls': {SYNC_STATE_OID: {'value': encoder.encode(value)}}}
+
+
+def info(kind, cookie=None, uuids=None, **flags):
+    value = SyncInfoValue()
+    if kind == 'newcookie':
+        value['newcookie'] = cookie
+    else:
+        component = value.getComponentByName(kind)
+        if cookie:
+            component['cookie'] = cookie
+        for name, flag in flags.items():
+            component[name] = flag
+        if kind == 'syncIdSet':
+            component['syncUUIDs'].extend([uuid.UUID(entry_uuid).bytes for entry_uuid in uuids])
+    return {'type': 'intermediateResponse', 'responseName': SYNC_INFO_OID,
+            'responseValue': encoder.encode(value)}
+
+
+def done(result=0, cookie=None):
+    value = SyncDoneValue()
+    if cookie:
+        value['cookie'] = cookie
+    return {'type': 'searchResDone', 'result': result, 'description': 'x', 'message': '',
+            'controls': {SYNC_DONE_OID: {'value': encoder.encode(value)}}}
+
+
+def run(session, responses):
+    """Events of each response, dispatched as ChangeFeed._follow does"""
+    events = []
+    for response in responses:
+        handle = {'searchResEntry': session.entry, 'intermediateResponse': session.info,
+                  'searchResDone': session.done}[response['type']]
+        events.extend(handle(response))
+    return [(event['action'], event['dn']) for event in events]
+
+
+@pytest.fixture
+def feed():
+    return ChangeFeed('ldap://localhost', '', '', BASE_DN, ['*'])
+
+
+def resumed(feed):
+    """A session resuming from cookie b'c1' with Alice, Bob and Carol known"""
+    feed._cookie = b'c1'
+    feed._uuids = {ALICE: dn('alice'), BOB: dn('bob'), CAROL: dn('carol')}
+    return _SyncSession(*feed._load_state())
+
+
+def test_decode_sync_id_set():
+    decoded = decode_sync_info(info('syncIdSet', b'c2', [ALICE, BOB], refreshDeletes=True)['responseValue'])
+    assert decoded['kind'] == 'syncIdSet'
+    assert decoded['cookie'] == b'c2'
+    assert decoded['refresh_deletes'] is True
+    assert sorted(decoded['uuids']) == sorted([ALICE, BOB])
+
+
+def test_baseline_refresh_reports_a_single_resync(feed):
+    feed._uuids = {DAVE: dn('dave')}
+    session = _SyncSession(*feed._load_state())
+    events = run(session, [
+        entry('add', ALICE, dn('alice'), mail='a@x'),
+        entry('add', BOB, dn('bob')),
+        info('refreshDelete', b'c1', refreshDone=True),
+    ])
+    feed._save_state(session)
+    assert events == [('resync', None)]
+    assert feed._cookie == b'c1'
+    # A UUID left by an older session is forgotten
+    assert feed._uuids == {ALICE: dn('alice'), BOB: dn('bob')}
+
+
+def test_refresh_delete(feed):
+    session = resumed(feed)
+    events = run(session, [
+        entry('delete', ALICE, dn('alice')),
+        entry('modify', BOB, dn('bob'), mail='b@x'),
+        info('refreshDelete', b'c2', refreshDone=True),
+        entry('add', DAVE, dn('dave'), cookie=b'c3'),
+    ])
+    feed._save_state(session)
+    assert events == [('delete', dn('alice')), ('modify', dn('bob')), ('add', dn('dave'))]
+    assert feed._cookie == b'c3'
+    assert feed._uuids == {BOB: dn('bob'), CAROL: dn('carol'), DAVE: dn('dave')}
+
+
+def test_refresh_present_deletes_what_was_not_listed(feed):
+    session = resumed(feed)
+    events = run(session, [
+        entry('present', ALICE, dn('alice')),
+        entry('modify', BOB, dn('robert')),
+        info('refreshPresent', b'c2', refreshDone=True),
+    ])
+    feed._save_state(session)
+    assert events == [('rename', dn('robert')), ('delete', dn('carol'))]
+    assert feed._cookie == b'c2'
+    assert feed._uuids == {ALICE: dn('alice'), BOB: dn('robert')}
+
+
+def test_sync_id_set_of_present_entries(feed):
+    session = resumed(feed)
+    events = run(session, [
+        info('syncIdSet', None, [ALICE, CAROL]),
+        info('refreshPresent', b'c2', refreshDone=True),
+    ])
+    feed._save_state(session)
+    assert events == [('delete', dn('bob'))]
+    assert feed._uuids == {ALICE: dn('alice'), CAROL: dn('carol')}
+
+
+def test_sync_id_set_with_refresh_deletes(feed):
+    session = resumed(feed)
+    events = run(session, [
+        info('syncIdSet', b'c2', [ALICE, DAVE], refreshDeletes=True),
+        info('refreshDelete', refreshDone=True),
+        info('newcookie', b'c3'),
+    ])
+    feed._save_state(session)
+    # Dave was never seen, so the scope of his delete is unknown
+    assert events == [('delete', dn('alice')), ('resync', None)]
+    assert feed._cookie == b'c3'
+    assert feed._uuids == {BOB: dn('bob'), CAROL: dn('carol')}
+
+
+def test_refresh_required(feed, monkeypatch):
+    session = resumed(feed)
+    with pytest.raises(SyncRefreshRequired):
+        session.done(done(E_SYNC_REFRESH_REQUIRED))
+
+    # The feed drops its cookie and starts the next session over
+    cookies = []
+
+    def follow():
+        cookies.append(feed._load_state()[0])
+        if len(cookies) == 1:
+            raise SyncRefreshRequired('cookie too old')
+        feed._stopping.set()
+
+    monkeypatch.setattr(feed, '_follow', follow)
+    feed._run()
+    assert cookies == [b'c1', None]
+    assert feed._uuids == {ALICE: dn('alice'), BOB: dn('bob'), CAROL: dn('carol')}
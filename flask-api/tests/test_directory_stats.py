@@ -0,0 +1,38 @@
+"""Writes submitted to the statistics never wait on Redis"""
+
+import json
+from unittest import mock
+
+import pytest
+
+from directory_stats import DirectoryStats
+
+DN = 'uid=a,ou=People,dc=college,dc=local'
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = DirectoryStats('dc=college,dc=local', connection=None, redis_client=mock.MagicMock())
+    monkeypatch.setattr(stats, '_ensure_started', lambda: None)
+    return stats
+
+
+def test_non_refresher_queues_without_redis(stats):
+    stats.entry_deleted(DN)
+    stats.record_activity('delete')
+    assert stats.redis_client.method_calls == []
+
+    stats._send_outbox()
+    pipe = stats.redis_client.pipeline.return_value
+    pushed = pipe.rpush.call_args.args
+    assert pushed[0] == stats.inbox_key
+    assert [json.loads(message)['op'] for message in pushed[1:]] == ['delete', 'activity']
+    pipe.execute.assert_called_once_with()
+
+
+def test_outbox_is_applied_here_after_taking_the_lead(stats):
+    stats.entry_changed(DN, {'ou': ['People'], 'objectClass': ['person']})
+    stats._leading.set()
+    stats._send_outbox()
+    assert stats.redis_client.pipeline.call_count == 0
+    assert stats.snapshot()['total_entries'] == 1
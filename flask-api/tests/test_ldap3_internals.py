@@ -0,0 +1,63 @@
+"""The ldap3 behaviour change_feed and aio_ldap rely on. The change feed
+uses ldap3's persistent search callback; aio_ldap wraps the ASYNC
+strategy's receiver hooks, which are not a public API. If ldap3 is
+upgraded and these fail, re-check both modules before moving the pin."""
+
+import inspect
+import os
+import re
+
+import ldap3
+from ldap3.strategy.asynchronous import AsyncStrategy
+
+from change_feed import SYNC_REQUEST_OID, sync_request_control
+
+PERSISTENT_SEARCH_OID = '2.16.840.1.113730.3.4.3'
+
+
+def pinned_version(package):
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'requirements.txt')
+    with open(path, encoding='utf-8') as f:
+        return re.search(rf'^{package}==(\S+)$', f.read(), re.M).group(1)
+
+
+def test_ldap3_is_the_pinned_version():
+    assert ldap3.__version__ == pinned_version('ldap3')
+
+
+def test_receiver_calls_the_hooks_aio_ldap_wraps():
+    receiver = inspect.getsource(AsyncStrategy.ReceiverSocketThread.run)
+    assert 'self.connection.strategy.set_event_for_message(message_id)' in receiver
+    assert 'self.connection.strategy.close()' in receiver
+    assert 'self.connection.strategy.accumulate_stream(message_id, dict_response)' in receiver
+    assert list(inspect.signature(AsyncStrategy.set_event_for_message).parameters) == ['self', 'message_id']
+    assert list(inspect.signature(AsyncStrategy.close).parameters) == ['self']
+
+
+def test_persistent_search_hands_every_message_to_the_callback(monkeypatch):
+    conn = ldap3.Connection(ldap3.Server('ldap://127.0.0.1:1'), client_strategy=ldap3.ASYNC_STREAM)
+    sent = {}
+
+    def search(**kwargs):
+        sent.update(kwargs)
+        return 7
+
+    monkeypatch.setattr(conn, 'search', search)
+    conn.bound = True
+    conn.strategy._responses = {}
+    received = []
+    conn.extend.standard.persistent_search('dc=college,dc=local', '(objectClass=*)', ldap3.SUBTREE,
+                                           attributes=['cn'], controls=[sync_request_control()],
+                                           notifications=False, callback=received.append)
+    # Only the sync request goes out, not ldap3's own persistent search control
+    assert [str(control[0]) for control in sent['controls']] == [SYNC_REQUEST_OID]
+    assert PERSISTENT_SEARCH_OID not in str(sent['controls'])
+
+    # What the receiver thread does with each message of the search
+    for message in ({'type': 'searchResEntry', 'dn': 'cn=a'}, {'type': 'intermediateResponse'},
+                    {'type': 'searchResDone', 'result': 0}):
+        conn.strategy._responses[7] = [message]
+        conn.strategy.accumulate_stream(7, message)
+        assert conn.strategy._responses[7] == []
+    assert [message['type'] for message in received] == ['searchResEntry', 'intermediateResponse',
+                                                          'searchResDone']
@@ -0,0 +1,49 @@
+"""Batch results when an operation raises partway through"""
+
+import ldap3
+import pytest
+from ldap3.core.exceptions import LDAPCommunicationError
+
+from ldap_batch import batch_results, parse_operations, run_operations
+
+BASE_DN = 'dc=college,dc=local'
+
+
+@pytest.fixture
+def conn():
+    conn = ldap3.Connection(ldap3.Server('mock'), client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(BASE_DN, {'objectClass': ['domain'], 'dc': 'college'})
+    conn.strategy.add_entry(f'uid=old,{BASE_DN}', {'objectClass': ['person'], 'uid': 'old', 'sn': 'o', 'cn': 'o'})
+    conn.bind()
+    return conn
+
+
+def operations():
+    return parse_operations([
+        {'op': 'add', 'dn': f'uid=a,{BASE_DN}', 'attributes': {'objectClass': ['person'], 'sn': 'a', 'cn': 'a'}},
+        {'op': 'delete', 'dn': f'uid=old,{BASE_DN}'},
+        {'op': 'add', 'dn': f'uid=b,{BASE_DN}', 'attributes': {'objectClass': ['person'], 'sn': 'b', 'cn': 'b'}},
+    ], 10)
+
+
+def drop_connection_on_delete(conn, monkeypatch):
+    def delete(dn, controls=None):
+        raise LDAPCommunicationError('connection reset')
+    monkeypatch.setattr(conn, 'delete', delete)
+
+
+def test_results_survive_a_dropped_connection(conn, monkeypatch):
+    ops = operations()
+    results = batch_results(ops)
+    drop_connection_on_delete(conn, monkeypatch)
+    with pytest.raises(LDAPCommunicationError):
+        run_operations(conn, ops, results=results)
+    assert [result['status'] for result in results] == ['success', 'error', 'skipped']
+    assert results[1]['error'] == 'connection reset'
+    assert 'uid' in {attr.lower() for attr in results[1]['old_attributes']}
+
+
+def test_all_successful(conn):
+    results, applied = run_operations(conn, operations())
+    assert applied
+    assert [result['status'] for result in results] == ['success'] * 3
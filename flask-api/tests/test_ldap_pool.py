@@ -0,0 +1,77 @@
+"""Checkout waits, wake-ups and timeouts of the LDAP connection pool"""
+
+import threading
+import time
+
+import ldap3
+import pytest
+
+from ldap_pool import LDAPConnectionPool
+
+
+def mock_connection():
+    conn = ldap3.Connection(ldap3.Server('mock'), client_strategy=ldap3.MOCK_SYNC)
+    conn.bind()
+    return conn
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = LDAPConnectionPool('test', 'ldap://localhost', '', '', size=1, timeout=2.0)
+    monkeypatch.setattr(pool, '_open', mock_connection)
+    return pool
+
+
+def acquire_in_thread(pool):
+    """Start acquire() in a thread; returns (thread, result) where result
+    gets the connection and how long the checkout took"""
+    result = {}
+
+    def run():
+        start = time.monotonic()
+        result['conn'] = pool.acquire()
+        result['waited'] = time.monotonic() - start
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.1)
+    return thread, result
+
+
+def test_release_wakes_a_waiter(pool):
+    conn = pool.acquire()
+    thread, result = acquire_in_thread(pool)
+    pool.release(conn)
+    thread.join()
+    assert result['conn'] is conn
+    assert result['waited'] < 1.0
+
+
+def test_discarding_a_broken_connection_wakes_a_waiter(pool):
+    conn = pool.acquire()
+    thread, result = acquire_in_thread(pool)
+    pool.release(conn, broken=True)
+    thread.join()
+    assert result['conn'] is not None and result['conn'] is not conn
+    assert result['waited'] < 1.0
+
+
+def test_unhealthy_idle_connection_is_replaced(pool, monkeypatch):
+    conn = pool.acquire()
+    pool.release(conn)
+    monkeypatch.setattr(pool, '_is_healthy', lambda conn, idle_for: False)
+    replacement = pool.acquire()
+    assert replacement is not None and replacement is not conn
+    assert pool._open_count == 1
+
+
+def test_exhausted_pool_times_out(pool):
+    pool.timeout = 0.2
+    pool.acquire()
+    assert pool.acquire() is None
+
+
+def test_failed_open_frees_the_slot(pool, monkeypatch):
+    monkeypatch.setattr(pool, '_open', lambda: None)
+    assert pool.acquire() is None
+    assert pool._open_count == 0
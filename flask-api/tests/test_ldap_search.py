@@ -0,0 +1,101 @@
+"""Paged search cursors taken over by another worker"""
+
+import ldap3
+import pytest
+
+from ldap_search import PagedSearchCursors
+
+BASE_DN = 'ou=People,dc=college,dc=local'
+OWNER = 'admin'
+
+
+class SharedState:
+    """The bit of Redis the cursors use"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class Directory:
+    """Entries of one LDAP server, and MOCK_SYNC connections to it"""
+
+    def __init__(self, count):
+        self.dns = [f'uid=u{i:02},{BASE_DN}' for i in range(count)]
+        self.servers = []
+
+    def connect(self, server_name):
+        self.servers.append(server_name)
+        conn = ldap3.Connection(ldap3.Server(server_name), client_strategy=ldap3.MOCK_SYNC)
+        conn.strategy.add_entry(BASE_DN, {'objectClass': ['organizationalUnit'], 'ou': 'People'})
+        for dn in self.dns:
+            uid = dn.split(',', 1)[0][4:]
+            conn.strategy.add_entry(dn, {'objectClass': ['inetOrgPerson'], 'uid': uid, 'cn': uid, 'sn': uid})
+        conn.bind()
+        return conn
+
+
+@pytest.fixture
+def directory():
+    return Directory(10)
+
+
+@pytest.fixture
+def workers(directory):
+    shared = SharedState()
+    workers = [PagedSearchCursors(redis_client=shared, connect=directory.connect) for _ in range(2)]
+    for worker in workers:
+        worker._ensure_started = lambda: None
+    return workers
+
+
+def start(worker, directory):
+    return worker.start(directory.connect('ldap://replica1:389'), OWNER, BASE_DN,
+                        '(objectClass=inetOrgPerson)', ['uid'], page_size=3)
+
+
+def page_through(workers, cookie, seen):
+    """Follow cookie to the end, alternating workers"""
+    turn = 1
+    while cookie:
+        results, cookie = workers[turn].next(cookie, OWNER)
+        seen.extend(entry['dn'] for entry in results)
+        turn = 1 - turn
+    return seen
+
+
+def test_pages_alternating_between_workers_return_each_entry_once(workers, directory):
+    results, cookie = start(workers[0], directory)
+    seen = page_through(workers, cookie, [entry['dn'] for entry in results])
+    assert sorted(seen) == directory.dns
+    # Every takeover went back to the server the search started on
+    assert set(directory.servers) == {'ldap://replica1:389'}
+
+
+def test_takeover_after_an_earlier_entry_was_deleted(workers, directory):
+    results, cookie = start(workers[0], directory)
+    seen = [entry['dn'] for entry in results]
+    directory.dns.remove(seen[0])
+    seen = page_through(workers, cookie, seen)
+    assert sorted(seen[1:]) == directory.dns
+
+
+def test_takeover_after_the_last_returned_entry_was_deleted_expires(workers, directory):
+    results, cookie = start(workers[0], directory)
+    directory.dns.remove(results[-1]['dn'])
+    with pytest.raises(KeyError):
+        workers[1].next(cookie, OWNER)
+
+
+def test_other_users_cannot_take_over(workers, directory):
+    _, cookie = start(workers[0], directory)
+    with pytest.raises(KeyError):
+        workers[1].next(cookie, 'someone-else')
@@ -0,0 +1,30 @@
+"""DN normalization and compiled policy lookups"""
+
+import pytest
+
+from rbac import CompiledPolicy, normalize_dn
+
+
+@pytest.mark.parametrize('dn', [
+    'cn=Smith\\2C John,ou=People,dc=college,dc=local',
+    'cn=Smith\\2c John,ou=People,dc=college,dc=local',
+    'CN=Smith\\, John, OU=People, DC=college, DC=local',
+    'cn="Smith, John",ou=People,dc=college,dc=local',
+])
+def test_escaped_values_normalize_alike(dn):
+    assert normalize_dn(dn) == ('dc=local', 'dc=college', 'ou=people', 'cn=smith\\, john')
+
+
+def test_utf8_hex_escapes_decode():
+    assert normalize_dn('cn=Caf\\C3\\A9,dc=local') == normalize_dn('cn=café,dc=local')
+
+
+def test_escaped_trailing_space_is_kept():
+    assert normalize_dn('cn=a\\ ,dc=local') != normalize_dn('cn=a,dc=local')
+
+
+def test_grant_matches_differently_escaped_dn():
+    policy = CompiledPolicy({'faculty': {'ou=Arts\\2C Music,dc=college,dc=local': ['read']}})
+    assert policy.is_allowed('faculty', 'uid=x,ou=arts\\, music,dc=college,dc=local', 'read')
+    assert not policy.is_allowed('faculty', 'uid=x,ou=arts,dc=college,dc=local', 'read')
+    assert policy.granted_bases('faculty', 'read') == ['ou=arts\\, music,dc=college,dc=local']
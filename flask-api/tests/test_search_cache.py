@@ -0,0 +1,212 @@
+"""Search result cache: invalidation by branch, across workers, and cache
+fills racing replication"""
+
+import queue
+import time
+from datetime import datetime, timedelta
+
+import ldap3
+import pytest
+
+from ldap_pool import LDAPConnectionPool
+from read_router import ReadRouter
+from replication import format_csn
+from search_cache import SearchCache
+
+SUFFIX = 'dc=college,dc=local'
+PEOPLE = 'ou=People,dc=college,dc=local'
+GROUPS = 'ou=Groups,dc=college,dc=local'
+USER = 'uid=alice,ou=People,dc=college,dc=local'
+
+
+class FakeRedis:
+    """The Redis commands SearchCache uses, pub/sub included"""
+
+    def __init__(self):
+        self.values = {}
+        self.subscribers = []
+
+    def pipeline(self, transaction=True):
+        redis = self
+        calls = []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                def queue_call(*args, **kwargs):
+                    calls.append((name, args, kwargs))
+                    return self
+                return queue_call
+
+            def execute(self):
+                return [getattr(redis, name)(*args, **kwargs) for name, args, kwargs in calls]
+
+        return Pipeline()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    def sadd(self, key, *members):
+        self.values.setdefault(key, set()).update(members)
+
+    def srem(self, key, *members):
+        self.values.get(key, set()).difference_update(members)
+
+    def smembers(self, key):
+        return set(self.values.get(key, set()))
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def publish(self, channel, data):
+        for messages in self.subscribers:
+            messages.put({'type': 'message', 'data': data.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        redis = self
+        messages = queue.Queue()
+
+        class PubSub:
+            def subscribe(self, channel):
+                redis.subscribers.append(messages)
+
+            def get_message(self, timeout):
+                try:
+                    return messages.get(timeout=timeout)
+                except queue.Empty:
+                    return None
+
+            def close(self):
+                redis.subscribers.remove(messages)
+
+        return PubSub()
+
+
+def cache_search(cache, base_dn, body=b'[]'):
+    key = cache.key(base_dn, 'subtree', '(objectClass=*)', ['cn'], ['dc=college,dc=local'])
+    cache.set(*key, body, cache.generation())
+    return key
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_invalidation_drops_ancestors_and_descendants_only():
+    cache = SearchCache()
+    suffix, people, groups, user = (cache_search(cache, dn) for dn in (SUFFIX, PEOPLE, GROUPS, USER))
+    cache.invalidate(USER)
+    assert cache.get(*suffix) is None
+    assert cache.get(*people) is None
+    assert cache.get(*user) is None
+    assert cache.get(*groups) == b'[]'
+
+
+def test_results_read_before_an_invalidation_are_not_stored():
+    cache = SearchCache()
+    key = cache.key(PEOPLE, 'subtree', '(uid=alice)', ['cn'], [SUFFIX])
+    generation = cache.generation()
+    cache.invalidate(USER)
+    cache.set(*key, b'[]', generation)
+    assert cache.get(*key) is None
+
+
+def test_invalidation_reaches_redis_and_other_workers():
+    redis = FakeRedis()
+    workers = [SearchCache(redis_client=redis) for _ in range(2)]
+    for worker in workers:
+        worker._ensure_started()
+    assert wait_for(lambda: len(redis.subscribers) == 2)
+    try:
+        people, groups = cache_search(workers[1], PEOPLE), cache_search(workers[1], GROUPS)
+        workers[0].invalidate(USER)
+        assert redis.get(workers[0]._value_key(people[1])) is None
+        assert redis.get(workers[0]._value_key(groups[1])) == b'[]'
+        assert wait_for(lambda: workers[1]._get_local(people[1]) is None)
+        assert workers[1]._get_local(groups[1]) == b'[]'
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+class Server:
+    """Entries and contextCSN of one LDAP server, reachable through a pool"""
+
+    def __init__(self, name, monkeypatch):
+        self.base = ldap3.Connection(ldap3.Server(name), client_strategy=ldap3.MOCK_SYNC)
+        self.base.strategy.add_entry(SUFFIX, {'objectClass': ['domain'], 'dc': 'college'})
+        self.base.strategy.add_entry(USER, {'objectClass': ['inetOrgPerson'], 'uid': 'alice',
+                                            'cn': 'alice', 'sn': 'Old'})
+        self.base.bind()
+        self.pool = LDAPConnectionPool(name, f'ldap://{name}', '', '', size=2, timeout=1.0)
+        monkeypatch.setattr(self.pool, '_open', self.connect)
+
+    def connect(self):
+        conn = ldap3.Connection(self.base.server, client_strategy=ldap3.MOCK_SYNC)
+        conn.strategy.entries = self.base.strategy.entries
+        conn.bind()
+        return conn
+
+    def write(self, sn, csn):
+        self.base.modify(USER, {'sn': [(ldap3.MODIFY_REPLACE, [sn])]})
+        self.base.modify(SUFFIX, {'contextCSN': [(ldap3.MODIFY_REPLACE, [csn])]})
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    master, replica = Server('master', monkeypatch), Server('replica', monkeypatch)
+    before = format_csn(datetime(2026, 1, 1), sid=1)
+    master.write('Old', before)
+    replica.write('Old', before)
+    router = ReadRouter([replica.pool], master.pool, SUFFIX, max_lag=None)
+    monkeypatch.setattr(router, '_ensure_started', lambda: None)
+    router.probe()
+    return master, replica, router
+
+
+def fill(cache, router, key):
+    """What /search does on a cache miss"""
+    generation = cache.generation()
+
+    def run_search(conn):
+        conn.search(USER, '(objectClass=*)', ldap3.BASE, attributes=['sn'])
+        return conn.response[0]['attributes']['sn'][0].encode()
+
+    body = router.execute(run_search, router.fill_eligibility(cache.invalidated_at()))
+    cache.set(*key, body, generation)
+    return body
+
+
+def test_lagging_replica_does_not_refill_an_invalidated_search(servers):
+    master, replica, router = servers
+    cache = SearchCache()
+    key = cache.key(USER, 'subtree', '(objectClass=*)', ['sn'], [SUFFIX])
+    assert fill(cache, router, key) == b'Old'
+
+    # Written on the master; the replica has not replicated it yet
+    master.write('New', format_csn(datetime(2026, 1, 1) + timedelta(seconds=1), sid=1))
+    cache.invalidate(USER)
+    assert cache.get(*key) is None
+    assert fill(cache, router, key) == b'New'
+    assert cache.get(*key) == b'New'
+
+    # Still lagging after the next probe: fills keep away from it
+    cache.invalidate(USER)
+    router.probe()
+    assert fill(cache, router, key) == b'New'
+
+    # Caught up: the replica serves fills again
+    replica.write('Newer', format_csn(datetime(2026, 1, 1) + timedelta(seconds=1), sid=1))
+    router.probe()
+    cache.invalidate(USER)
+    router.probe()
+    assert fill(cache, router, key) == b'Newer'
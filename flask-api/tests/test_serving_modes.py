@@ -0,0 +1,173 @@
+"""The Flask routes and their asgi_app counterparts answer alike"""
+
+import os
+import time
+from datetime import timedelta
+
+os.environ.update(SOCKETIO_MESSAGE_QUEUE='', CHANGE_FEED_ENABLED='false', SEARCH_CACHE_ENABLED='false',
+                  REDIS_URL='redis://127.0.0.1:1/0')
+
+import pytest
+from flask_jwt_extended import create_access_token, create_refresh_token
+from starlette.testclient import TestClient
+
+import app as flask_api
+import asgi_app
+
+ROLES = {'uid=admin,dc=college,dc=local': 'admin', 'uid=s1,ou=Students,dc=college,dc=local': 'student'}
+ADMIN, STUDENT = ROLES
+
+
+@pytest.fixture(scope='module', autouse=True)
+def offline(request):
+    """No Redis, LDAP or rate limits: only the request handling runs"""
+    patch = pytest.MonkeyPatch()
+    flask_api.limiter.enabled = False
+    patch.setattr(flask_api.role_cache, 'redis_client', None)
+    patch.setattr(flask_api, 'get_user_role', ROLES.get)
+
+    async def get_user_role(user_dn):
+        return ROLES.get(user_dn)
+
+    async def no_limit(*args, **kwargs):
+        return 1
+
+    patch.setattr(asgi_app, 'get_user_role', get_user_role)
+    patch.setattr(asgi_app.redis_client, 'incr', no_limit)
+    patch.setattr(asgi_app.redis_client, 'expire', no_limit)
+    yield
+    patch.undo()
+
+
+def token(identity, **kwargs):
+    with flask_api.app.app_context():
+        return create_access_token(identity=identity, **kwargs)
+
+
+def bearer(value):
+    return {'Authorization': f'Bearer {value}'}
+
+
+def call(client, method, path, headers=None, json=None):
+    response = client.open(path, method=method, headers=headers, json=json) if hasattr(client, 'open') \
+        else client.request(method, path, headers=headers, json=json)
+    body = response.get_json() if hasattr(response, 'get_json') else response.json()
+    return response.status_code, body
+
+
+def both(method, path, headers=None, json=None):
+    """(status, body) from the Flask app and from asgi_app, which must agree"""
+    flask_result = call(flask_api.app.test_client(), method, path, headers, json)
+    asgi_result = call(TestClient(asgi_app.app), method, path, headers, json)
+    assert flask_result == asgi_result
+    return flask_result
+
+
+ROUTES = [
+    ('POST', '/search', {'filter': '(uid=x)'}),
+    ('GET', '/tree', None),
+    ('POST', '/add_user', {'cn': 'x'}),
+    ('PUT', '/modify_user', {'dn': 'uid=x,dc=college,dc=local', 'modifications': {'mail': 'x@y'}}),
+    ('DELETE', '/delete_user', {'dn': 'uid=x,dc=college,dc=local'}),
+]
+
+
+@pytest.mark.parametrize('method,path,body', ROUTES)
+def test_missing_token(method, path, body):
+    assert both(method, path, json=body) == (401, {'msg': 'Missing Authorization Header'})
+
+
+@pytest.mark.parametrize('method,path,body', ROUTES)
+def test_wrong_scheme(method, path, body):
+    status, _ = both(method, path, {'Authorization': 'Token abc'}, body)
+    assert status == 401
+
+
+@pytest.mark.parametrize('method,path,body', ROUTES)
+@pytest.mark.parametrize('value', ['not-a-jwt', 'two parts'])
+def test_malformed_token(method, path, body, value):
+    status, _ = both(method, path, bearer(value), body)
+    assert status == 422
+
+
+@pytest.mark.parametrize('method,path,body', ROUTES)
+def test_expired_token(method, path, body):
+    expired = token(ADMIN, expires_delta=timedelta(seconds=-1))
+    assert both(method, path, bearer(expired), body) == (401, {'msg': 'Token has expired'})
+
+
+@pytest.mark.parametrize('method,path,body', ROUTES)
+def test_refresh_token_is_not_an_access_token(method, path, body):
+    with flask_api.app.app_context():
+        refresh = create_refresh_token(identity=ADMIN)
+    assert both(method, path, bearer(refresh), body) == (422, {'msg': 'Only non-refresh tokens are allowed'})
+
+
+def test_wrong_signature():
+    forged = token(ADMIN)[:-4] + 'AAAA'
+    status, body = both('POST', '/search', bearer(forged), {})
+    assert status == 422 and body['msg']
+
+
+@pytest.mark.parametrize('method,path,body', [
+    ('POST', '/add_user', {'cn': 'x'}),
+    ('DELETE', '/delete_user', {'dn': 'uid=x,dc=college,dc=local'}),
+    ('PUT', '/modify_user', {'dn': 'uid=other,ou=Students,dc=college,dc=local', 'modifications': {'mail': 'x'}}),
+])
+def test_forbidden_for_student(method, path, body):
+    assert both(method, path, bearer(token(STUDENT)), body) == (403, {'error': 'Insufficient permissions'})
+
+
+@pytest.mark.parametrize('page_size', ['abc', 2.5, [10], {'n': 1}])
+def test_search_rejects_bad_page_size(page_size):
+    body = {'filter': '(uid=x)', 'page_size': page_size}
+    assert both('POST', '/search', bearer(token(STUDENT)), body) == (400, {'error': 'page_size must be an integer'})
+
+
+@pytest.mark.parametrize('page_size', ['abc', '2.5', ''])
+def test_tree_rejects_bad_page_size(page_size):
+    assert both('GET', f'/tree?page_size={page_size}', bearer(token(STUDENT))) == \
+        (400, {'error': 'page_size must be an integer'})
+
+
+def test_search_rejects_bad_consistency_token():
+    status, body = both('POST', '/search', bearer(token(STUDENT)), {'consistency_token': 'garbage'})
+    assert status == 400 and body['error'].startswith('Invalid consistency token')
+
+
+@pytest.mark.parametrize('method,path', [('POST', '/search'), ('PUT', '/modify_user'), ('DELETE', '/delete_user')])
+def test_body_must_be_a_json_object(method, path):
+    assert both(method, path, bearer(token(ADMIN)), ['not', 'an', 'object']) == \
+        (400, {'error': 'Request body must be a JSON object'})
+
+
+@pytest.mark.parametrize('method,path,body', [
+    ('DELETE', '/delete_user', {}),
+    ('PUT', '/modify_user', {'modifications': {'mail': 'x'}}),
+])
+def test_dn_required(method, path, body):
+    assert both(method, path, bearer(token(ADMIN)), body) == (400, {'error': 'DN required'})
+
+
+def test_modifications_must_be_an_object():
+    body = {'dn': ADMIN, 'modifications': ['mail']}
+    assert both('PUT', '/modify_user', bearer(token(ADMIN)), body) == \
+        (400, {'error': 'modifications must be an object'})
+
+
+def test_unknown_cookie():
+    body = {'cookie': 'no-such-cursor'}
+    patch = pytest.MonkeyPatch()
+    patch.setattr(flask_api.search_cursors, 'redis_client', None)
+    try:
+        assert both('POST', '/search', bearer(token(STUDENT)), body) == (400, {'error': 'Invalid or expired cookie'})
+    finally:
+        patch.undo()
+
+
+def test_stats_answer_before_the_first_count():
+    started = time.monotonic()
+    status, body = both('GET', '/stats', bearer(token(ADMIN)))
+    assert status == 200
+    assert body['stale'] is True
+    assert time.monotonic() - started < 1.0
@@ -10,6 +10,8 @@ function AuditLogs() {
   const [loading, setLoading] = useState(true);
   const [page, setPage] = useState(0);
   const [limit] = useState(50);
+  // cursors[n] is the keyset cursor that starts page n
+  const [cursors, setCursors] = useState(['']);
 
   useEffect(() => {
     loadLogs();
@@ -17,11 +19,17 @@ function AuditLogs() {
 
   const loadLogs = async () => {
     try {
+      const cursor = cursors[page] ? `&cursor=${encodeURIComponent(cursors[page])}` : '';
       const response = await axios.get(
-        `${API_URL}/audit_logs?limit=${limit}&offset=${page * limit}`,
+        `${API_URL}/audit_logs?limit=${limit}${cursor}`,
         { headers: { Authorization: `Bearer ${token}` } }
       );
       setLogs(response.data.logs);
+      const nextCursors = cursors.slice(0, page + 1);
+      if (response.data.next_cursor) {
+        nextCursors.push(response.data.next_cursor);
+      }
+      setCursors(nextCursors);
     } catch (error) {
       console.error('Error loading audit logs:', error);
     } finally {
@@ -111,7 +119,7 @@ function AuditLogs() {
         <span className="text-gray-700 dark:text-gray-300">Page {page + 1}</span>
         <button
           onClick={() => setPage(page + 1)}
-          disabled={logs.length < limit}
+          disabled={cursors.length <= page + 1}
           className="px-4 py-2 bg-gray-600 text-white rounded hover:bg-gray-700 disabled:opacity-50"
         >
           Next
@@ -23,12 +23,21 @@ function Dashboard() {
     fetchRecentActivity();
     
     // Set up WebSocket connection
+    // Updates are scoped to the subtrees this token may read
     const socket = io(WS_URL, {
-      transports: ['websocket', 'polling']
+      transports: ['websocket', 'polling'],
+      auth: { token }
     });
 
     socket.on('ldap_update', (data) => {
-      setRecentActivity(prev => [data, ...prev].slice(0, 10));
+      // Bursts of changes arrive coalesced into a single batch event
+      const operations = data.action === 'batch' ? data.operations : [data];
+      const activity = operations.map(op => ({
+        action: op.action,
+        target_dn: op.dn,
+        timestamp: data.timestamp
+      })).reverse();
+      setRecentActivity(prev => [...activity, ...prev].slice(0, 10));
       fetchStats(); // Refresh stats on update
     });
 
@@ -43,30 +52,12 @@ function Dashboard() {
 
   const fetchStats = async () => {
     try {
-      // Get total users
-      const allUsers = await axios.post(
-        `${API_URL}/search`,
-        { filter: '(objectClass=person)' },
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-
-      const students = await axios.post(
-        `${API_URL}/search`,
-        { filter: '(objectClass=studentEntry)' },
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-
-      const faculty = await axios.post(
-        `${API_URL}/search`,
-        { filter: '(objectClass=facultyMember)' },
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-
-      const staff = await axios.post(
-        `${API_URL}/search`,
-        { filter: '(objectClass=staffEntry)' },
+      // Counts are precomputed server-side
+      const directoryStats = await axios.get(
+        `${API_URL}/stats`,
         { headers: { Authorization: `Bearer ${token}` } }
       );
+      const byClass = directoryStats.data.by_object_class || {};
 
       // Get replica status
       const replicaStatus = await axios.get(
@@ -75,10 +66,10 @@ function Dashboard() {
       );
 
       setStats({
-        totalUsers: allUsers.data.count,
-        students: students.data.count,
-        faculty: faculty.data.count,
-        staff: staff.data.count,
+        totalUsers: byClass.person || 0,
+        students: byClass.studentEntry || 0,
+        faculty: byClass.facultyMember || 0,
+        staff: byClass.staffEntry || 0,
         replicaStatus: replicaStatus.data.sync_status
       });
     } catch (error) {
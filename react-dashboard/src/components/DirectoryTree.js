@@ -3,60 +3,49 @@ import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
+const ROOT_DN = 'dc=college,dc=local';
 
 function DirectoryTree() {
   const { token } = useAuth();
-  const [tree, setTree] = useState({});
-  const [expanded, setExpanded] = useState(new Set(['dc=college,dc=local']));
+  // dn -> { children: [...], cookie, loading }
+  const [nodes, setNodes] = useState({});
+  const [expanded, setExpanded] = useState(new Set([ROOT_DN]));
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     loadDirectoryTree();
   }, []);
 
-  const loadDirectoryTree = async () => {
+  const loadChildren = async (dn, cookie = null) => {
+    setNodes(prev => ({ ...prev, [dn]: { ...(prev[dn] || { children: [] }), loading: true } }));
     try {
-      const response = await axios.post(
-        `${API_URL}/search`,
-        {
-          base_dn: 'dc=college,dc=local',
-          filter: '(objectClass=*)',
-          attributes: ['objectClass', 'cn', 'ou', 'dc', 'dn']
-        },
-        { headers: { Authorization: `Bearer ${token}` } }
-      );
-
-      const treeData = buildTree(response.data.results);
-      setTree(treeData);
+      const params = { dn };
+      if (cookie) {
+        params.cookie = cookie;
+      }
+      const response = await axios.get(`${API_URL}/tree`, {
+        params,
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setNodes(prev => ({
+        ...prev,
+        [dn]: {
+          children: [...(cookie && prev[dn] ? prev[dn].children : []), ...response.data.children],
+          cookie: response.data.cookie,
+          loading: false
+        }
+      }));
     } catch (error) {
       console.error('Error loading directory tree:', error);
-    } finally {
-      setLoading(false);
+      setNodes(prev => ({ ...prev, [dn]: { ...(prev[dn] || { children: [] }), loading: false } }));
     }
   };
 
-  const buildTree = (entries) => {
-    const tree = {};
-    
-    entries.forEach(entry => {
-      const dn = entry.dn;
-      const parts = dn.split(',').reverse();
-      let current = tree;
-      
-      parts.forEach((part, index) => {
-        const key = part.trim();
-        if (!current[key]) {
-          current[key] = {
-            dn: parts.slice(0, index + 1).reverse().join(','),
-            children: {},
-            entry: index === parts.length - 1 ? entry : null
-          };
-        }
-        current = current[key].children;
-      });
-    });
-    
-    return tree;
+  const loadDirectoryTree = async () => {
+    setNodes({});
+    setExpanded(new Set([ROOT_DN]));
+    await loadChildren(ROOT_DN);
+    setLoading(false);
   };
 
   const toggleExpand = (dn) => {
@@ -66,43 +55,68 @@ function DirectoryTree() {
         next.delete(dn);
       } else {
         next.add(dn);
+        if (!nodes[dn]) {
+          loadChildren(dn);
+        }
       }
       return next;
     });
   };
 
-  const renderTreeNode = (node, level = 0) => {
-    const entries = Object.entries(node);
-    
-    return entries.map(([key, value]) => {
-      const isExpanded = expanded.has(value.dn);
-      const hasChildren = Object.keys(value.children).length > 0;
-      
-      return (
-        <div key={value.dn} style={{ marginLeft: `${level * 20}px` }}>
-          <div
-            className="flex items-center py-1 hover:bg-gray-100 dark:hover:bg-gray-700 cursor-pointer"
-            onClick={() => hasChildren && toggleExpand(value.dn)}
-          >
-            {hasChildren && (
-              <span className="mr-2">{isExpanded ? '▼' : '▶'}</span>
-            )}
-            {!hasChildren && <span className="mr-2 w-4" />}
-            <span className="font-mono text-sm text-gray-700 dark:text-gray-300">
-              {key}
-            </span>
-            {value.entry && (
-              <span className="ml-2 text-xs text-gray-500 dark:text-gray-400">
-                ({value.entry.objectClass?.join(', ') || 'objectClass'})
-              </span>
-            )}
+  const renderTreeNode = (dn, level = 0) => {
+    const node = nodes[dn];
+    if (!node) {
+      return null;
+    }
+
+    return (
+      <>
+        {node.children.map((child) => {
+          const isExpanded = expanded.has(child.dn);
+          // Servers without hasSubordinates leave it null: assume expandable
+          const hasChildren = child.hasSubordinates !== false;
+
+          return (
+            <div key={child.dn} style={{ marginLeft: `${level * 20}px` }}>
+              <div
+                className="flex items-center py-1 hover:bg-gray-100 dark:hover:bg-gray-700 cursor-pointer"
+                onClick={() => hasChildren && toggleExpand(child.dn)}
+              >
+                {hasChildren && (
+                  <span className="mr-2">{isExpanded ? '▼' : '▶'}</span>
+                )}
+                {!hasChildren && <span className="mr-2 w-4" />}
+                <span className="font-mono text-sm text-gray-700 dark:text-gray-300">
+                  {child.rdn}
+                </span>
+                <span className="ml-2 text-xs text-gray-500 dark:text-gray-400">
+                  ({child.objectClass?.join(', ') || 'objectClass'})
+                  {child.numSubordinates !== null && ` · ${child.numSubordinates}`}
+                </span>
+              </div>
+              {isExpanded && hasChildren && (
+                <div>{renderTreeNode(child.dn, level + 1)}</div>
+              )}
+            </div>
+          );
+        })}
+        {node.loading && (
+          <div style={{ marginLeft: `${level * 20}px` }} className="text-xs text-gray-500 py-1">
+            Loading...
           </div>
-          {isExpanded && hasChildren && (
-            <div>{renderTreeNode(value.children, level + 1)}</div>
-          )}
-        </div>
-      );
-    });
+        )}
+        {!node.loading && node.cookie && (
+          <div style={{ marginLeft: `${level * 20}px` }}>
+            <button
+              onClick={() => loadChildren(dn, node.cookie)}
+              className="text-xs text-indigo-600 dark:text-indigo-400 py-1"
+            >
+              Load more...
+            </button>
+          </div>
+        )}
+      </>
+    );
   };
 
   if (loading) {
@@ -129,7 +143,7 @@ function DirectoryTree() {
 
       <div className="bg-white dark:bg-gray-800 rounded-lg shadow p-6">
         <div className="font-mono text-sm">
-          {renderTreeNode(tree)}
+          {renderTreeNode(ROOT_DN)}
         </div>
       </div>
     </div>
@@ -137,4 +151,3 @@ function DirectoryTree() {
 }
 
 export default DirectoryTree;
-
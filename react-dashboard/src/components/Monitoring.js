@@ -82,15 +82,15 @@ function Monitoring() {
           </h2>
           <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
             <div>
-              <p className="text-sm text-gray-600 dark:text-gray-400">Master Entries</p>
+              <p className="text-sm text-gray-600 dark:text-gray-400">Replication Lag</p>
               <p className="text-2xl font-bold text-indigo-600 dark:text-indigo-400">
-                {replicaStatus.master_entries}
+                {replicaStatus.lag === null ? 'unknown' : `${replicaStatus.lag.toFixed(1)}s`}
               </p>
             </div>
             <div>
-              <p className="text-sm text-gray-600 dark:text-gray-400">Replica Entries</p>
+              <p className="text-sm text-gray-600 dark:text-gray-400">Server IDs</p>
               <p className="text-2xl font-bold text-green-600 dark:text-green-400">
-                {replicaStatus.replica_entries}
+                {(replicaStatus.servers || []).length}
               </p>
             </div>
             <div>
@@ -106,6 +106,28 @@ function Monitoring() {
               </p>
             </div>
           </div>
+          {replicaStatus.servers && replicaStatus.servers.length > 0 && (
+            <table className="mt-4 w-full text-sm">
+              <thead>
+                <tr className="text-left text-gray-600 dark:text-gray-400">
+                  <th>Server ID</th>
+                  <th>Provider CSN</th>
+                  <th>Consumer CSN</th>
+                  <th>Lag</th>
+                </tr>
+              </thead>
+              <tbody>
+                {replicaStatus.servers.map((server) => (
+                  <tr key={server.server_id} className="font-mono text-gray-900 dark:text-white">
+                    <td>{server.server_id}</td>
+                    <td>{server.provider_csn || '-'}</td>
+                    <td>{server.consumer_csn || '-'}</td>
+                    <td>{server.lag_seconds === null ? server.status : `${server.lag_seconds.toFixed(1)}s`}</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          )}
         </div>
       )}
 